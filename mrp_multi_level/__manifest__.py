@@ -3,7 +3,7 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 {
     'name': 'MRP Multi Level',
-    'version': '11.0.3.2.3',
+    'version': '11.0.4.0.0',
     'development_status': 'Beta',
     'license': 'AGPL-3',
     'author': 'Ucamco, '
@@ -31,6 +31,9 @@
         'wizards/mrp_inventory_procure_views.xml',
         'views/mrp_inventory_views.xml',
         'wizards/mrp_multi_level_views.xml',
+        'views/mrp_run_views.xml',
+        'views/mrp_pegging_views.xml',
+        'views/mrp_inventory_procure_job_views.xml',
         'views/mrp_menuitem.xml',
         'data/mrp_multi_level_cron.xml',
         'data/mrp_area_data.xml',
@@ -0,0 +1,2 @@
+from . import mrp_export
+from . import mrp_benchmark
@@ -0,0 +1,391 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import argparse
+from collections import OrderedDict
+from datetime import date, timedelta
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+
+import odoo
+from odoo import SUPERUSER_ID, api, fields
+from odoo.cli import Command
+from odoo.tools import config
+
+from dateutil.rrule import WEEKLY
+
+from ..models.mrp_inventory import MRP_INVENTORY_INDEXES
+from ..models.mrp_move import MRP_MOVE_INDEXES
+from ..models.mrp_planned_order import MRP_PLANNED_ORDER_INDEXES
+
+_logger = logging.getLogger(__name__)
+
+# Single column indexes the MRP result tables had before 11.0.3.6.0, to
+# compare the current layout with. The runs of the results came later, the
+# current indexes on mrp_run_id are kept in both layouts.
+LEGACY_INDEXES = {
+    'mrp_move': [
+        'product_mrp_area_id', 'mrp_area_id', 'parent_product_id',
+        'production_id', 'purchase_line_id', 'purchase_order_id',
+        'stock_move_id',
+    ],
+    'mrp_inventory': ['product_mrp_area_id'],
+    'mrp_planned_order': ['product_mrp_area_id', 'mrp_area_id'],
+}
+
+# Reads of the MRP results timed after the run, by product MRP area or by
+# MRP area.
+BENCHMARK_QUERIES = [
+    ('netting_read', 'product_mrp_area', """
+        SELECT id, mrp_date, mrp_type, mrp_qty FROM mrp_move
+        WHERE product_mrp_area_id = %s AND active
+        ORDER BY mrp_date, mrp_type DESC, id
+    """),
+    ('inventory_read', 'product_mrp_area', """
+        SELECT id, date, final_on_hand_qty FROM mrp_inventory
+        WHERE product_mrp_area_id = %s AND active
+        ORDER BY date
+    """),
+    ('planned_order_read', 'product_mrp_area', """
+        SELECT id, due_date, mrp_qty FROM mrp_planned_order
+        WHERE product_mrp_area_id = %s AND active
+        ORDER BY due_date
+    """),
+    ('area_inventory_scan', 'mrp_area', """
+        SELECT product_id, date, final_on_hand_qty FROM mrp_inventory
+        WHERE mrp_area_id = %s AND active
+        ORDER BY product_id, date
+    """),
+]
+
+
+class MrpBenchmarkData(object):
+    """Synthetic catalogue for the MRP benchmark: BoM trees of ``depth``
+    levels where every manufactured product has ``fan_out`` components of
+    the next level. The products of the last level are bought."""
+
+    def __init__(self, env, args):
+        self.env = env
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.mrp_areas = env['mrp.area']
+        self.levels = []
+
+    def generate(self):
+        self._generate_mrp_areas()
+        self._generate_products()
+        self._generate_boms()
+        self._generate_product_mrp_areas()
+        self._generate_stock_moves()
+        self._generate_purchase_lines()
+        self._generate_estimates()
+        return self.mrp_areas
+
+    def _random_date(self):
+        return date.today() + timedelta(days=self.rng.randint(0, 90))
+
+    def _generate_mrp_areas(self):
+        for i in range(self.args.areas):
+            warehouse = self.env['stock.warehouse'].create({
+                'name': 'MRP Benchmark %s' % i,
+                'code': 'MB%s' % i,
+            })
+            self.mrp_areas |= self.env['mrp.area'].create({
+                'name': 'MRP Benchmark %s' % i,
+                'warehouse_id': warehouse.id,
+                'location_id': warehouse.lot_stock_id.id,
+            })
+
+    def _generate_products(self):
+        product_obj = self.env['product.product']
+        vendor = self.env['res.partner'].create({
+            'name': 'MRP Benchmark Vendor',
+            'supplier': True,
+        })
+        buy = self.env.ref('purchase.route_warehouse0_buy')
+        manufacture = self.env.ref('mrp.route_warehouse0_manufacture')
+        depth = max(self.args.depth, 1)
+        per_level = max(self.args.products // depth, 1)
+        for level in range(depth):
+            route = buy if level == depth - 1 else manufacture
+            products = product_obj
+            for i in range(per_level):
+                products |= product_obj.create({
+                    'name': 'MRP Benchmark L%s-%s' % (level, i),
+                    'default_code': 'MB-L%s-%s' % (level, i),
+                    'type': 'product',
+                    'route_ids': [(6, 0, route.ids)],
+                    'produce_delay': self.rng.randint(0, 5),
+                    'seller_ids': route == buy and [(0, 0, {
+                        'name': vendor.id,
+                        'delay': self.rng.randint(1, 10),
+                    })] or [],
+                })
+            self.levels.append(products)
+
+    def _generate_boms(self):
+        for products, components in zip(self.levels, self.levels[1:]):
+            fan_out = min(self.args.fan_out, len(components))
+            for product in products:
+                self.env['mrp.bom'].create({
+                    'product_tmpl_id': product.product_tmpl_id.id,
+                    'product_id': product.id,
+                    'product_qty': 1.0,
+                    'type': 'normal',
+                    'bom_line_ids': [(0, 0, {
+                        'product_id': component.id,
+                        'product_qty': self.rng.randint(1, 4),
+                    }) for component in self.rng.sample(
+                        list(components), fan_out)],
+                })
+
+    def _generate_product_mrp_areas(self):
+        for mrp_area in self.mrp_areas:
+            for products in self.levels:
+                for product in products:
+                    self.env['product.mrp.area'].create({
+                        'product_id': product.id,
+                        'mrp_area_id': mrp_area.id,
+                        'mrp_minimum_order_qty': self.rng.choice(
+                            [0.0, 10.0, 50.0]),
+                        'mrp_qty_multiple': self.rng.choice([1.0, 5.0]),
+                        'mrp_nbr_days': self.rng.choice([0, 0, 7]),
+                    })
+
+    def _generate_stock_moves(self):
+        customers = self.env.ref('stock.stock_location_customers')
+        moves = self.env['stock.move']
+        for i in range(self.args.moves):
+            product = self.rng.choice(list(self.levels[0]))
+            mrp_area = self.rng.choice(list(self.mrp_areas))
+            move_date = fields.Date.to_string(self._random_date())
+            moves |= moves.create({
+                'name': 'MRP Benchmark %s' % i,
+                'product_id': product.id,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': self.rng.randint(1, 100),
+                'location_id': mrp_area.location_id.id,
+                'location_dest_id': customers.id,
+                'date': move_date,
+                'date_expected': move_date,
+            })
+        moves._action_confirm()
+
+    def _generate_purchase_lines(self):
+        if not self.args.purchase_lines:
+            return
+        products = self.levels[-1]
+        vendor = products[0].seller_ids[0].name
+        orders = {}
+        for i in range(self.args.purchase_lines):
+            mrp_area = self.rng.choice(list(self.mrp_areas))
+            if mrp_area not in orders:
+                orders[mrp_area] = self.env['purchase.order'].create({
+                    'partner_id': vendor.id,
+                    'picking_type_id':
+                        mrp_area.warehouse_id.in_type_id.id,
+                })
+            product = self.rng.choice(list(products))
+            self.env['purchase.order.line'].create({
+                'order_id': orders[mrp_area].id,
+                'name': product.name,
+                'product_id': product.id,
+                'product_uom': product.uom_id.id,
+                'product_qty': self.rng.randint(1, 200),
+                'price_unit': 1.0,
+                'date_planned': fields.Date.to_string(self._random_date()),
+            })
+
+    def _generate_estimates(self):
+        if not self.args.estimate_weeks:
+            return
+        range_type = self.env['date.range.type'].create({
+            'name': 'MRP Benchmark Weeks',
+            'company_id': False,
+            'allow_overlap': False,
+        })
+        self.env['date.range.generator'].create({
+            'date_start': date.today(),
+            'name_prefix': 'MRP-BENCH-W',
+            'type_id': range_type.id,
+            'duration_count': 1,
+            'unit_of_time': WEEKLY,
+            'count': self.args.estimate_weeks,
+        }).action_apply()
+        date_ranges = self.env['date.range'].search([
+            ('type_id', '=', range_type.id)])
+        for mrp_area in self.mrp_areas:
+            for product in self.levels[0]:
+                for date_range in date_ranges:
+                    self.env['stock.demand.estimate'].create({
+                        'product_id': product.id,
+                        'location_id': mrp_area.location_id.id,
+                        'product_uom': product.uom_id.id,
+                        'product_uom_qty': self.rng.randint(0, 500),
+                        'date_range_id': date_range.id,
+                    })
+
+
+class MrpBenchmark(Command):
+    """Time a multi level MRP run on synthetic data"""
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog='%s mrpbenchmark' % sys.argv[0].split('/')[-1],
+            description=self.__doc__)
+        parser.add_argument('--products', type=int, default=1000,
+                            help="Products to generate, 0 to benchmark the "
+                                 "existing data.")
+        parser.add_argument('--depth', type=int, default=4,
+                            help="Levels of the BoM trees.")
+        parser.add_argument('--fan-out', type=int, default=3,
+                            help="Components of every BoM.")
+        parser.add_argument('--areas', type=int, default=1)
+        parser.add_argument('--moves', type=int, default=1000,
+                            help="Open outgoing stock moves.")
+        parser.add_argument('--purchase-lines', type=int, default=200,
+                            help="Draft purchase order lines.")
+        parser.add_argument('--estimate-weeks', type=int, default=8,
+                            help="Weekly demand estimates of every "
+                                 "finished product and area.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--parallel', action='store_true',
+                            help="Run the areas in parallel, by the "
+                                 "scheduled actions of a running server "
+                                 "on the same database. The data is "
+                                 "committed.")
+        parser.add_argument('--snapshot', action='store_true',
+                            help="Use an isolated run.")
+        parser.add_argument('--legacy-indexes', action='store_true',
+                            help="Run with the single column indexes of "
+                                 "the former layout of the MRP tables "
+                                 "instead of the current ones.")
+        parser.add_argument('--query-samples', type=int, default=100,
+                            help="Product MRP areas the reads are timed "
+                                 "on after the run.")
+        parser.add_argument('--keep', action='store_true',
+                            help="Commit the generated data and results.")
+        parser.add_argument('--output', default='mrp_benchmark.jsonl',
+                            help="JSON Lines file the results are "
+                                 "appended to.")
+        args, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args)
+        dbname = config['db_name']
+        if not dbname:
+            parser.error("A database is required, use -d.")
+        if args.legacy_indexes and (args.parallel or args.keep):
+            parser.error("--legacy-indexes cannot be committed, it excludes "
+                         "--parallel and --keep.")
+        with odoo.api.Environment.manage():
+            with odoo.registry(dbname).cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                result = self._benchmark(env, args)
+                if not (args.keep or args.parallel):
+                    cr.rollback()
+        with open(args.output, 'a') as output:
+            output.write(json.dumps(result) + '\n')
+        _logger.info('MRP benchmark: %.2fs, %s queries, results in %s',
+                     result['duration'], result['query_count'], args.output)
+
+    def _benchmark(self, env, args):
+        wizard_vals = {'parallel': args.parallel, 'snapshot': args.snapshot}
+        if args.legacy_indexes:
+            # Replaced in the transaction of the benchmark, which is
+            # rolled back.
+            for name, definition in (MRP_MOVE_INDEXES +
+                                     MRP_INVENTORY_INDEXES +
+                                     MRP_PLANNED_ORDER_INDEXES):
+                if not definition.startswith('(mrp_run_id)'):
+                    env.cr.execute('DROP INDEX IF EXISTS %s' % name)
+            for table, columns in LEGACY_INDEXES.items():
+                for column in columns:
+                    env.cr.execute(
+                        'CREATE INDEX IF NOT EXISTS {0}_{1}_index '
+                        'ON {0} ({1})'.format(table, column))
+        if args.products:
+            _logger.info('MRP benchmark: generating the data')
+            mrp_areas = MrpBenchmarkData(env, args).generate()
+            wizard_vals['mrp_area_ids'] = [(6, 0, mrp_areas.ids)]
+        _logger.info('MRP benchmark: running the MRP')
+        env['mrp.multi.level'].create(wizard_vals).run_mrp_multi_level()
+        run = env['mrp.run'].search([('parent_id', '=', False)], limit=1)
+        if args.parallel:
+            # The area runs are computed by the server once committed.
+            env.cr.commit()
+            while run.state == 'running':
+                time.sleep(1)
+                env.cr.rollback()
+                run.invalidate_cache()
+        stages = OrderedDict()
+        for stage in (run | run.child_ids).mapped('stage_ids'):
+            totals = stages.setdefault(stage.name, {
+                'duration': 0.0, 'query_count': 0, 'rows_created': 0})
+            totals['duration'] += stage.duration
+            totals['query_count'] += stage.query_count
+            totals['rows_created'] += stage.rows_created
+        return {
+            'date': fields.Datetime.now(),
+            'revision': self._get_revision(),
+            'database': env.cr.dbname,
+            'parameters': vars(args),
+            'product_mrp_areas': env['product.mrp.area'].search_count([]),
+            'duration': run.duration,
+            'query_count': run.query_count,
+            'rows_created': run.rows_created,
+            'stages': stages,
+            'slow_products': [
+                (product.product_mrp_area_id.display_name, product.duration)
+                for product in (run | run.child_ids).mapped(
+                    'slow_product_ids').sorted('duration', reverse=True)[
+                        :10]],
+            'queries': self._benchmark_queries(env, args),
+            'indexes': self._benchmark_indexes(env),
+        }
+
+    def _benchmark_indexes(self, env):
+        """Number and size, in bytes, of the indexes of the MRP tables."""
+        env.cr.execute("""
+            SELECT c.relname, count(i.indexrelid),
+                sum(pg_relation_size(i.indexrelid))
+            FROM pg_class c
+            JOIN pg_index i ON i.indrelid = c.oid
+            WHERE c.relname IN ('mrp_move', 'mrp_inventory',
+                                'mrp_planned_order')
+            GROUP BY c.relname
+        """)
+        return {table: {'count': count, 'size': int(size)}
+                for table, count, size in env.cr.fetchall()}
+
+    def _benchmark_queries(self, env, args):
+        """Total time of the reads of ``BENCHMARK_QUERIES`` over a sample
+        of the product MRP areas and over all the MRP areas."""
+        env.cr.execute('ANALYZE mrp_move, mrp_inventory, mrp_planned_order')
+        samples = {
+            'product_mrp_area': env['product.mrp.area'].search(
+                [], limit=args.query_samples).ids,
+            'mrp_area': env['mrp.area'].search([]).ids,
+        }
+        timings = OrderedDict()
+        for name, sample, query in BENCHMARK_QUERIES:
+            start = time.time()
+            for record_id in samples[sample]:
+                env.cr.execute(query, (record_id, ))
+                env.cr.fetchall()
+            timings[name] = time.time() - start
+        return timings
+
+    @staticmethod
+    def _get_revision():
+        """Commit of the addon being benchmarked, if in a git tree."""
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
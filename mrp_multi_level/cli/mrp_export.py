@@ -0,0 +1,64 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import argparse
+import sys
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from odoo.cli import Command
+from odoo.tools import config
+
+from ..models.mrp_export import (
+    EXPORT_CHUNK_SIZE, EXPORT_FORMATS, EXPORT_TABLES,
+)
+
+
+class MrpExport(Command):
+    """Export the MRP results of a database to CSV or Parquet"""
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog='%s mrpexport' % sys.argv[0].split('/')[-1],
+            description=self.__doc__)
+        parser.add_argument('--table', choices=sorted(EXPORT_TABLES),
+                            default='inventory')
+        parser.add_argument('--format', dest='file_format',
+                            choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', default='-',
+                            help="File to write, standard output if '-'.")
+        parser.add_argument('--mrp-area', dest='mrp_area_ids', type=int,
+                            action='append',
+                            help="MRP area to export, all if not given.")
+        parser.add_argument('--chunk-size', type=int,
+                            default=EXPORT_CHUNK_SIZE)
+        args, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args)
+        dbname = config['db_name']
+        if not dbname:
+            parser.error("A database is required, use -d.")
+        if args.file_format == 'parquet' and args.output == '-':
+            parser.error("The Parquet export requires an --output file.")
+        with odoo.api.Environment.manage():
+            with odoo.registry(dbname).cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                mrp_areas = None
+                if args.mrp_area_ids:
+                    mrp_areas = env['mrp.area'].browse(args.mrp_area_ids)
+                export = env['mrp.export']
+                if args.file_format == 'parquet':
+                    with open(args.output, 'wb') as fileobj:
+                        export._export_parquet(
+                            args.table, fileobj, mrp_areas=mrp_areas,
+                            chunk_size=args.chunk_size)
+                    return
+                fileobj = sys.stdout.buffer if args.output == '-' else \
+                    open(args.output, 'wb')
+                try:
+                    for chunk in export._export_csv(
+                            args.table, mrp_areas=mrp_areas,
+                            chunk_size=args.chunk_size):
+                        fileobj.write(chunk)
+                finally:
+                    if fileobj is not sys.stdout.buffer:
+                        fileobj.close()
@@ -0,0 +1,62 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import tempfile
+
+from odoo import api, http, registry
+from odoo.http import request
+from werkzeug.exceptions import BadRequest, NotFound
+from werkzeug.wsgi import wrap_file
+
+from ..models.mrp_export import EXPORT_FORMATS, EXPORT_TABLES
+
+
+class MrpExportController(http.Controller):
+
+    @http.route('/mrp_multi_level/export/<string:table>.<string:file_format>',
+                type='http', auth='user')
+    def export(self, table, file_format, mrp_area_ids=None, **kwargs):
+        """Stream the active results of an MRP table. ``mrp_area_ids`` is
+        an optional comma separated list of area ids."""
+        if table not in EXPORT_TABLES or file_format not in EXPORT_FORMATS:
+            raise NotFound()
+        request.env[EXPORT_TABLES[table][2]].check_access_rights('read')
+        mrp_areas = request.env['mrp.area'].search([])
+        if mrp_area_ids:
+            area_ids = self._parse_mrp_area_ids(mrp_area_ids)
+            mrp_areas = mrp_areas.filtered(lambda a: a.id in area_ids)
+        filename = 'mrp_%s.%s' % (table, file_format)
+        headers = [
+            ('Content-Disposition', 'attachment; filename="%s"' % filename),
+        ]
+        if file_format == 'parquet':
+            fileobj = tempfile.TemporaryFile()
+            request.env['mrp.export']._export_parquet(
+                table, fileobj, mrp_areas=mrp_areas)
+            fileobj.seek(0)
+            headers.append(('Content-Type', 'application/octet-stream'))
+            return request.make_response(
+                wrap_file(request.httprequest.environ, fileobj),
+                headers=headers)
+        headers.append(('Content-Type', 'text/csv; charset=utf-8'))
+        return request.make_response(self._stream_csv(
+            request.env.cr.dbname, request.env.uid, table, mrp_areas.ids),
+            headers=headers)
+
+    @staticmethod
+    def _parse_mrp_area_ids(mrp_area_ids):
+        try:
+            return {int(area_id) for area_id in mrp_area_ids.split(',')}
+        except ValueError:
+            raise BadRequest('Invalid MRP area ids: %s' % mrp_area_ids)
+
+    @staticmethod
+    def _stream_csv(dbname, uid, table, mrp_area_ids):
+        """The response is sent once the request cursor is closed: the
+        rows are streamed from a cursor of their own."""
+        with api.Environment.manage():
+            with registry(dbname).cursor() as cr:
+                env = api.Environment(cr, uid, {})
+                for chunk in env['mrp.export']._export_csv(
+                        table, env['mrp.area'].browse(mrp_area_ids)):
+                    yield chunk
@@ -0,0 +1,11 @@
+# Copyright 2019 Eficent Business and IT Consulting Services, S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+__name__ = "Upgrade to 11.0.3.6.0"
+
+
+def migrate(cr, version):
+    # The single column indexes were replaced, refresh the statistics the
+    # planner chooses among the new ones with.
+    for table in ('mrp_move', 'mrp_inventory', 'mrp_planned_order'):
+        cr.execute('ANALYZE %s' % table)
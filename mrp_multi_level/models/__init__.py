@@ -6,3 +6,13 @@ from . import mrp_move
 from . import mrp_planned_order
 from . import mrp_inventory
 from . import product_mrp_area
+from . import mrp_dirty_product
+from . import stock_move
+from . import purchase_order
+from . import stock_demand_estimate
+from . import mrp_bom
+from . import mrp_run
+from . import mrp_pegging
+from . import procurement_rule
+from . import mrp_export
+from . import mrp_inventory_procure_job
@@ -4,6 +4,8 @@
 # - Lois Rilo Antelo <lois.rilo@eficent.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+from datetime import date, timedelta
+
 from odoo import api, fields, models
 
 
@@ -30,9 +32,55 @@ class MrpArea(models.Model):
         string='Working Hours',
         related='warehouse_id.calendar_id',
     )
+    planning_horizon = fields.Integer(
+        string='Planning Horizon (days)',
+        help="Demand and supply planned after this number of days are "
+             "collapsed on the last day of the horizon. Leave it to 0 to "
+             "plan without horizon.",
+    )
+    inventory_bucket = fields.Selection(
+        selection=[('day', 'Daily'),
+                   ('week', 'Weekly'),
+                   ('month', 'Monthly')],
+        string='Inventory Buckets', default='day', required=True,
+        help="Period the MRP inventory projections are aggregated by.",
+    )
+
+    @api.multi
+    def _get_horizon_date(self):
+        """Last day of the planning horizon, None without horizon."""
+        self.ensure_one()
+        if not self.planning_horizon:
+            return None
+        return date.today() + timedelta(days=self.planning_horizon)
 
     @api.multi
     def _get_locations(self):
         self.ensure_one()
         return self.env['stock.location'].search([
             ('id', 'child_of', self.location_id.id)])
+
+    @api.multi
+    def _get_on_hand_qty(self, products=None, exclude_reserved=False):
+        """On hand quantity of ``products`` (all the products when not
+        given) in the locations of the area, aggregated from the quants
+        with a single query. Returns a dict by product id."""
+        self.ensure_one()
+        query = """
+            SELECT q.product_id, sum(q.quantity{reserved})
+            FROM stock_quant q
+            JOIN stock_location l ON l.id = q.location_id
+            JOIN stock_location root ON root.id = %(location)s
+            WHERE l.parent_left >= root.parent_left
+            AND l.parent_left < root.parent_right
+        """.format(
+            reserved=exclude_reserved and ' - q.reserved_quantity' or '')
+        params = {'location': self.location_id.id}
+        if products is not None:
+            if not products:
+                return {}
+            query += " AND q.product_id IN %(products)s"
+            params['products'] = tuple(products.ids)
+        query += " GROUP BY q.product_id"
+        self.env.cr.execute(query, params)
+        return dict(self.env.cr.fetchall())
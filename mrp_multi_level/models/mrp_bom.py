@@ -0,0 +1,69 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+
+class MrpBom(models.Model):
+    _inherit = 'mrp.bom'
+
+    @api.multi
+    def _get_mrp_affected_products(self):
+        """Products whose explosion depends on these BoMs. Their components
+        are recomputed as well by the net change run."""
+        products = self.env['product.product']
+        for bom in self:
+            products |= bom.product_id or \
+                bom.product_tmpl_id.product_variant_ids
+        return products
+
+    @api.model
+    def create(self, vals):
+        bom = super(MrpBom, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            bom._get_mrp_affected_products())
+        return bom
+
+    @api.multi
+    def write(self, vals):
+        products = self._get_mrp_affected_products()
+        res = super(MrpBom, self).write(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            products | self._get_mrp_affected_products())
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.env['mrp.dirty.product'].enqueue(
+            self._get_mrp_affected_products())
+        return super(MrpBom, self).unlink()
+
+
+class MrpBomLine(models.Model):
+    _inherit = 'mrp.bom.line'
+
+    @api.multi
+    def _get_mrp_affected_products(self):
+        return self.mapped('product_id') | \
+            self.mapped('bom_id')._get_mrp_affected_products()
+
+    @api.model
+    def create(self, vals):
+        line = super(MrpBomLine, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            line._get_mrp_affected_products())
+        return line
+
+    @api.multi
+    def write(self, vals):
+        products = self._get_mrp_affected_products()
+        res = super(MrpBomLine, self).write(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            products | self._get_mrp_affected_products())
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.env['mrp.dirty.product'].enqueue(
+            self._get_mrp_affected_products())
+        return super(MrpBomLine, self).unlink()
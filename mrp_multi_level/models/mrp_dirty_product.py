@@ -0,0 +1,44 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, fields, models
+
+
+class MrpDirtyProduct(models.Model):
+    """Queue of the products whose demand, supply or MRP parameters have
+    changed since the last MRP run. Consumed by the net change runs."""
+    _name = 'mrp.dirty.product'
+    _description = 'MRP Net Change Queue'
+    _log_access = False
+
+    product_id = fields.Many2one(
+        comodel_name='product.product',
+        required=True,
+        index=True,
+        ondelete='cascade',
+    )
+    mrp_area_id = fields.Many2one(
+        comodel_name='mrp.area',
+        string='MRP Area',
+        ondelete='cascade',
+        help="If empty, the product is affected in all the MRP areas.",
+    )
+
+    @api.model
+    def enqueue(self, products, mrp_area=None):
+        """Mark the given products as changed. Only products with MRP area
+        parameters are queued, and only once."""
+        if not products:
+            return
+        mrp_area_id = mrp_area.id if mrp_area else None
+        self.env.cr.execute("""
+            INSERT INTO mrp_dirty_product (product_id, mrp_area_id)
+            SELECT DISTINCT pma.product_id, %(area)s
+            FROM product_mrp_area pma
+            WHERE pma.product_id IN %(products)s
+                AND (%(area)s IS NULL OR pma.mrp_area_id = %(area)s)
+                AND NOT EXISTS (
+                    SELECT 1 FROM mrp_dirty_product d
+                    WHERE d.product_id = pma.product_id
+                        AND d.mrp_area_id IS NOT DISTINCT FROM %(area)s)
+        """, {'products': tuple(products.ids), 'area': mrp_area_id})
@@ -0,0 +1,168 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import csv
+import io
+import logging
+
+from odoo import api, models, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+    _logger.debug('Cannot import pyarrow, Parquet export disabled.')
+
+# Rows fetched at once from the server-side cursor of the exports.
+EXPORT_CHUNK_SIZE = 10000
+
+EXPORT_COLUMNS = [
+    ('mrp_area', 'string'),
+    ('default_code', 'string'),
+    ('product', 'string'),
+    ('date', 'date'),
+]
+
+# Query, extra columns and model of every exportable MRP result table. All
+# of them start with the area, product and date columns above.
+EXPORT_TABLES = {
+    'inventory': ("""
+        SELECT area.name, pp.default_code, pt.name, t.date,
+            t.demand_qty, t.supply_qty, t.initial_on_hand_qty,
+            t.final_on_hand_qty, t.to_procure, t.running_availability
+        FROM mrp_inventory t
+        {join}
+        ORDER BY t.mrp_area_id, t.product_id, t.date
+    """, [
+        ('demand_qty', 'float'),
+        ('supply_qty', 'float'),
+        ('initial_on_hand_qty', 'float'),
+        ('final_on_hand_qty', 'float'),
+        ('to_procure', 'float'),
+        ('running_availability', 'float'),
+    ], 'mrp.inventory'),
+    'move': ("""
+        SELECT area.name, pp.default_code, pt.name, t.mrp_date,
+            t.mrp_type, t.mrp_origin, t.mrp_qty, t.name
+        FROM mrp_move t
+        {join}
+        ORDER BY t.mrp_area_id, t.product_id, t.mrp_date, t.id
+    """, [
+        ('mrp_type', 'string'),
+        ('mrp_origin', 'string'),
+        ('mrp_qty', 'float'),
+        ('name', 'string'),
+    ], 'mrp.move'),
+    'planned_order': ("""
+        SELECT area.name, pp.default_code, pt.name, t.due_date,
+            t.order_release_date, t.mrp_action, t.mrp_qty, t.qty_released,
+            coalesce(t.fixed, FALSE)
+        FROM mrp_planned_order t
+        {join}
+        ORDER BY t.mrp_area_id, t.product_id, t.due_date, t.id
+    """, [
+        ('order_release_date', 'date'),
+        ('mrp_action', 'string'),
+        ('mrp_qty', 'float'),
+        ('qty_released', 'float'),
+        ('fixed', 'bool'),
+    ], 'mrp.planned.order'),
+}
+
+EXPORT_JOIN = """
+    JOIN mrp_area area ON area.id = t.mrp_area_id
+    JOIN product_product pp ON pp.id = t.product_id
+    JOIN product_template pt ON pt.id = pp.product_tmpl_id
+    WHERE t.active AND t.mrp_area_id IN %(mrp_areas)s
+"""
+
+EXPORT_FORMATS = ['csv', 'parquet']
+
+
+class MrpExport(models.AbstractModel):
+    """Streaming export of the MRP results, for the BI tools to avoid
+    reading millions of records through the ORM."""
+    _name = 'mrp.export'
+    _description = 'MRP Results Export'
+
+    @api.model
+    def _get_export_columns(self, table):
+        if table not in EXPORT_TABLES:
+            raise UserError(_("Unknown MRP table to export: %s") % table)
+        return EXPORT_COLUMNS + EXPORT_TABLES[table][1]
+
+    @api.model
+    def _iter_export_chunks(self, table, mrp_areas=None,
+                            chunk_size=EXPORT_CHUNK_SIZE):
+        """Rows of the active results of ``table``, fetched by chunks from
+        a server-side cursor so that the result set is never held in
+        memory. ``mrp_areas`` defaults to the areas readable by the user.
+        """
+        self._get_export_columns(table)
+        self.env['mrp.inventory'].check_access_rights('read')
+        if mrp_areas is None:
+            mrp_areas = self.env['mrp.area'].search([])
+        if not mrp_areas:
+            return
+        cursor_name = 'mrp_export_%s' % table
+        self.env.cr.execute(
+            "DECLARE %s NO SCROLL CURSOR FOR " % cursor_name +
+            EXPORT_TABLES[table][0].format(join=EXPORT_JOIN),
+            {'mrp_areas': tuple(mrp_areas.ids)})
+        try:
+            while True:
+                self.env.cr.execute(
+                    "FETCH FORWARD %s FROM " + cursor_name, (chunk_size, ))
+                rows = self.env.cr.fetchall()
+                if not rows:
+                    break
+                yield rows
+        finally:
+            self.env.cr.execute("CLOSE %s" % cursor_name)
+
+    @api.model
+    def _export_csv(self, table, mrp_areas=None,
+                    chunk_size=EXPORT_CHUNK_SIZE):
+        """Generate the CSV export of ``table``, one encoded chunk at
+        a time."""
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow([c[0] for c in self._get_export_columns(table)])
+        for rows in self._iter_export_chunks(table, mrp_areas, chunk_size):
+            writer.writerows(rows)
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode('utf-8')
+
+    @api.model
+    def _export_parquet(self, table, fileobj, mrp_areas=None,
+                        chunk_size=EXPORT_CHUNK_SIZE):
+        """Write the Parquet export of ``table`` into ``fileobj``, one row
+        group per chunk. Requires pyarrow."""
+        if pyarrow is None:
+            raise UserError(_("The Parquet export requires pyarrow."))
+        types = {
+            'string': pyarrow.string(),
+            'date': pyarrow.date32(),
+            'float': pyarrow.float64(),
+            'bool': pyarrow.bool_(),
+        }
+        columns = self._get_export_columns(table)
+        schema = pyarrow.schema([(name, types[kind])
+                                 for name, kind in columns])
+        writer = pyarrow.parquet.ParquetWriter(fileobj, schema)
+        try:
+            for rows in self._iter_export_chunks(
+                    table, mrp_areas, chunk_size):
+                writer.write_table(pyarrow.Table.from_arrays([
+                    pyarrow.array([row[i] for row in rows], type=type_)
+                    for i, type_ in enumerate(schema.types)
+                ], schema=schema))
+        finally:
+            writer.close()
@@ -5,9 +5,16 @@
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
 from odoo import api, fields, models
+from odoo.tools.sql import index_exists
 
 from datetime import timedelta, date
 
+MRP_INVENTORY_INDEXES = [
+    ('mrp_inventory_pma_date_index', '(product_mrp_area_id, date)'),
+    ('mrp_inventory_mrp_run_id_inactive_index',
+     '(mrp_run_id) WHERE NOT active'),
+]
+
 
 class MrpInventory(models.Model):
     _name = 'mrp.inventory'
@@ -21,11 +28,10 @@ class MrpInventory(models.Model):
 
     mrp_area_id = fields.Many2one(
         comodel_name='mrp.area', string='MRP Area',
-        related='product_mrp_area_id.mrp_area_id', store=True,
+        related='product_mrp_area_id.mrp_area_id', store=True, index=True,
     )
     product_mrp_area_id = fields.Many2one(
         comodel_name='product.mrp.area', string='Product Parameters',
-        index=True,
         required=True,
     )
     company_id = fields.Many2one(
@@ -38,6 +44,15 @@ class MrpInventory(models.Model):
         related='product_mrp_area_id.product_id',
         store=True,
     )
+    active = fields.Boolean(
+        default=True,
+        help="Inactive records belong to an isolated MRP run still being "
+             "computed, or to a replaced version of the plan.",
+    )
+    mrp_run_id = fields.Many2one(
+        comodel_name='mrp.run', string='MRP Run',
+        ondelete='set null', readonly=True,
+    )
     uom_id = fields.Many2one(
         comodel_name='product.uom', string='Product UoM',
         compute='_compute_uom_id',
@@ -68,6 +83,13 @@ class MrpInventory(models.Model):
         readonly=True,
     )
 
+    @api.model_cr
+    def init(self):
+        for name, definition in MRP_INVENTORY_INDEXES:
+            if not index_exists(self._cr, name):
+                self._cr.execute('CREATE INDEX %s ON %s %s' % (
+                    name, self._table, definition))
+
     @api.multi
     def _compute_uom_id(self):
         for rec in self:
@@ -81,17 +103,19 @@ class MrpInventory(models.Model):
 
     @api.multi
     @api.depends('product_mrp_area_id',
-                 'product_mrp_area_id.main_supplierinfo_id',
-                 'product_mrp_area_id.mrp_lead_time',
                  'product_mrp_area_id.mrp_area_id.calendar_id')
     def _compute_order_release_date(self):
+        # The lead time is not a dependency: it is recomputed for every
+        # product MRP area of a rule or route being changed, and the MRP
+        # run stores the release dates in bulk anyway.
         today = date.today()
         for rec in self.filtered(lambda r: r.date):
             delay = rec.product_mrp_area_id.mrp_lead_time
             if delay and rec.mrp_area_id.calendar_id:
                 dt_date = fields.Datetime.from_string(rec.date)
-                order_release_date = rec.mrp_area_id.calendar_id.plan_days(
-                    -delay - 1, dt_date).date()
+                order_release_date = \
+                    rec.mrp_area_id.calendar_id.plan_working_days(
+                        -delay - 1, dt_date).date()
             else:
                 order_release_date = fields.Date.from_string(
                     rec.date) - timedelta(days=delay)
@@ -0,0 +1,125 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+import logging
+
+from odoo import api, fields, models, _
+
+from .mrp_run import MRP_RUN_MAX_ATTEMPTS
+
+_logger = logging.getLogger(__name__)
+
+
+class MrpInventoryProcureJob(models.Model):
+    _name = 'mrp.inventory.procure.job'
+    _description = 'MRP Bulk Release'
+    _order = 'id desc'
+
+    name = fields.Char(compute='_compute_name')
+    user_id = fields.Many2one(
+        comodel_name='res.users', string='User',
+        default=lambda self: self.env.user, readonly=True,
+    )
+    state = fields.Selection(
+        selection=[('queued', 'Queued'),
+                   ('running', 'Running'),
+                   ('done', 'Done'),
+                   ('failed', 'Failed')],
+        default='queued', required=True, readonly=True,
+    )
+    date_end = fields.Datetime(string='Finished On', readonly=True)
+    mrp_inventory_ids = fields.Many2many(
+        comodel_name='mrp.inventory', string='MRP Inventories',
+        readonly=True,
+    )
+    procurement_count = fields.Integer(string='Procurements', readonly=True)
+    procurement_done = fields.Integer(
+        string='Procurements Processed', readonly=True,
+    )
+    progress = fields.Float(compute='_compute_progress')
+    attempt_count = fields.Integer(string='Attempts', readonly=True)
+    error = fields.Text(readonly=True)
+
+    @api.multi
+    @api.depends('create_date')
+    def _compute_name(self):
+        for rec in self:
+            rec.name = 'MRP Release %s' % rec.create_date
+
+    @api.multi
+    @api.depends('procurement_done', 'procurement_count')
+    def _compute_progress(self):
+        for rec in self:
+            if rec.procurement_count:
+                rec.progress = min(100.0, 100.0 * rec.procurement_done /
+                                   rec.procurement_count)
+
+    @api.multi
+    def _add_progress(self, count, errors):
+        """Record a batch of ``count`` procurements processed, failing with
+        the given error messages."""
+        self.ensure_one()
+        self.write({
+            'procurement_done': self.procurement_done + count,
+            'error': '\n'.join(filter(None, [self.error] + errors)) or False,
+        })
+
+    @api.model
+    def _process_queue(self, commit=True):
+        """Release the queued jobs, one after the other. Jobs found running
+        were interrupted by a crash: as the planned orders are released
+        with the batch of procurements committing them, they are resumed
+        with the planned orders left to release."""
+        while True:
+            job = self.search([
+                ('state', 'in', ('queued', 'running')),
+            ], order='id', limit=1)
+            if not job:
+                return True
+            if job.state == 'running' and \
+                    job.attempt_count >= MRP_RUN_MAX_ATTEMPTS:
+                job.write({
+                    'state': 'failed',
+                    'error': '\n'.join(filter(None, [
+                        job.error,
+                        _('Interrupted %s times.') % job.attempt_count])),
+                })
+                continue
+            job.write({
+                'state': 'running',
+                'attempt_count': job.attempt_count + 1,
+            })
+            if commit:
+                self.env.cr.commit()
+            job._run(commit=commit)
+
+    @api.multi
+    def _run(self, commit=True):
+        """Run the procurements of the planned orders left to release, as
+        the user who queued the job."""
+        self.ensure_one()
+        procure_obj = self.env['mrp.inventory.procure'].sudo(self.user_id)
+        try:
+            procurements = procure_obj._get_bulk_procurements(
+                self.mrp_inventory_ids)
+            self.procurement_count = \
+                self.procurement_done + len(procurements)
+            procure_obj._run_bulk_procurements(
+                procurements, commit=commit, job=self)
+        except Exception as e:
+            _logger.exception('MRP release %s failed', self.id)
+            if commit:
+                self.env.cr.rollback()
+            self.invalidate_cache()
+            self.write({
+                'state': 'failed',
+                'date_end': fields.Datetime.now(),
+                'error': '\n'.join(filter(None, [self.error, str(e)])),
+            })
+        else:
+            self.write({
+                'state': 'done',
+                'date_end': fields.Datetime.now(),
+            })
+        if commit:
+            self.env.cr.commit()
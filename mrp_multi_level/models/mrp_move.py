@@ -2,18 +2,34 @@
 # © 2016-18 Eficent Business and IT Consulting Services S.L.
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
-from odoo import models, fields
+from odoo import api, models, fields
+from odoo.tools.sql import index_exists
+
+# The moves are read by product MRP area in date order, and by MRP area
+# (indexed on the field). The foreign keys only set on the few moves coming
+# from actual documents, and the runs of the inactive moves, only exist
+# for a small part of the table: their indexes are partial, so that they
+# are not maintained when the exploded moves are inserted.
+MRP_MOVE_INDEXES = [
+    ('mrp_move_pma_date_type_index',
+     '(product_mrp_area_id, mrp_date, mrp_type)'),
+    ('mrp_move_mrp_run_id_inactive_index',
+     '(mrp_run_id) WHERE NOT active'),
+] + [
+    ('mrp_move_%s_partial_index' % column,
+     '(%s) WHERE %s IS NOT NULL' % (column, column))
+    for column in ('production_id', 'purchase_line_id', 'purchase_order_id',
+                   'stock_move_id')
+]
 
 
 class MrpMove(models.Model):
     _name = 'mrp.move'
     _order = 'product_mrp_area_id, mrp_date, mrp_type desc, id'
 
-    # TODO: too many indexes...
-
     product_mrp_area_id = fields.Many2one(
         comodel_name="product.mrp.area",
-        string="Product", index=True,
+        string="Product",
         required=True,
     )
     mrp_area_id = fields.Many2one(
@@ -33,6 +49,15 @@ class MrpMove(models.Model):
         related='product_mrp_area_id.product_id',
         store=True,
     )
+    active = fields.Boolean(
+        default=True,
+        help="Inactive records belong to an isolated MRP run still being "
+             "computed, or to a replaced version of the plan.",
+    )
+    mrp_run_id = fields.Many2one(
+        comodel_name='mrp.run', string='MRP Run',
+        ondelete='set null', readonly=True,
+    )
 
     current_date = fields.Date(string='Current Date')
     current_qty = fields.Float(string='Current Qty')
@@ -60,19 +85,19 @@ class MrpMove(models.Model):
     name = fields.Char(string='Description')
     parent_product_id = fields.Many2one(
         comodel_name="product.product",
-        string="Parent Product", index=True,
+        string="Parent Product",
     )
     production_id = fields.Many2one(
         comodel_name='mrp.production',
-        string='Manufacturing Order', index=True,
+        string='Manufacturing Order',
     )
     purchase_line_id = fields.Many2one(
         comodel_name='purchase.order.line',
-        string='Purchase Order Line', index=True,
+        string='Purchase Order Line',
     )
     purchase_order_id = fields.Many2one(
         comodel_name='purchase.order',
-        string='Purchase Order', index=True,
+        string='Purchase Order',
     )
     state = fields.Selection(
         selection=[('draft', 'Draft'),
@@ -88,5 +113,25 @@ class MrpMove(models.Model):
     )
     stock_move_id = fields.Many2one(
         comodel_name='stock.move',
-        string='Stock Move', index=True,
+        string='Stock Move',
     )
+
+    @api.model_cr
+    def init(self):
+        for name, definition in MRP_MOVE_INDEXES:
+            if not index_exists(self._cr, name):
+                self._cr.execute('CREATE INDEX %s ON %s %s' % (
+                    name, self._table, definition))
+
+    @api.multi
+    def get_pegged_demand(self):
+        """Independent demand these supply moves are pegged to, through
+        every BoM level, as a dict of quantity by ``mrp.move`` id."""
+        return self.env['mrp.pegging']._get_upstream_demand(
+            supply_moves=self)
+
+    @api.multi
+    def get_pegged_supply(self):
+        """Pegging of these demand moves, including the one of the
+        components of the planned orders covering them."""
+        return self.env['mrp.pegging']._get_downstream_pegging(self)
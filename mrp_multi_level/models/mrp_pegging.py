@@ -0,0 +1,144 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, fields, models
+from odoo.tools.sql import index_exists
+
+# Guard of the recursive queries against cyclic BoM structures.
+PEGGING_MAX_DEPTH = 100
+
+# The recursive queries walk the pegging from a demand move to the planned
+# orders covering it, and from a planned order or a supply move to the
+# demand it covers: the composite indexes hold the column joined next. The
+# foreign keys to the supply and the runs of the inactive rows are only
+# set on a part of the table, their indexes are partial.
+MRP_PEGGING_INDEXES = [
+    ('mrp_pegging_demand_order_index', '(demand_move_id, planned_order_id)'),
+    ('mrp_pegging_order_demand_index',
+     '(planned_order_id, demand_move_id, qty) '
+     'WHERE planned_order_id IS NOT NULL'),
+    ('mrp_pegging_supply_move_id_partial_index',
+     '(supply_move_id) WHERE supply_move_id IS NOT NULL'),
+    ('mrp_pegging_mrp_run_id_inactive_index',
+     '(mrp_run_id) WHERE NOT active'),
+]
+
+
+class MrpPegging(models.Model):
+    _name = 'mrp.pegging'
+    _description = 'MRP Pegging'
+    _order = 'product_mrp_area_id, id'
+
+    product_mrp_area_id = fields.Many2one(
+        comodel_name='product.mrp.area', string='Product Parameters',
+        required=True, ondelete='cascade',
+    )
+    mrp_area_id = fields.Many2one(
+        comodel_name='mrp.area', string='MRP Area',
+        related='product_mrp_area_id.mrp_area_id', store=True,
+    )
+    product_id = fields.Many2one(
+        comodel_name='product.product',
+        related='product_mrp_area_id.product_id', store=True,
+    )
+    active = fields.Boolean(default=True)
+    mrp_run_id = fields.Many2one(
+        comodel_name='mrp.run', string='MRP Run',
+        ondelete='set null', readonly=True,
+    )
+    demand_move_id = fields.Many2one(
+        comodel_name='mrp.move', string='Demand',
+        required=True, ondelete='cascade',
+    )
+    supply_move_id = fields.Many2one(
+        comodel_name='mrp.move', string='Supply',
+        ondelete='cascade',
+    )
+    planned_order_id = fields.Many2one(
+        comodel_name='mrp.planned.order', string='Planned Order',
+        ondelete='cascade',
+    )
+    demand_date = fields.Date(
+        related='demand_move_id.mrp_date', readonly=True,
+    )
+    supply_date = fields.Date(
+        compute='_compute_supply_date',
+    )
+    qty = fields.Float(string='Quantity')
+
+    @api.model_cr
+    def init(self):
+        for name, definition in MRP_PEGGING_INDEXES:
+            if not index_exists(self._cr, name):
+                self._cr.execute('CREATE INDEX %s ON %s %s' % (
+                    name, self._table, definition))
+
+    @api.multi
+    def _compute_supply_date(self):
+        for rec in self:
+            if rec.planned_order_id:
+                rec.supply_date = rec.planned_order_id.due_date
+            else:
+                rec.supply_date = rec.supply_move_id.mrp_date
+
+    @api.model
+    def _get_upstream_demand(self, supply_moves=None, planned_orders=None):
+        """Independent demand (not coming from a BoM explosion) driving the
+        given supply, through every BoM level. Returns a dict of the pegged
+        quantity by ``mrp.move`` id."""
+        supply_moves = supply_moves or self.env['mrp.move']
+        planned_orders = planned_orders or self.env['mrp.planned.order']
+        self.env.cr.execute("""
+            WITH RECURSIVE up(demand_move_id, qty, depth) AS (
+                SELECT p.demand_move_id, p.qty, 0
+                FROM mrp_pegging p
+                WHERE p.active
+                AND (p.supply_move_id IN %(supply_moves)s
+                     OR p.planned_order_id IN %(planned_orders)s)
+              UNION ALL
+                SELECT p.demand_move_id, p.qty, up.depth + 1
+                FROM up
+                JOIN mrp_move m
+                    ON m.id = up.demand_move_id AND m.mrp_origin = 'mrp'
+                JOIN mrp_move_planned_order_rel rel
+                    ON rel.move_down_id = m.id
+                JOIN mrp_pegging p
+                    ON p.planned_order_id = rel.order_id AND p.active
+                WHERE up.depth < %(max_depth)s
+            )
+            SELECT up.demand_move_id, sum(up.qty)
+            FROM up
+            JOIN mrp_move m ON m.id = up.demand_move_id
+            WHERE m.mrp_origin != 'mrp'
+            GROUP BY up.demand_move_id
+        """, {
+            'supply_moves': tuple(supply_moves.ids) or (None, ),
+            'planned_orders': tuple(planned_orders.ids) or (None, ),
+            'max_depth': PEGGING_MAX_DEPTH,
+        })
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _get_downstream_pegging(self, demand_moves):
+        """Pegging of ``demand_moves`` and, through the planned orders
+        covering them, of the demand they explode to at every BoM level."""
+        self.env.cr.execute("""
+            WITH RECURSIVE down(id, planned_order_id, depth) AS (
+                SELECT p.id, p.planned_order_id, 0
+                FROM mrp_pegging p
+                WHERE p.active AND p.demand_move_id IN %(demand_moves)s
+              UNION ALL
+                SELECT p.id, p.planned_order_id, down.depth + 1
+                FROM down
+                JOIN mrp_move_planned_order_rel rel
+                    ON rel.order_id = down.planned_order_id
+                JOIN mrp_pegging p
+                    ON p.demand_move_id = rel.move_down_id AND p.active
+                WHERE down.depth < %(max_depth)s
+            )
+            SELECT DISTINCT id FROM down
+        """, {
+            'demand_moves': tuple(demand_moves.ids) or (None, ),
+            'max_depth': PEGGING_MAX_DEPTH,
+        })
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
@@ -2,7 +2,15 @@
 # - Lois Rilo Antelo <lois.rilo@eficent.com>
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
-from odoo import models, fields
+from odoo import api, models, fields
+from odoo.tools.sql import index_exists
+
+MRP_PLANNED_ORDER_INDEXES = [
+    ('mrp_planned_order_pma_due_date_index',
+     '(product_mrp_area_id, due_date)'),
+    ('mrp_planned_order_mrp_run_id_inactive_index',
+     '(mrp_run_id) WHERE NOT active'),
+]
 
 
 class MrpPlannedOrder(models.Model):
@@ -14,7 +22,6 @@ class MrpPlannedOrder(models.Model):
     product_mrp_area_id = fields.Many2one(
         comodel_name="product.mrp.area",
         string="Product",
-        index=True,
         required=True,
     )
     mrp_area_id = fields.Many2one(
@@ -22,8 +29,8 @@ class MrpPlannedOrder(models.Model):
         related="product_mrp_area_id.mrp_area_id",
         string="MRP Area",
         store=True,
-        index=True,
         readonly=True,
+        index=True,
     )
     company_id = fields.Many2one(
         comodel_name='res.company',
@@ -36,6 +43,15 @@ class MrpPlannedOrder(models.Model):
         store=True,
         readonly=True,
     )
+    active = fields.Boolean(
+        default=True,
+        help="Inactive records belong to an isolated MRP run still being "
+             "computed, or to a replaced version of the plan.",
+    )
+    mrp_run_id = fields.Many2one(
+        comodel_name="mrp.run", string="MRP Run",
+        ondelete="set null", readonly=True,
+    )
     order_release_date = fields.Date(
         string="Release Date",
         help="Order release date planned by MRP.",
@@ -65,4 +81,45 @@ class MrpPlannedOrder(models.Model):
         string="Associated MRP Inventory",
         comodel_name="mrp.inventory",
         ondelete="set null",
+        index=True,
     )
+
+    @api.model_cr
+    def init(self):
+        for name, definition in MRP_PLANNED_ORDER_INDEXES:
+            if not index_exists(self._cr, name):
+                self._cr.execute('CREATE INDEX %s ON %s %s' % (
+                    name, self._table, definition))
+
+    @api.multi
+    def get_pegged_demand(self):
+        """Independent demand these planned orders are pegged to, through
+        every BoM level, as a dict of quantity by ``mrp.move`` id."""
+        return self.env['mrp.pegging']._get_upstream_demand(
+            planned_orders=self)
+
+    @api.multi
+    def _release_all(self):
+        """Mark the whole quantity of the planned orders as released, and
+        update the quantity to procure of their inventories."""
+        if not self:
+            return
+        self.env.cr.execute("""
+            UPDATE mrp_planned_order SET qty_released = mrp_qty
+            WHERE id IN %s
+            RETURNING mrp_inventory_id
+        """, (tuple(self.ids), ))
+        inventory_ids = tuple(
+            {row[0] for row in self.env.cr.fetchall() if row[0]})
+        if inventory_ids:
+            self.env.cr.execute("""
+                UPDATE mrp_inventory inv
+                SET to_procure = coalesce((
+                    SELECT sum(po.mrp_qty - po.qty_released)
+                    FROM mrp_planned_order po
+                    WHERE po.mrp_inventory_id = inv.id), 0.0)
+                WHERE inv.id IN %s
+            """, (inventory_ids, ))
+        self.invalidate_cache(['qty_released'], self.ids)
+        self.env['mrp.inventory'].invalidate_cache(
+            ['to_procure'], list(inventory_ids))
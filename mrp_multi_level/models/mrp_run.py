@@ -0,0 +1,475 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from contextlib import contextmanager
+from collections import defaultdict
+import heapq
+import logging
+import threading
+import time
+
+import psycopg2
+
+from odoo import api, fields, models, _
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+MRP_RUN_STAGES = [
+    ('queue', 'Net Change Queue'),
+    ('cleanup', 'Cleanup'),
+    ('llc', 'Low Level Codes'),
+    ('applicable', 'MRP Applicable'),
+    ('initialisation', 'Initialisation'),
+    ('calculation', 'Calculation'),
+    ('flush', 'Netting Flush'),
+    ('final_process', 'Final Process'),
+    ('swap', 'Plan Replacement'),
+]
+# Times a background run interrupted by a crash is resumed by the queue.
+MRP_RUN_MAX_ATTEMPTS = 3
+
+
+class MrpRunProfiler(object):
+    """Collect the statistics of an MRP run while it is being computed.
+
+    Stages are measured on the cursor running them.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.start = time.time()
+        self.stages = []
+        self.products = []
+        self.rows = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, cr, name, mrp_area_id=None, llc=None):
+        start = time.time()
+        query_count = cr.sql_log_count
+        rows = self.rows[id(cr)]
+        stats = {'product_count': 0}
+        try:
+            yield stats
+        finally:
+            self.stages.append({
+                'product_count': stats['product_count'],
+                'name': name,
+                'mrp_area_id': mrp_area_id,
+                'llc': llc,
+                'duration': time.time() - start,
+                'query_count': cr.sql_log_count - query_count,
+                'rows_created': self.rows[id(cr)] - rows,
+            })
+
+    def add_rows(self, cr, count):
+        self.rows[id(cr)] += count
+
+    def add_product(self, product_mrp_area_id, duration):
+        """Keep the ``top`` slowest product MRP areas."""
+        with self._lock:
+            item = (duration, product_mrp_area_id)
+            if len(self.products) < self.top:
+                heapq.heappush(self.products, item)
+            else:
+                heapq.heappushpop(self.products, item)
+
+
+class MrpRun(models.Model):
+    _name = 'mrp.run'
+    _description = 'MRP Run'
+    _order = 'date_start desc, id desc'
+
+    name = fields.Char(compute='_compute_name')
+    date_start = fields.Datetime(
+        string='Started On', default=fields.Datetime.now, readonly=True,
+    )
+    date_end = fields.Datetime(string='Finished On', readonly=True)
+    duration = fields.Float(string='Duration (s)', readonly=True)
+    query_count = fields.Integer(string='SQL Queries', readonly=True)
+    rows_created = fields.Integer(string='Rows Created', readonly=True)
+    state = fields.Selection(
+        selection=[('queued', 'Queued'),
+                   ('running', 'Running'),
+                   ('done', 'Done'),
+                   ('failed', 'Failed'),
+                   ('cancel', 'Cancelled')],
+        default='running', required=True, readonly=True,
+    )
+    background = fields.Boolean(readonly=True)
+    parallel = fields.Boolean(string='Parallel Run', readonly=True)
+    parent_id = fields.Many2one(
+        comodel_name='mrp.run', string='Parent Run', readonly=True,
+        ondelete='cascade', index=True,
+    )
+    child_ids = fields.One2many(
+        comodel_name='mrp.run', inverse_name='parent_id',
+        string='Area Runs', readonly=True,
+    )
+    worker_cron_ids = fields.Many2many(
+        comodel_name='ir.cron', string='Workers', readonly=True,
+        help="Scheduled actions computing the area runs of a parallel "
+             "run.",
+    )
+    user_id = fields.Many2one(
+        comodel_name='res.users', string='User',
+        default=lambda self: self.env.user, readonly=True,
+    )
+    mrp_area_ids = fields.Many2many(
+        comodel_name='mrp.area', string='MRP Areas', readonly=True,
+    )
+    net_change = fields.Boolean(readonly=True)
+    snapshot = fields.Boolean(string='Isolated Run', readonly=True)
+    exclude_reserved = fields.Boolean(
+        string='Exclude Reserved Stock', readonly=True,
+    )
+    product_mrp_area_ids = fields.Many2many(
+        comodel_name='product.mrp.area', string='Changed Products',
+        readonly=True,
+        help="Product MRP areas recomputed by a background net change run.",
+    )
+    lowest_llc = fields.Integer(readonly=True)
+    completed_steps = fields.Text(
+        readonly=True,
+        help="Steps of a background run already committed, skipped when "
+             "the run is resumed.",
+    )
+    attempt_count = fields.Integer(string='Attempts', readonly=True)
+    error = fields.Text(readonly=True)
+    current_stage = fields.Selection(
+        selection=MRP_RUN_STAGES, string='Last Completed Stage',
+        readonly=True,
+    )
+    product_count = fields.Integer(
+        string='Products Calculated', readonly=True,
+    )
+    product_total = fields.Integer(
+        string='Products to Calculate', readonly=True,
+    )
+    progress = fields.Float(compute='_compute_progress')
+    stage_ids = fields.One2many(
+        comodel_name='mrp.run.stage', inverse_name='run_id',
+        string='Stages', readonly=True,
+    )
+    slow_product_ids = fields.One2many(
+        comodel_name='mrp.run.product', inverse_name='run_id',
+        string='Slowest Products', readonly=True,
+    )
+
+    @api.multi
+    @api.depends('date_start')
+    def _compute_name(self):
+        for rec in self:
+            rec.name = 'MRP Run %s' % rec.date_start
+
+    @api.multi
+    @api.depends('product_count', 'product_total')
+    def _compute_progress(self):
+        for rec in self:
+            if rec.product_total:
+                rec.progress = min(
+                    100.0, 100.0 * rec.product_count / rec.product_total)
+
+    @api.multi
+    def _flush_profile(self, profiler):
+        """Store the stages measured by ``profiler`` since its last flush,
+        so that the statistics of background runs survive their
+        interruption."""
+        self.ensure_one()
+        now = time.time()
+        stages = profiler.stages
+        self.write({
+            'duration': self.duration + now - profiler.start,
+            'query_count': self.query_count + sum(
+                s['query_count'] for s in stages),
+            'rows_created': self.rows_created + sum(
+                s['rows_created'] for s in stages),
+            'product_count': self.product_count + sum(
+                s['product_count'] for s in stages
+                if s['name'] == 'calculation'),
+            'stage_ids': [(0, 0, dict(vals, sequence=sequence))
+                          for sequence, vals in enumerate(
+                              stages, len(self.stage_ids))],
+        })
+        profiler.stages = []
+        profiler.start = now
+
+    @api.multi
+    def _save_profile(self, profiler):
+        """Store the statistics collected by ``profiler`` and close the
+        run."""
+        self.ensure_one()
+        self._flush_profile(profiler)
+        products = [(0, 0, {
+            'product_mrp_area_id': product_mrp_area_id,
+            'duration': duration,
+        }) for duration, product_mrp_area_id in sorted(
+            profiler.products, reverse=True)]
+        self.write({
+            'state': 'done',
+            'date_end': fields.Datetime.now(),
+            'slow_product_ids': products,
+        })
+
+    @api.multi
+    def _checkpoint(self, step, stage, profiler):
+        """Record ``step`` as completed, in the transaction of its
+        results."""
+        self.ensure_one()
+        self._flush_profile(profiler)
+        self.write({
+            'completed_steps': '\n'.join(
+                filter(None, [self.completed_steps, step])),
+            'current_stage': stage,
+        })
+
+    @api.multi
+    def _is_cancelled(self):
+        """Whether the run was cancelled, read from the database as the
+        cancellation comes from another transaction."""
+        self.ensure_one()
+        self.env.cr.execute(
+            "SELECT state FROM mrp_run WHERE id = %s", (self.id, ))
+        return self.env.cr.fetchone()[0] == 'cancel'
+
+    @api.multi
+    def action_cancel(self):
+        """Stop background runs. A running one stops once its current step
+        is finished, the results of the steps already completed are kept
+        unless the run is isolated."""
+        self.filtered(
+            lambda r: r.background and
+            r.state in ('queued', 'running', 'failed')).write({
+                'state': 'cancel',
+                'date_end': fields.Datetime.now(),
+            })
+        return True
+
+    @api.multi
+    def action_resume(self):
+        """Queue failed background runs again, to be continued from their
+        last completed step."""
+        self.filtered(
+            lambda r: r.background and r.state == 'failed').write({
+            'state': 'queued',
+            'error': False,
+            'attempt_count': 0,
+        })
+        return True
+
+    @api.model
+    def _process_mrp_run_queue(self, commit=True):
+        """Compute the queued background runs, one after the other. Runs
+        found running were interrupted by a crash of their worker, as the
+        queue is only processed by one cron job at a time: they are
+        resumed from their last completed step."""
+        while True:
+            run = self.search([
+                ('background', '=', True),
+                ('state', 'in', ('queued', 'running')),
+            ], order='id', limit=1)
+            if not run:
+                return True
+            if run.state == 'running' and \
+                    run.attempt_count >= MRP_RUN_MAX_ATTEMPTS:
+                run.write({
+                    'state': 'failed',
+                    'error': _('Interrupted %s times.') % run.attempt_count,
+                })
+                continue
+            run.write({
+                'state': 'running',
+                'attempt_count': run.attempt_count + 1,
+            })
+            if commit:
+                self.env.cr.commit()
+            self.env['mrp.multi.level']._run_background_mrp_run(
+                run, commit=commit)
+
+    @api.multi
+    def _dispatch_area_runs(self):
+        """Create the scheduled actions computing the area runs of the
+        parallel run, once its transaction is committed. Each one is run
+        once, by the first server worker available: the areas are only
+        computed at the same time when the server runs several worker
+        processes, at most ``mrp_multi_level.parallel_workers`` (by default
+        the number of cron workers of the server)."""
+        self.ensure_one()
+        cron_obj = self.env['ir.cron'].sudo()
+        # The workers of the former parallel runs are not needed anymore.
+        self.with_context(active_test=False).search([
+            ('worker_cron_ids', '!=', False),
+            ('state', 'not in', ('queued', 'running')),
+        ]).mapped('worker_cron_ids').filtered(
+            lambda c: not c.active).sudo().unlink()
+        max_workers = int(self.env['ir.config_parameter'].sudo().get_param(
+            'mrp_multi_level.parallel_workers', 0)) or \
+            config['max_cron_threads']
+        crons = cron_obj.browse()
+        for worker in range(max(1, min(len(self.child_ids), max_workers))):
+            crons |= cron_obj.create({
+                'name': _('%s: Worker %s') % (self.name, worker + 1),
+                'model_id': self.env.ref('mrp_multi_level.model_mrp_run').id,
+                'state': 'code',
+                'code': 'model._process_mrp_area_runs(%s)' % self.id,
+                'user_id': self.user_id.id,
+                'interval_number': 1,
+                'interval_type': 'minutes',
+                'numbercall': 1,
+                'doall': False,
+                'nextcall': fields.Datetime.now(),
+            })
+        self.worker_cron_ids = crons
+        return True
+
+    @api.model
+    def _process_mrp_area_runs(self, parent_id, commit=True):
+        """Worker of the parallel run ``parent_id``: compute its queued area
+        runs, one after the other, until none is left, the area runs taken
+        by the other workers being skipped. The last worker closes the
+        parallel run."""
+        while True:
+            if commit:
+                self.env.cr.commit()
+            try:
+                self.env.cr.execute("""
+                    SELECT id FROM mrp_run
+                    WHERE parent_id = %s AND state = 'queued'
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                """, (parent_id, ))
+            except psycopg2.extensions.TransactionRollbackError:
+                # Finished by another worker meanwhile.
+                if not commit:
+                    raise
+                self.env.cr.rollback()
+                continue
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+            self.env['mrp.multi.level']._run_mrp_area_run(
+                self.browse(row[0]), commit=commit)
+        return self.browse(parent_id)._close_parallel_run(commit=commit)
+
+    @api.multi
+    def _close_parallel_run(self, commit=True):
+        """Close the parallel run once all its area runs are finished,
+        failing it if any of them failed. Returns whether it was closed."""
+        self.ensure_one()
+        while True:
+            try:
+                self.env.cr.execute("""
+                    SELECT state FROM mrp_run WHERE id = %s FOR UPDATE
+                """, (self.id, ))
+            except psycopg2.extensions.TransactionRollbackError:
+                # Closed by another worker meanwhile.
+                if not commit:
+                    raise
+                self.env.cr.rollback()
+                continue
+            break
+        self.invalidate_cache()
+        if self.state != 'running' or \
+                'queued' in self.child_ids.mapped('state'):
+            return False
+        failed = self.child_ids.filtered(lambda r: r.state == 'failed')
+        date_end = fields.Datetime.now()
+        vals = {
+            'state': failed and 'failed' or 'done',
+            'date_end': date_end,
+            'duration': (
+                fields.Datetime.from_string(date_end) -
+                fields.Datetime.from_string(self.date_start)
+            ).total_seconds(),
+            'query_count': self.query_count + sum(
+                self.child_ids.mapped('query_count')),
+            'rows_created': self.rows_created + sum(
+                self.child_ids.mapped('rows_created')),
+            'product_count': sum(self.child_ids.mapped('product_count')),
+        }
+        if failed:
+            vals['error'] = _(
+                "The MRP could not be computed for some areas:\n%s") % \
+                '\n'.join('%s: %s' % (r.mrp_area_ids.name, r.error)
+                          for r in failed)
+        self.write(vals)
+        if commit:
+            self.env.cr.commit()
+        return True
+
+    @api.model
+    def _get_runs_keeping_results(self):
+        """Isolated runs whose inactive results must be kept: the ones
+        being computed and the failed background ones, which can be
+        resumed."""
+        return self.search([
+            ('snapshot', '=', True),
+            '|', ('state', 'in', ('queued', 'running')),
+            '&', ('state', '=', 'failed'), ('background', '=', True),
+        ])
+
+    @api.model
+    def _gc_mrp_snapshots(self):
+        """Remove the MRP results replaced by isolated runs, and the ones
+        left behind by isolated runs that were cancelled or failed. The
+        ones of failed background runs are kept until they are resumed or
+        cancelled."""
+        kept_runs = self._get_runs_keeping_results()
+        for table in ('mrp_pegging', 'mrp_move', 'mrp_inventory',
+                      'mrp_planned_order'):
+            self.env.cr.execute("""
+                DELETE FROM {table}
+                WHERE NOT active
+                AND (mrp_run_id IS NULL OR mrp_run_id NOT IN %s)
+            """.format(table=table), (tuple(kept_runs.ids) or (None, ), ))
+            _logger.info('MRP garbage collection: %s rows removed from %s',
+                         self.env.cr.rowcount, table)
+        self.env['mrp.move'].invalidate_cache()
+        return True
+
+
+class MrpRunStage(models.Model):
+    _name = 'mrp.run.stage'
+    _description = 'MRP Run Stage'
+    _order = 'run_id, sequence'
+
+    run_id = fields.Many2one(
+        comodel_name='mrp.run', required=True, ondelete='cascade',
+        index=True,
+    )
+    sequence = fields.Integer()
+    name = fields.Selection(
+        selection=MRP_RUN_STAGES, string='Stage', required=True,
+    )
+    mrp_area_id = fields.Many2one(comodel_name='mrp.area', string='MRP Area')
+    llc = fields.Integer(string='Low Level Code')
+    duration = fields.Float(string='Duration (s)')
+    query_count = fields.Integer(string='SQL Queries')
+    rows_created = fields.Integer(string='Rows Created')
+    product_count = fields.Integer(string='Products')
+
+
+class MrpRunProduct(models.Model):
+    _name = 'mrp.run.product'
+    _description = 'MRP Run Slowest Product'
+    _order = 'run_id, duration desc'
+
+    run_id = fields.Many2one(
+        comodel_name='mrp.run', required=True, ondelete='cascade',
+        index=True,
+    )
+    product_mrp_area_id = fields.Many2one(
+        comodel_name='product.mrp.area', string='Product Parameters',
+        ondelete='cascade',
+    )
+    product_id = fields.Many2one(
+        comodel_name='product.product',
+        related='product_mrp_area_id.product_id', readonly=True,
+    )
+    mrp_area_id = fields.Many2one(
+        comodel_name='mrp.area',
+        related='product_mrp_area_id.mrp_area_id', readonly=True,
+    )
+    duration = fields.Float(string='Duration (s)')
@@ -0,0 +1,59 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+
+class ProcurementRule(models.Model):
+    _inherit = 'procurement.rule'
+
+    @api.multi
+    def _get_mrp_affected_product_mrp_areas(self):
+        """Product MRP areas whose supply method may be resolved to these
+        rules. Rules without warehouse may apply to every area."""
+        product_mrp_area_obj = self.env['product.mrp.area']
+        if not self:
+            return product_mrp_area_obj
+        if not all(self.mapped('warehouse_id')):
+            return product_mrp_area_obj.search([])
+        warehouses = self.mapped('warehouse_id')
+        return product_mrp_area_obj.search([
+            ('mrp_area_id.warehouse_id', 'in', warehouses.ids)])
+
+    @api.model
+    def create(self, vals):
+        rule = super(ProcurementRule, self).create(vals)
+        rule._get_mrp_affected_product_mrp_areas()._recompute_supply_method()
+        return rule
+
+    @api.multi
+    def write(self, vals):
+        product_mrp_areas = self._get_mrp_affected_product_mrp_areas()
+        res = super(ProcurementRule, self).write(vals)
+        (product_mrp_areas | self._get_mrp_affected_product_mrp_areas()
+         )._recompute_supply_method()
+        return res
+
+    @api.multi
+    def unlink(self):
+        product_mrp_areas = self._get_mrp_affected_product_mrp_areas()
+        res = super(ProcurementRule, self).unlink()
+        product_mrp_areas.exists()._recompute_supply_method()
+        return res
+
+
+class StockLocationRoute(models.Model):
+    _inherit = 'stock.location.route'
+
+    @api.multi
+    def _get_mrp_affected_product_mrp_areas(self):
+        return self.with_context(active_test=False).mapped(
+            'pull_ids')._get_mrp_affected_product_mrp_areas()
+
+    @api.multi
+    def write(self, vals):
+        product_mrp_areas = self._get_mrp_affected_product_mrp_areas()
+        res = super(StockLocationRoute, self).write(vals)
+        (product_mrp_areas | self._get_mrp_affected_product_mrp_areas()
+         )._recompute_supply_method()
+        return res
@@ -71,7 +71,7 @@ class ProductMRPArea(models.Model):
     )
     mrp_lead_time = fields.Float(
         string='Lead Time',
-        compute='_compute_mrp_lead_time',
+        compute='_compute_mrp_lead_time', store=True,
     )
     main_supplier_id = fields.Many2one(
         comodel_name='res.partner', string='Main Supplier',
@@ -88,7 +88,7 @@ class ProductMRPArea(models.Model):
                    ('manufacture', 'Produce'),
                    ('move', 'Transfer')],
         string='Supply Method',
-        compute='_compute_supply_method',
+        compute='_compute_supply_method', store=True,
     )
 
     qty_available = fields.Float(
@@ -129,6 +129,22 @@ class ProductMRPArea(models.Model):
             if any(v < 0 for v in rec.values()):
                 raise ValidationError(_("You cannot use a negative number."))
 
+    @api.model
+    def create(self, vals):
+        rec = super(ProductMRPArea, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            rec.product_id, mrp_area=rec.mrp_area_id)
+        return rec
+
+    @api.multi
+    def write(self, vals):
+        res = super(ProductMRPArea, self).write(vals)
+        if set(vals) - {'mrp_applicable'}:
+            for rec in self:
+                self.env['mrp.dirty.product'].enqueue(
+                    rec.product_id, mrp_area=rec.mrp_area_id)
+        return res
+
     @api.multi
     def name_get(self):
         return [(area.id, '[%s] %s' % (
@@ -136,51 +152,89 @@ class ProductMRPArea(models.Model):
             area.product_id.display_name)) for area in self]
 
     @api.multi
+    @api.depends('supply_method', 'product_id.produce_delay',
+                 'main_supplierinfo_id.delay')
     def _compute_mrp_lead_time(self):
         produced = self.filtered(lambda r: r.supply_method == "manufacture")
         purchased = self.filtered(lambda r: r.supply_method == "buy")
+        moved = self.filtered(lambda r: r.supply_method == "move")
         for rec in produced:
             rec.mrp_lead_time = rec.product_id.produce_delay
         for rec in purchased:
             rec.mrp_lead_time = rec.main_supplierinfo_id.delay
-        # TODO: 'move' supply method.
-        for rec in (self - produced - purchased):
+        # The rules are not reachable through field dependencies, their
+        # changes are handled by _recompute_supply_method.
+        for rec in moved:
+            rec.mrp_lead_time = rec._get_rule().delay
+        for rec in (self - produced - purchased - moved):
             rec.mrp_lead_time = 0
 
     @api.multi
     def _compute_qty_available(self):
-        for rec in self:
-            rec.qty_available = rec.product_id.with_context(
-                {'location': rec.mrp_area_id.location_id.id}).qty_available
+        for mrp_area in self.mapped('mrp_area_id'):
+            area_recs = self.filtered(lambda r: r.mrp_area_id == mrp_area)
+            on_hand = mrp_area._get_on_hand_qty(area_recs.mapped('product_id'))
+            for rec in area_recs:
+                rec.qty_available = on_hand.get(rec.product_id.id, 0.0)
 
     @api.multi
+    @api.depends('mrp_area_id', 'location_proc_id',
+                 'mrp_area_id.location_id', 'mrp_area_id.warehouse_id',
+                 'mrp_area_id.warehouse_id.route_ids', 'product_id',
+                 'product_id.route_ids', 'product_id.categ_id.route_ids')
     def _compute_supply_method(self):
-        group_obj = self.env['procurement.group']
         for rec in self:
-            proc_loc = rec.location_proc_id or rec.mrp_area_id.location_id
-            values = {
-                'warehouse_id': rec.mrp_area_id.warehouse_id,
-                'company_id': self.env.user.company_id.id,
-                # TODO: better way to get company
-            }
-            rule = group_obj._get_rule(rec.product_id, proc_loc, values)
+            rule = rec._get_rule()
             rec.supply_method = rule.action if rule else 'none'
 
+    @api.multi
+    def _get_rule(self):
+        """Procurement rule supplying the product in the MRP area."""
+        self.ensure_one()
+        proc_loc = self.location_proc_id or self.mrp_area_id.location_id
+        values = {
+            'warehouse_id': self.mrp_area_id.warehouse_id,
+            'company_id': self.env.user.company_id.id,
+            # TODO: better way to get company
+        }
+        return self.env['procurement.group']._get_rule(
+            self.product_id, proc_loc, values)
+
     @api.multi
     @api.depends('supply_method', 'product_id.route_ids',
                  'product_id.seller_ids')
     def _compute_main_supplier(self):
         """Simplified and similar to procurement.rule logic."""
-        for rec in self.filtered(lambda r: r.supply_method == 'buy'):
-            suppliers = rec.product_id.seller_ids.filtered(
-                lambda r: (not r.product_id or r.product_id == rec.product_id)
-                and (not r.company_id or r.company_id == rec.company_id)
-            )
+        for rec in self:
+            suppliers = rec.supply_method == 'buy' and \
+                rec.product_id.seller_ids.filtered(
+                    lambda r: (not r.product_id or
+                               r.product_id == rec.product_id) and
+                    (not r.company_id or r.company_id == rec.company_id))
             if not suppliers:
+                rec.main_supplierinfo_id = False
+                rec.main_supplier_id = False
                 continue
             rec.main_supplierinfo_id = suppliers[0]
             rec.main_supplier_id = suppliers[0].name
 
+    @api.multi
+    def _recompute_supply_method(self):
+        """Resolve again the procurement rule of these records, and the
+        fields depending on it. Used when the rules or routes change, as
+        they are not reachable through field dependencies."""
+        previous = {rec.id: rec.supply_method for rec in self}
+        for name in ('supply_method', 'main_supplier_id',
+                     'main_supplierinfo_id', 'mrp_lead_time'):
+            self._recompute_todo(self._fields[name])
+        self.recompute()
+        changed = self.filtered(
+            lambda r: r.supply_method != previous[r.id])
+        for rec in changed:
+            self.env['mrp.dirty.product'].enqueue(
+                rec.product_id, mrp_area=rec.mrp_area_id)
+        return True
+
     @api.multi
     def _adjust_qty_to_order(self, qty_to_order):
         self.ensure_one()
@@ -197,6 +251,36 @@ class ProductMRPArea(models.Model):
             return self.mrp_maximum_order_qty
         return qty_to_order
 
+    @api.multi
+    def _get_order_quantities(self, qty_to_order, qty_ordered=0.0):
+        """Split ``qty_to_order`` into orders following the lot sizing
+        rules, as repeatedly applying ``_adjust_qty_to_order`` would do.
+
+        The run of orders capped to the maximum order quantity is computed
+        in closed form. Returns a list of ``(qty, number of orders)``.
+        """
+        self.ensure_one()
+        res = []
+        remaining = qty_to_order
+        # The loop stops once the remaining quantity is below this limit.
+        threshold = qty_ordered
+        while remaining > threshold:
+            qty = self._adjust_qty_to_order(remaining)
+            count = 1
+            maximum = self.mrp_maximum_order_qty
+            if maximum and qty == maximum:
+                # Above this quantity, every order is capped to the maximum.
+                capped_from = maximum
+                if self.mrp_qty_multiple:
+                    capped_from = (maximum // self.mrp_qty_multiple) * \
+                        self.mrp_qty_multiple
+                limit = max(capped_from, threshold)
+                if remaining > limit and self.mrp_minimum_order_qty <= limit:
+                    count = int(ceil((remaining - limit) / maximum))
+            res.append((qty, count))
+            remaining -= qty * count
+        return res
+
     @api.multi
     def _to_be_exploded(self):
         self.ensure_one()
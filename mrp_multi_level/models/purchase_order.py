@@ -0,0 +1,46 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+MRP_LINE_FIELDS = {
+    'product_id', 'product_qty', 'product_uom', 'date_planned', 'order_id',
+}
+MRP_ORDER_FIELDS = {'state', 'picking_type_id'}
+
+
+class PurchaseOrder(models.Model):
+    _inherit = 'purchase.order'
+
+    @api.multi
+    def write(self, vals):
+        res = super(PurchaseOrder, self).write(vals)
+        if MRP_ORDER_FIELDS.intersection(vals):
+            self.env['mrp.dirty.product'].enqueue(
+                self.mapped('order_line.product_id'))
+        return res
+
+
+class PurchaseOrderLine(models.Model):
+    _inherit = 'purchase.order.line'
+
+    @api.model
+    def create(self, vals):
+        line = super(PurchaseOrderLine, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(line.product_id)
+        return line
+
+    @api.multi
+    def write(self, vals):
+        if not MRP_LINE_FIELDS.intersection(vals):
+            return super(PurchaseOrderLine, self).write(vals)
+        products = self.mapped('product_id')
+        res = super(PurchaseOrderLine, self).write(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            products | self.mapped('product_id'))
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.env['mrp.dirty.product'].enqueue(self.mapped('product_id'))
+        return super(PurchaseOrderLine, self).unlink()
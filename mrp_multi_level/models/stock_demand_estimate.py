@@ -0,0 +1,27 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+
+class StockDemandEstimate(models.Model):
+    _inherit = 'stock.demand.estimate'
+
+    @api.model
+    def create(self, vals):
+        estimate = super(StockDemandEstimate, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(estimate.product_id)
+        return estimate
+
+    @api.multi
+    def write(self, vals):
+        products = self.mapped('product_id')
+        res = super(StockDemandEstimate, self).write(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            products | self.mapped('product_id'))
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.env['mrp.dirty.product'].enqueue(self.mapped('product_id'))
+        return super(StockDemandEstimate, self).unlink()
@@ -0,0 +1,35 @@
+# Copyright 2019 Eficent Business and IT Consulting Services S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from odoo import api, models
+
+MRP_FIELDS = {
+    'product_id', 'product_uom_qty', 'product_qty', 'product_uom', 'state',
+    'date_expected', 'location_id', 'location_dest_id', 'purchase_line_id',
+    'production_id', 'move_dest_ids',
+}
+
+
+class StockMove(models.Model):
+    _inherit = 'stock.move'
+
+    @api.model
+    def create(self, vals):
+        move = super(StockMove, self).create(vals)
+        self.env['mrp.dirty.product'].enqueue(move.product_id)
+        return move
+
+    @api.multi
+    def write(self, vals):
+        if not MRP_FIELDS.intersection(vals):
+            return super(StockMove, self).write(vals)
+        products = self.mapped('product_id')
+        res = super(StockMove, self).write(vals)
+        self.env['mrp.dirty.product'].enqueue(
+            products | self.mapped('product_id'))
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.env['mrp.dirty.product'].enqueue(self.mapped('product_id'))
+        return super(StockMove, self).unlink()
@@ -2,11 +2,20 @@
 #   (http://www.eficent.com)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import csv
+import io
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
 from odoo.tests.common import SavepointCase
+from odoo.exceptions import UserError
 from odoo import fields
+from odoo.addons.mrp_multi_level.controllers.main import \
+    MrpExportController
+from odoo.addons.mrp_multi_level.wizards.mrp_multi_level import \
+    MrpRunCache
 from dateutil.rrule import WEEKLY
+from werkzeug.exceptions import BadRequest
 
 
 class TestMrpMultiLevel(SavepointCase):
@@ -389,6 +398,17 @@ class TestMrpMultiLevel(SavepointCase):
         picking.action_confirm()
         return picking
 
+    def _get_exclusive_locks(self, tables):
+        """Tables among ``tables`` locked against any read by the current
+        transaction."""
+        self.env.cr.execute("""
+            SELECT relation::regclass::text FROM pg_locks
+            WHERE pid = pg_backend_pid()
+            AND mode = 'AccessExclusiveLock'
+            AND relation = ANY(%s::regclass[])
+        """, (list(tables), ))
+        return set(row[0] for row in self.env.cr.fetchall())
+
     def test_01_mrp_levels(self):
         """Tests computation of MRP levels."""
         self.assertEqual(self.fp_1.llc, 0)
@@ -675,3 +695,813 @@ class TestMrpMultiLevel(SavepointCase):
         self.assertEqual(mrp_invs[0].to_procure, 130)
         # Net needs = 18, available on-hand = 3 -> 15
         self.assertEqual(mrp_invs[1].to_procure, 15)
+
+    def test_12_bulk_initialisation(self):
+        """The bulk initialisation of a whole MRP area creates the moves of
+        the demand estimates, stock moves and purchases with the values the
+        initialisation of every product gave."""
+        wiz = self.mrp_multi_level_wiz.create({})
+        self.mrp_move_obj.search([
+            ('mrp_area_id', '=', self.mrp_area.id)]).unlink()
+        wiz._init_mrp_move(self.product_mrp_area_obj.search([
+            ('mrp_area_id', '=', self.mrp_area.id),
+            ('mrp_applicable', '=', True),
+        ]))
+
+        def _get_moves(product, origin):
+            return self.mrp_move_obj.search([
+                ('product_id', '=', product.id),
+                ('mrp_area_id', '=', self.mrp_area.id),
+                ('mrp_origin', '=', origin),
+            ])
+
+        # Delivery orders:
+        for picking, product, qty in (
+                (self.picking_1, self.fp_1, 100.0),
+                (self.picking_1, self.fp_2, 15.0),
+                (self.picking_2, self.prod_min, 16.0),
+                (self.picking_2, self.prod_max, 140.0),
+                (self.picking_2, self.prod_multiple, 112.0)):
+            move = _get_moves(product, 'mv')
+            stock_move = picking.move_lines.filtered(
+                lambda m: m.product_id == product)
+            self.assertEqual(len(move), 1)
+            self.assertEqual((
+                move.mrp_type, move.mrp_qty, move.current_qty, move.mrp_date,
+                move.current_date, move.name, move.mrp_order_number,
+                move.stock_move_id, move.parent_product_id, move.state,
+                move.company_id,
+            ), (
+                'd', -qty, -qty, self.date_7, self.date_7, picking.name,
+                picking.name, stock_move, self.product_obj,
+                stock_move.state, self.company,
+            ))
+        # Draft purchase order:
+        date_po = fields.Date.to_string(
+            self.calendar.plan_days(1 + 1, datetime.today()).date())
+        move = _get_moves(self.pp_2, 'po')
+        self.assertEqual(len(move), 1)
+        self.assertEqual((
+            move.mrp_type, move.mrp_qty, move.current_qty, move.mrp_date,
+            move.current_date, move.name, move.mrp_order_number,
+            move.purchase_order_id, move.purchase_line_id,
+            move.stock_move_id, move.state,
+        ), (
+            's', 5.0, 5.0, date_po, date_po, 'Test PO-001', 'Test PO-001',
+            self.po, self.po.order_line, self.env['stock.move'], 'draft',
+        ))
+        # Demand estimates of 210, 280 and 350 a week, expanded by day from
+        # today, the first week having started 3 days ago:
+        today = fields.Date.from_string(fields.Date.today())
+        expected = [
+            (fields.Date.to_string(today + timedelta(days=day)), -qty)
+            for day, qty in enumerate([30.0] * 4 + [40.0] * 7 + [50.0] * 7)]
+        moves = _get_moves(self.prod_test, 'fc').sorted('mrp_date')
+        self.assertEqual(
+            [(m.mrp_date, m.mrp_qty) for m in moves], expected)
+        for move in moves:
+            self.assertEqual((
+                move.mrp_type, move.current_date, move.current_qty,
+                move.name, move.state, move.stock_move_id,
+                move.parent_product_id,
+            ), (
+                'd', move.mrp_date, move.mrp_qty, 'Forecast', 'confirmed',
+                self.env['stock.move'], self.product_obj,
+            ))
+
+    def test_13_netting_flush(self):
+        """Planned orders and exploded moves are created in bulk at the end
+        of the calculation and linked together."""
+        fp_1_orders = self.planned_order_obj.search([
+            ('product_id', '=', self.fp_1.id)])
+        self.assertEqual(len(fp_1_orders), 1)
+        self.assertEqual(fp_1_orders.mrp_qty, 100.0)
+        down_moves = fp_1_orders.mrp_move_down_ids
+        self.assertEqual(
+            down_moves.mapped('product_id'), self.pp_1 | self.pp_2)
+        self.assertEqual(set(down_moves.mapped('mrp_origin')), {'mrp'})
+        self.assertEqual(
+            sorted(down_moves.mapped('mrp_qty')), [-300.0, -200.0])
+        for move in down_moves:
+            self.assertEqual(move.parent_product_id, self.fp_1)
+            self.assertEqual(move.planned_order_up_ids, fp_1_orders)
+            self.assertEqual(move.mrp_area_id, self.mrp_area)
+        # Identical orders are exploded at once, each one with its own
+        # moves:
+        self.product_mrp_area_obj.search([
+            ('product_id', '=', self.fp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id),
+        ]).mrp_maximum_order_qty = 40.0
+        self.mrp_multi_level_wiz.create({
+            'mrp_area_ids': [(6, 0, self.mrp_area.ids)],
+        }).run_mrp_multi_level()
+        fp_1_orders = self.planned_order_obj.search([
+            ('product_id', '=', self.fp_1.id)])
+        self.assertEqual(
+            sorted(fp_1_orders.mapped('mrp_qty')), [20.0, 40.0, 40.0])
+        for order in fp_1_orders:
+            down_moves = order.mrp_move_down_ids
+            self.assertEqual(len(down_moves), 2)
+            self.assertEqual(
+                sorted(down_moves.mapped('mrp_qty')),
+                [-3.0 * order.mrp_qty, -2.0 * order.mrp_qty])
+            for move in down_moves:
+                self.assertEqual(move.planned_order_up_ids, order)
+
+    def test_14_net_change(self):
+        """Net change runs only recompute the changed products and their
+        components."""
+        dirty_obj = self.env['mrp.dirty.product']
+        self.assertFalse(dirty_obj.search([]))
+        sf_1_invs = self.mrp_inventory_obj.search([
+            ('product_id', '=', self.sf_1.id)])
+        pp_1_from_sf_1 = self.mrp_move_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('parent_product_id', '=', self.sf_1.id)])
+        self.assertEqual(len(pp_1_from_sf_1), 2)
+        self._create_picking_out(
+            self.fp_1, 50.0, fields.Datetime.from_string(self.date_7))
+        self.assertTrue(dirty_obj.search([('product_id', '=', self.fp_1.id)]))
+        self.mrp_multi_level_wiz.create({
+            'net_change': True,
+        }).run_mrp_multi_level()
+        self.assertFalse(dirty_obj.search([]))
+        fp_1_orders = self.planned_order_obj.search([
+            ('product_id', '=', self.fp_1.id)])
+        self.assertEqual(sum(fp_1_orders.mapped('mrp_qty')), 150.0)
+        pp_1_from_fp_1 = self.mrp_move_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('parent_product_id', '=', self.fp_1.id)])
+        self.assertEqual(sum(pp_1_from_fp_1.mapped('mrp_qty')), -300.0)
+        # SF-1 is not a component of FP-1, it is not recomputed, and the
+        # demand it explodes to PP-1 is kept:
+        self.assertTrue(sf_1_invs.exists())
+        self.assertEqual(pp_1_from_sf_1, self.mrp_move_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('parent_product_id', '=', self.sf_1.id)]))
+        pp_1_invs = self.mrp_inventory_obj.search([
+            ('product_id', '=', self.pp_1.id)])
+        self.assertEqual(
+            sum(pp_1_invs.mapped('demand_qty')), 290.0 + 72.0 + 100.0)
+        # The pegging is replaced, not duplicated, by net change runs:
+        pegging_count = self.env['mrp.pegging'].search_count([])
+        for __ in range(2):
+            dirty_obj.enqueue(self.fp_1)
+            self.mrp_multi_level_wiz.create({
+                'net_change': True,
+            }).run_mrp_multi_level()
+            self.assertEqual(
+                self.env['mrp.pegging'].search_count([]), pegging_count)
+        # Without any MRP area, the queue is left untouched:
+        self._create_picking_out(
+            self.fp_1, 10.0, fields.Datetime.from_string(self.date_7))
+        self.mrp_area_obj.search([]).write({'active': False})
+        self.assertFalse(
+            self.mrp_multi_level_wiz._consume_net_change_queue(
+                self.mrp_area_obj))
+        self.assertTrue(dirty_obj.search([]))
+
+    def test_15_low_level_code(self):
+        """Low level codes are only recomputed when the BoMs change, and
+        BoM cycles are reported."""
+        wiz = self.mrp_multi_level_wiz
+        lowest_llc = wiz._low_level_code_calculation()
+        # No BoM change, the low level codes are not recomputed:
+        self.sf_1.llc = lowest_llc + 5
+        self.assertEqual(wiz._low_level_code_calculation(), lowest_llc + 6)
+        self.assertEqual(self.sf_1.llc, lowest_llc + 5)
+        bom_sf_1 = self.env.ref('mrp_multi_level.mrp_bom_sf_1')
+        bom_sf_1.write({'bom_line_ids': [(0, 0, {
+            'product_id': self.prod_min.id,
+            'product_qty': 1.0,
+        })]})
+        self.assertEqual(wiz._low_level_code_calculation(), lowest_llc)
+        self.assertEqual(self.sf_1.llc, 1)
+        self.assertEqual(self.prod_min.llc, 2)
+        # PP-1 -> FP-1 closes a cycle:
+        self.env['mrp.bom'].create({
+            'product_tmpl_id': self.pp_1.product_tmpl_id.id,
+            'bom_line_ids': [(0, 0, {
+                'product_id': self.fp_1.id,
+                'product_qty': 1.0,
+            })],
+        })
+        with self.assertRaises(UserError):
+            wiz._low_level_code_calculation()
+
+    def test_16_mrp_area_run(self):
+        """An MRP area can be computed on its own, as done by the workers of
+        the parallel runs."""
+        wiz = self.mrp_multi_level_wiz
+        domain = [('mrp_area_id', '=', self.secondary_area.id)]
+        invs = self.mrp_inventory_obj.search(domain)
+        other_invs = self.mrp_inventory_obj.search([
+            ('mrp_area_id', '!=', self.secondary_area.id)])
+        timings = wiz._run_mrp_area(
+            self.secondary_area, wiz._low_level_code_calculation())
+        self.assertEqual(list(timings), [
+            'cleanup', 'initialisation', 'calculation', 'final_process'])
+        self.assertFalse(invs.exists())
+        self.assertEqual(
+            len(self.mrp_inventory_obj.search(domain)), len(invs))
+        self.assertEqual(other_invs, other_invs.exists())
+
+    def test_17_bulk_inventory(self):
+        """The time-phased inventory is built in bulk, with its planned
+        orders attached and its release dates computed."""
+        invs = self.mrp_inventory_obj.search([
+            ('product_id', '=', self.pp_1.id)])
+        orders = self.env['mrp.planned.order'].search([
+            ('product_id', '=', self.pp_1.id)])
+        self.assertTrue(orders)
+        for order in orders:
+            self.assertIn(order.mrp_inventory_id, invs)
+            self.assertEqual(order.mrp_inventory_id.date, order.due_date)
+        for inv in invs:
+            self.assertTrue(inv.order_release_date)
+            self.assertAlmostEqual(
+                inv.final_on_hand_qty - inv.initial_on_hand_qty,
+                inv.supply_qty - inv.demand_qty)
+
+    def test_18_run_cache(self):
+        """Area and product MRP area lookups are memoized during a run."""
+        cache = MrpRunCache()
+        wiz = self.mrp_multi_level_wiz.with_context(mrp_cache=cache)
+        locations = wiz._get_mrp_area_locations(self.secondary_area)
+        self.assertEqual(locations, self.secondary_area._get_locations())
+        self.assertEqual(
+            cache.locations[self.secondary_area.id], locations.ids)
+        pma = wiz._get_product_mrp_area_from_product_and_area(
+            self.prod_test, self.secondary_area)
+        self.assertEqual(pma.product_id, self.prod_test)
+        self.assertFalse(wiz._exclude_from_mrp(
+            self.prod_test, self.secondary_area))
+        # Changes done during the run are not seen:
+        pma.mrp_exclude = True
+        self.assertFalse(wiz._exclude_from_mrp(
+            self.prod_test, self.secondary_area))
+        cache.clear()
+        self.assertTrue(wiz._exclude_from_mrp(
+            self.prod_test, self.secondary_area))
+
+    def test_19_on_hand_qty(self):
+        """On hand quantities are aggregated from the quants per area."""
+        on_hand = self.mrp_area._get_on_hand_qty(
+            self.fp_1 | self.pp_1 | self.prod_test)
+        for product in self.fp_1 | self.pp_1 | self.prod_test:
+            self.assertAlmostEqual(
+                on_hand.get(product.id, 0.0),
+                product.with_context(
+                    location=self.mrp_area.location_id.id).qty_available)
+        pma = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id)])
+        self.assertAlmostEqual(
+            pma.qty_available, on_hand.get(self.pp_1.id, 0.0))
+        cache = MrpRunCache()
+        wiz = self.mrp_multi_level_wiz.with_context(mrp_cache=cache)
+        self.assertAlmostEqual(
+            wiz._get_on_hand_by_product_mrp_area(pma)[pma.id],
+            pma.qty_available)
+        self.assertIn(self.mrp_area.id, cache.on_hand)
+
+    def test_20_order_quantities(self):
+        """Lot sizing splits the quantity to order in closed form, the same
+        way repeatedly adjusting the remaining quantity would do."""
+        pma_max = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.prod_max.id)])
+        self.assertEqual(
+            pma_max._get_order_quantities(1030.0), [(100.0, 10), (50.0, 1)])
+        pma_multiple = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.prod_multiple.id)])
+        self.assertEqual(
+            pma_multiple._get_order_quantities(1010.0),
+            [(500.0, 2), (50.0, 1)])
+        for pma in pma_max | pma_multiple:
+            for qty_to_order in (10.0, 99.0, 510.0, 2345.0):
+                expected = []
+                remaining = qty_to_order
+                while remaining > 0.0:
+                    qty = pma._adjust_qty_to_order(remaining)
+                    expected.append(qty)
+                    remaining -= qty
+                res = pma._get_order_quantities(qty_to_order)
+                self.assertEqual(
+                    [qty for qty, count in res for __ in range(count)],
+                    expected)
+
+    def test_21_explosion_cache(self):
+        """BoM explosions are memoized by BoM and MRP area during a run,
+        with quantities per unit of the parent product."""
+        cache = MrpRunCache()
+        wiz = self.mrp_multi_level_wiz.with_context(mrp_cache=cache)
+        bom = wiz._get_explosion_bom(self.fp_1)
+        self.assertEqual(bom, self.env.ref('mrp_multi_level.mrp_bom_fp_1'))
+        self.assertEqual(cache.boms[self.fp_1.id], bom.id)
+        bomlines = wiz._get_explosion_lines(bom, self.mrp_area)
+        self.assertEqual(bomlines, bom.bom_line_ids)
+        self.assertEqual(
+            cache.explosions[(bom.id, self.mrp_area.id)], bomlines.ids)
+        for bomline in bomlines:
+            self.assertEqual(
+                cache.bom_line_qty[bomline.id], bomline.product_qty)
+        bom.product_qty = 2.0
+        # The cached values are used until the end of the run:
+        self.assertEqual(
+            wiz._get_bom_line_unit_qty(bom, bomlines[0]),
+            bomlines[0].product_qty)
+        cache.clear()
+        self.assertEqual(
+            wiz._get_bom_line_unit_qty(bom, bomlines[0]),
+            bomlines[0].product_qty / 2.0)
+
+    def test_22_run_history(self):
+        """Every run is recorded with the statistics of its stages."""
+        run = self.env['mrp.run'].search([], limit=1)
+        self.assertEqual(run.state, 'done')
+        self.assertTrue(run.duration > 0.0)
+        self.assertTrue(run.query_count)
+        stages = run.stage_ids
+        self.assertEqual(
+            stages.filtered(lambda s: s.name == 'llc').mapped('mrp_area_id'),
+            self.env['mrp.area'])
+        self.assertIn(
+            self.secondary_area,
+            stages.filtered(
+                lambda s: s.name == 'final_process').mapped('mrp_area_id'))
+        self.assertEqual(
+            run.rows_created, sum(stages.mapped('rows_created')))
+        self.assertEqual(
+            run.rows_created,
+            self.mrp_move_obj.search_count([]) +
+            self.planned_order_obj.search_count([]) +
+            self.mrp_inventory_obj.search_count([]) +
+            self.env['mrp.pegging'].search_count([]))
+        self.assertTrue(run.slow_product_ids)
+        self.assertTrue(len(run.slow_product_ids) <= 10)
+
+    def test_23_cleanup(self):
+        """The cleanup removes the MRP results with SQL, keeping the fixed
+        planned orders."""
+        wiz = self.mrp_multi_level_wiz
+        orders = self.planned_order_obj.search([])
+        fixed_order = orders.filtered(
+            lambda o: o.mrp_move_down_ids)[0]
+        fixed_order.fixed = True
+        self.assertNotIn(
+            'mrp_planned_order', wiz._get_mrp_truncatable_tables())
+        self.assertNotIn('mrp_inventory', wiz._get_mrp_truncatable_tables())
+        # Only one area:
+        wiz._mrp_cleanup(self.secondary_area)
+        domain = [('mrp_area_id', '=', self.secondary_area.id)]
+        self.assertFalse(self.mrp_move_obj.search(domain))
+        self.assertFalse(self.mrp_inventory_obj.search(domain))
+        self.assertTrue(self.mrp_move_obj.search([
+            ('mrp_area_id', '!=', self.secondary_area.id)]))
+        # Every area, deleting the results so that the former plan stays
+        # readable until the end of the transaction:
+        truncatable = wiz._get_mrp_truncatable_tables()
+        self.assertTrue(truncatable)
+        wiz._mrp_cleanup(self.env['mrp.area'])
+        self.assertFalse(self._get_exclusive_locks(truncatable))
+        self.assertFalse(self.mrp_move_obj.search([]))
+        self.assertFalse(self.mrp_inventory_obj.search([]))
+        self.assertEqual(self.planned_order_obj.search([]), fixed_order)
+        self.assertFalse(fixed_order.mrp_move_down_ids)
+        self.assertFalse(fixed_order.mrp_inventory_id)
+        # Truncating them, for the callers committing right away:
+        wiz._mrp_cleanup(self.env['mrp.area'], truncate=True)
+        self.assertEqual(self._get_exclusive_locks(truncatable), truncatable)
+        self.assertEqual(self.planned_order_obj.search([]), fixed_order)
+
+
+    def test_24_snapshot_run(self):
+        """Isolated runs build the new plan next to the current one and
+        replace it at once, the replaced results being garbage collected
+        later on."""
+        domain = [('mrp_area_id', '=', self.secondary_area.id)]
+        invs = self.mrp_inventory_obj.search(domain)
+        moves = self.mrp_move_obj.search(domain)
+        self.mrp_multi_level_wiz.create({
+            'mrp_area_ids': [(6, 0, self.secondary_area.ids)],
+            'snapshot': True,
+        }).run_mrp_multi_level()
+        run = self.env['mrp.run'].search([], limit=1)
+        self.assertTrue(run.snapshot)
+        new_invs = self.mrp_inventory_obj.search(domain)
+        self.assertEqual(len(new_invs), len(invs))
+        self.assertFalse(new_invs & invs)
+        self.assertEqual(new_invs.mapped('mrp_run_id'), run)
+        self.assertEqual(
+            len(self.mrp_move_obj.search(domain)), len(moves))
+        # The replaced plan is only deactivated:
+        self.assertFalse(any(invs.mapped('active')))
+        self.assertEqual(invs.exists(), invs)
+        self.env['mrp.run']._gc_mrp_snapshots()
+        self.assertFalse(invs.exists())
+        self.assertFalse(moves.exists())
+        self.assertEqual(new_invs.exists(), new_invs)
+
+    def test_25_forecast_expansion(self):
+        """Demand estimates are expanded by the database in one move every
+        ``group_estimate_days`` days, from today at the earliest."""
+        pma = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.prod_test.id),
+            ('mrp_area_id', '=', self.mrp_area.id)])
+        pma.group_estimate_days = 7
+        self.mrp_multi_level_wiz._mrp_cleanup(self.mrp_area)
+        self.mrp_multi_level_wiz._init_mrp_move(pma)
+        moves = self.mrp_move_obj.search([
+            ('product_mrp_area_id', '=', pma.id),
+            ('mrp_origin', '=', 'fc')])
+        dates = sorted(moves.mapped('mrp_date'))
+        self.assertEqual(dates[0], fields.Date.today())
+        estimate_ends = self.estimate_obj.search([
+            ('product_id', '=', self.prod_test.id),
+            ('location_id', '=', self.stock_location.id),
+        ]).mapped('date_range_id.date_end')
+        self.assertTrue(all(d <= max(estimate_ends) for d in dates))
+        for move in moves:
+            self.assertEqual(move.mrp_date, move.current_date)
+            self.assertEqual(move.mrp_qty, move.current_qty * 7)
+        self.assertTrue(moves.mapped('company_id'))
+        self.assertEqual(moves.mapped('mrp_area_id'), self.mrp_area)
+
+    def test_26_pegging(self):
+        """Demand is pegged to the supply covering it, and the components
+        planned orders can be traced back to the independent demand."""
+        fp_1_demand = self.mrp_move_obj.search([
+            ('product_id', '=', self.fp_1.id),
+            ('mrp_type', '=', 'd'),
+            ('mrp_origin', '=', 'mv')])
+        self.assertEqual(len(fp_1_demand), 1)
+        pp_1_demand = self.mrp_move_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('mrp_type', '=', 'd')])
+        for move in fp_1_demand | pp_1_demand:
+            pegging = self.env['mrp.pegging'].search([
+                ('demand_move_id', '=', move.id)])
+            self.assertAlmostEqual(sum(pegging.mapped('qty')), -move.mrp_qty)
+        pp_1_orders = self.planned_order_obj.search([
+            ('product_id', '=', self.pp_1.id)])
+        demand = pp_1_orders.get_pegged_demand()
+        self.assertIn(fp_1_demand.id, demand)
+        self.assertFalse(self.mrp_move_obj.browse(list(demand)).filtered(
+            lambda m: m.mrp_origin == 'mrp'))
+        downstream = fp_1_demand.get_pegged_supply()
+        self.assertIn(self.pp_1, downstream.mapped('product_id'))
+
+    def test_27_procure_bulk(self):
+        """Large selections are released in bulk, grouping the planned
+        orders by product, location and date."""
+        self.env['ir.config_parameter'].sudo().set_param(
+            'mrp_multi_level.procure_bulk_threshold', 0)
+        mrp_invs = self.mrp_inventory_obj.search([
+            ('product_mrp_area_id.product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id),
+            ('to_procure', '>', 0.0)])
+        orders = mrp_invs.mapped('planned_order_ids')
+        wiz = self.mrp_inventory_procure_wiz.with_context({
+            'active_model': 'mrp.inventory',
+            'active_ids': mrp_invs.ids,
+        }).create({})
+        self.assertTrue(wiz.bulk)
+        self.assertFalse(wiz.item_ids)
+        self.assertEqual(wiz.procurement_count,
+                         len(set(orders.mapped('due_date'))))
+        wiz.make_procurement()
+        for order in orders:
+            self.assertEqual(order.qty_released, order.mrp_qty)
+        self.assertFalse(any(mrp_invs.mapped('to_procure')))
+        po_lines = self.env['purchase.order.line'].search([
+            ('product_id', '=', self.pp_1.id)])
+        self.assertAlmostEqual(
+            sum(po_lines.mapped('product_qty')),
+            sum(orders.mapped('mrp_qty')))
+
+    def test_28_stored_supply_method(self):
+        """Supply method and lead time are stored, and refreshed when the
+        routes of the product change."""
+        pma = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id)])
+        self.env.cr.execute("""
+            SELECT supply_method, mrp_lead_time FROM product_mrp_area
+            WHERE id = %s
+        """, (pma.id, ))
+        self.assertEqual(
+            self.env.cr.fetchone(),
+            ('buy', pma.main_supplierinfo_id.delay))
+        self.pp_1.route_ids = [(5, 0, 0)]
+        self.assertNotEqual(pma.supply_method, 'buy')
+        self.assertFalse(pma.main_supplier_id)
+        pma._recompute_supply_method()
+        self.assertNotEqual(pma.supply_method, 'buy')
+        # Transfers take the delay of their rule:
+        route = self.env['stock.location.route'].create({
+            'name': 'Resupply Test location',
+            'product_selectable': True,
+            'pull_ids': [(0, 0, {
+                'name': 'Stock -> Test location',
+                'action': 'move',
+                'location_id': self.sec_loc.id,
+                'location_src_id': self.wh.lot_stock_id.id,
+                'picking_type_id': self.wh.int_type_id.id,
+                'warehouse_id': self.wh.id,
+                'delay': 3,
+            })],
+        })
+        self.prod_test.route_ids = [(6, 0, route.ids)]
+        pma = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.prod_test.id),
+            ('mrp_area_id', '=', self.secondary_area.id)])
+        self.assertEqual(pma.supply_method, 'move')
+        self.assertEqual(pma.mrp_lead_time, 3)
+        route.pull_ids.delay = 5
+        self.assertEqual(pma.mrp_lead_time, 5)
+        # The release dates of the inventories are only computed by the
+        # MRP run, not on every change of the lead times:
+        self.assertNotIn(
+            'product_mrp_area_id.mrp_lead_time',
+            self.mrp_inventory_obj._fields['order_release_date'].depends)
+
+    def test_29_export_csv(self):
+        """MRP results are streamed by chunks from a server-side cursor."""
+        data = b''.join(self.env['mrp.export']._export_csv(
+            'inventory', mrp_areas=self.mrp_area, chunk_size=5))
+        rows = list(csv.reader(io.StringIO(data.decode('utf-8'))))
+        self.assertEqual(rows[0][:4], [
+            'mrp_area', 'default_code', 'product', 'date'])
+        self.assertEqual(len(rows) - 1, self.mrp_inventory_obj.search_count(
+            [('mrp_area_id', '=', self.mrp_area.id)]))
+        self.assertEqual({row[0] for row in rows[1:]}, {self.mrp_area.name})
+        chunks = list(self.env['mrp.export']._iter_export_chunks(
+            'planned_order', mrp_areas=self.mrp_area, chunk_size=5))
+        self.assertTrue(all(len(chunk) <= 5 for chunk in chunks))
+        self.assertEqual(
+            sum(len(chunk) for chunk in chunks),
+            self.planned_order_obj.search_count(
+                [('mrp_area_id', '=', self.mrp_area.id)]))
+        # Malformed area ids are a bad request rather than a server error:
+        self.assertEqual(
+            MrpExportController._parse_mrp_area_ids('3,12'), {3, 12})
+        with self.assertRaises(BadRequest):
+            MrpExportController._parse_mrp_area_ids('3,main')
+
+    def test_30_horizon_and_buckets(self):
+        """Inventories are aggregated by week and what is planned after
+        the horizon is collapsed on its last day."""
+        domain = [('mrp_area_id', '=', self.mrp_area.id)]
+        demand = sum(self.mrp_move_obj.search(
+            domain + [('mrp_type', '=', 'd'),
+                      ('mrp_origin', '!=', 'mrp')]).mapped('mrp_qty'))
+        self.mrp_area.write({
+            'planning_horizon': 14,
+            'inventory_bucket': 'week',
+        })
+        horizon = fields.Date.to_string(
+            datetime.today() + timedelta(days=14))
+        today = fields.Date.today()
+        self.mrp_multi_level_wiz.create({
+            'mrp_area_ids': [(6, 0, self.mrp_area.ids)],
+        }).run_mrp_multi_level()
+        moves = self.mrp_move_obj.search(domain)
+        self.assertTrue(all(d <= horizon for d in moves.mapped('mrp_date')))
+        self.assertAlmostEqual(sum(moves.filtered(
+            lambda m: m.mrp_type == 'd' and m.mrp_origin != 'mrp'
+        ).mapped('mrp_qty')), demand)
+        for inventory in self.mrp_inventory_obj.search(domain):
+            inv_date = fields.Date.from_string(inventory.date)
+            self.assertTrue(
+                inventory.date in (today, horizon) or
+                inv_date.weekday() == 0)
+            self.assertLessEqual(inventory.date, horizon)
+
+    def test_31_stock_move_data_batch(self):
+        """The batch preparation of the stock move data gives the same
+        values as the single move one."""
+        wiz = self.mrp_multi_level_wiz
+        pmas = self.product_mrp_area_obj.search([
+            ('mrp_area_id', '=', self.mrp_area.id)])
+        pma_by_product = {pma.product_id.id: pma for pma in pmas}
+        for direction, domain in (
+                ('in', wiz._in_stock_moves_domain(pmas)),
+                ('out', wiz._out_stock_moves_domain(pmas))):
+            moves = self.env['stock.move'].search(domain)
+            batch = wiz._prepare_mrp_move_data_from_stock_moves(
+                pmas, moves, direction=direction)
+            self.assertEqual(len(batch), len(moves))
+            for move, vals in zip(moves, batch):
+                single = wiz._prepare_mrp_move_data_from_stock_move(
+                    pma_by_product[move.product_id.id], move,
+                    direction=direction)
+                self.assertEqual(
+                    fields.Date.to_string(vals.pop('current_date')),
+                    fields.Date.to_string(fields.Datetime.from_string(
+                        single.pop('current_date'))))
+                self.assertEqual(vals, single)
+
+    def test_32_mrp_applicable_delta(self):
+        """Only the product MRP areas whose MRP applicable flag changes are
+        updated, returned and queued for the net change runs."""
+        pma = self.product_mrp_area_obj.search([
+            ('product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id)])
+        pma.mrp_applicable = False
+        self.env['mrp.dirty.product'].search([]).unlink()
+        changed = self.mrp_multi_level_wiz._calculate_mrp_applicable(
+            self.mrp_area)
+        self.assertEqual(changed, pma)
+        self.assertTrue(pma.mrp_applicable)
+        self.assertTrue(self.env['mrp.dirty.product'].search([
+            ('product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id)]))
+        self.assertFalse(
+            self.mrp_multi_level_wiz._calculate_mrp_applicable(
+                self.mrp_area))
+        # The flags are compared once adjusted by _adjust_mrp_applicable,
+        # the rows it flips back on every run are not reported:
+        self.env['mrp.dirty.product'].search([]).unlink()
+        pp_1 = self.pp_1
+        wiz_class = type(self.mrp_multi_level_wiz)
+
+        def _adjust_mrp_applicable(wiz, mrp_areas):
+            wiz.env['product.mrp.area'].search([
+                ('product_id', '=', pp_1.id),
+            ]).write({'mrp_applicable': False})
+            return True
+
+        with patch.object(
+                wiz_class, '_adjust_mrp_applicable', _adjust_mrp_applicable):
+            changed = self.mrp_multi_level_wiz._calculate_mrp_applicable(
+                self.mrp_area)
+            self.assertEqual(changed, pma)
+            self.assertFalse(pma.mrp_applicable)
+            self.assertFalse(
+                self.mrp_multi_level_wiz._calculate_mrp_applicable(
+                    self.mrp_area))
+        self.assertEqual(
+            self.env['mrp.dirty.product'].search([]).mapped('product_id'),
+            self.pp_1)
+
+    def test_33_result_indexes(self):
+        """The MRP result tables are indexed by product MRP area and date
+        instead of single columns."""
+        self.cr.execute("""
+            SELECT indexname FROM pg_indexes
+            WHERE tablename IN ('mrp_move', 'mrp_inventory',
+                                'mrp_planned_order', 'mrp_pegging')
+        """)
+        indexes = {row[0] for row in self.cr.fetchall()}
+        for name in ('mrp_move_pma_date_type_index',
+                     'mrp_inventory_pma_date_index',
+                     'mrp_planned_order_pma_due_date_index',
+                     'mrp_move_stock_move_id_partial_index',
+                     'mrp_move_mrp_run_id_inactive_index',
+                     'mrp_pegging_demand_order_index',
+                     'mrp_pegging_order_demand_index',
+                     'mrp_pegging_mrp_run_id_inactive_index'):
+            self.assertIn(name, indexes)
+        for name in ('mrp_move_parent_product_id_index',
+                     'mrp_move_product_mrp_area_id_index',
+                     'mrp_pegging_mrp_run_id_index',
+                     'mrp_pegging_demand_move_id_index',
+                     'mrp_pegging_product_mrp_area_id_index'):
+            self.assertNotIn(name, indexes)
+
+    def test_34_background_run(self):
+        """Background runs are queued, computed step by step and resumed
+        from their last completed step."""
+        domain = [('mrp_area_id', '=', self.secondary_area.id)]
+        move_count = self.mrp_move_obj.search_count(domain)
+        order_count = self.planned_order_obj.search_count(domain)
+        inv_count = self.mrp_inventory_obj.search_count(domain)
+        self.mrp_multi_level_wiz.create({
+            'mrp_area_ids': [(6, 0, self.secondary_area.ids)],
+            'background': True,
+        }).run_mrp_multi_level()
+        run = self.env['mrp.run'].search([], limit=1)
+        self.assertEqual(run.state, 'queued')
+        self.env['mrp.run']._process_mrp_run_queue(commit=False)
+        self.assertEqual(run.state, 'done')
+        self.assertEqual(self.mrp_move_obj.search_count(domain), move_count)
+        self.assertEqual(
+            self.planned_order_obj.search_count(domain), order_count)
+        self.assertEqual(
+            self.mrp_inventory_obj.search_count(domain), inv_count)
+        self.assertTrue(run.product_total)
+        self.assertEqual(run.product_count, run.product_total)
+        self.assertEqual(run.progress, 100.0)
+        steps = run.completed_steps.split()
+        final_step = 'final_process-%s' % self.secondary_area.id
+        self.assertEqual(steps[-1], final_step)
+        # Interrupted before its last step, only that one is run again:
+        self.mrp_inventory_obj.search(domain).unlink()
+        run.write({
+            'state': 'running',
+            'completed_steps': '\n'.join(steps[:-1]),
+        })
+        self.env['mrp.run']._process_mrp_run_queue(commit=False)
+        self.assertEqual(run.state, 'done')
+        self.assertEqual(run.attempt_count, 2)
+        self.assertEqual(self.mrp_move_obj.search_count(domain), move_count)
+        self.assertEqual(
+            self.mrp_inventory_obj.search_count(domain), inv_count)
+        # Cancelled runs are not computed:
+        run = self.env['mrp.run'].create({
+            'background': True,
+            'state': 'queued',
+        })
+        run.action_cancel()
+        self.env['mrp.run']._process_mrp_run_queue(commit=False)
+        self.assertEqual(run.state, 'cancel')
+        self.assertFalse(run.completed_steps)
+
+    def test_35_cleanup_keeps_resumable_runs(self):
+        """The results of failed background isolated runs are kept by the
+        cleanup and the garbage collector until the run is cancelled."""
+        run = self.env['mrp.run'].create({
+            'background': True,
+            'snapshot': True,
+            'state': 'failed',
+        })
+        invs = self.mrp_inventory_obj.search([
+            ('mrp_area_id', '=', self.secondary_area.id)])
+        invs.write({'active': False, 'mrp_run_id': run.id})
+        self.mrp_multi_level_wiz._mrp_cleanup(self.env['mrp.area'])
+        self.assertEqual(invs.exists(), invs)
+        self.assertFalse(self.mrp_inventory_obj.search([]))
+        self.env['mrp.run']._gc_mrp_snapshots()
+        self.assertEqual(invs.exists(), invs)
+        run.action_cancel()
+        self.env['mrp.run']._gc_mrp_snapshots()
+        self.assertFalse(invs.exists())
+
+    def test_36_procure_bulk_background(self):
+        """Background bulk releases are queued and processed by batches,
+        recording their progress."""
+        self.env['ir.config_parameter'].sudo().set_param(
+            'mrp_multi_level.procure_bulk_threshold', 0)
+        mrp_invs = self.mrp_inventory_obj.search([
+            ('product_mrp_area_id.product_id', '=', self.pp_1.id),
+            ('mrp_area_id', '=', self.mrp_area.id),
+            ('to_procure', '>', 0.0)])
+        orders = mrp_invs.mapped('planned_order_ids')
+        wiz = self.mrp_inventory_procure_wiz.with_context({
+            'active_model': 'mrp.inventory',
+            'active_ids': mrp_invs.ids,
+        }).create({'background': True})
+        action = wiz.make_procurement()
+        job = self.env['mrp.inventory.procure.job'].browse(action['res_id'])
+        self.assertEqual(job.state, 'queued')
+        self.assertFalse(any(orders.mapped('qty_released')))
+        job._process_queue(commit=False)
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.procurement_done, job.procurement_count)
+        self.assertEqual(job.progress, 100.0)
+        self.assertFalse(job.error)
+        for order in orders:
+            self.assertEqual(order.qty_released, order.mrp_qty)
+
+    def test_37_parallel_run(self):
+        """Parallel runs compute every MRP area in its own area run, the
+        net change queue of an area that fails being kept."""
+        dirty_obj = self.env['mrp.dirty.product']
+        dirty_obj.enqueue(self.prod_test)
+        self.mrp_multi_level_wiz.create({
+            'net_change': True,
+            'parallel': True,
+        }).run_mrp_multi_level()
+        run = self.env['mrp.run'].search([('parent_id', '=', False)], limit=1)
+        self.assertEqual(run.state, 'running')
+        self.assertEqual(
+            run.child_ids.mapped('mrp_area_ids'), self.mrp_area_obj.search([]))
+        self.assertEqual(set(run.child_ids.mapped('state')), {'queued'})
+        self.assertTrue(run.worker_cron_ids)
+        self.assertEqual(
+            set(run.worker_cron_ids.mapped('numbercall')), {1})
+        # The products queued for all the areas are queued for each one:
+        queue = dirty_obj.search([('product_id', '=', self.prod_test.id)])
+        self.assertEqual(
+            queue.mapped('mrp_area_id'), self.mrp_area | self.secondary_area)
+        wiz_class = type(self.mrp_multi_level_wiz)
+        run_mrp_area = wiz_class._run_mrp_area
+        secondary_area = self.secondary_area
+
+        def _run_mrp_area(wiz, mrp_area, *args, **kwargs):
+            if mrp_area == secondary_area:
+                raise UserError('Area failure')
+            return run_mrp_area(wiz, mrp_area, *args, **kwargs)
+
+        with patch.object(wiz_class, '_run_mrp_area', _run_mrp_area):
+            self.env['mrp.run']._process_mrp_area_runs(run.id, commit=False)
+        failed = run.child_ids.filtered(lambda r: r.state == 'failed')
+        self.assertEqual(failed.mrp_area_ids, self.secondary_area)
+        self.assertIn('Area failure', failed.error)
+        self.assertEqual(
+            set((run.child_ids - failed).mapped('state')), {'done'})
+        self.assertEqual(run.state, 'failed')
+        self.assertIn(self.secondary_area.name, run.error)
+        # Only the queue of the area that failed is left for the next run:
+        queue = dirty_obj.search([('product_id', '=', self.prod_test.id)])
+        self.assertEqual(queue.mapped('mrp_area_id'), self.secondary_area)
@@ -2,8 +2,13 @@
 #   (http://www.eficent.com)
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
 
+import logging
+
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools.misc import split_every
+
+_logger = logging.getLogger(__name__)
 
 
 class MrpInventoryProcure(models.TransientModel):
@@ -15,6 +20,31 @@ class MrpInventoryProcure(models.TransientModel):
         inverse_name='wiz_id',
         string='Items',
     )
+    bulk = fields.Boolean(
+        string='Bulk Release', readonly=True,
+        help="Too many planned orders are selected to be listed. The whole "
+             "quantity left of each of them is released, with one "
+             "procurement per product, location and date.",
+    )
+    background = fields.Boolean(
+        string='Run in Background',
+        help="Queue the release, to be processed by a scheduled action "
+             "committing after each batch of procurements. Its progress and "
+             "errors are shown in the MRP releases.",
+    )
+    mrp_inventory_ids = fields.Many2many(
+        comodel_name='mrp.inventory', string='MRP Inventories',
+    )
+    procurement_count = fields.Integer(
+        string='Procurements', compute='_compute_procurement_count',
+    )
+
+    @api.multi
+    @api.depends('mrp_inventory_ids', 'bulk')
+    def _compute_procurement_count(self):
+        for rec in self.filtered('bulk'):
+            rec.procurement_count = len(
+                rec._get_bulk_procurements(rec.mrp_inventory_ids))
 
     @api.model
     def _prepare_item(self, planned_order):
@@ -58,6 +88,16 @@ class MrpInventoryProcure(models.TransientModel):
 
         assert active_model == 'mrp.inventory', 'Bad context propagation'
 
+        res['mrp_inventory_ids'] = [(6, 0, mrp_inventory_ids)]
+        threshold = int(self.env['ir.config_parameter'].sudo().get_param(
+            'mrp_multi_level.procure_bulk_threshold', 200))
+        self.env.cr.execute("""
+            SELECT count(*) FROM mrp_planned_order
+            WHERE mrp_inventory_id IN %s AND qty_released < mrp_qty
+        """, (tuple(mrp_inventory_ids), ))
+        if self.env.cr.fetchone()[0] > threshold:
+            res['bulk'] = True
+            return res
         items = item_obj = self.env['mrp.inventory.procure.item']
         for line in mrp_inventory_obj.browse(mrp_inventory_ids).mapped(
                 'planned_order_ids'):
@@ -66,9 +106,81 @@ class MrpInventoryProcure(models.TransientModel):
         res['item_ids'] = [(6, 0, items.ids)]
         return res
 
+    @api.model
+    def _get_bulk_procurements(self, mrp_inventories):
+        """Quantity left to release of the planned orders of
+        ``mrp_inventories``, grouped by product, location, warehouse and
+        date. Returns a list of dicts with the ids of the planned orders of
+        every group."""
+        if not mrp_inventories:
+            return []
+        self.env.cr.execute("""
+            SELECT po.product_id,
+                coalesce(pma.location_proc_id, area.location_id)
+                    AS location_id,
+                area.warehouse_id, po.due_date AS date_planned,
+                sum(po.mrp_qty - po.qty_released) AS qty,
+                array_agg(po.id ORDER BY po.id) AS planned_order_ids
+            FROM mrp_planned_order po
+            JOIN product_mrp_area pma ON pma.id = po.product_mrp_area_id
+            JOIN mrp_area area ON area.id = pma.mrp_area_id
+            WHERE po.mrp_inventory_id IN %s
+            AND po.qty_released < po.mrp_qty
+            GROUP BY po.product_id, 2, area.warehouse_id, po.due_date
+            ORDER BY po.due_date, po.product_id
+        """, (tuple(mrp_inventories.ids), ))
+        return self.env.cr.dictfetchall()
+
+    @api.model
+    def _run_bulk_procurements(self, procurements, commit=False, job=None):
+        """Run one procurement per group and release their planned orders
+        by batches. With ``commit``, every batch is committed, with the
+        progress of the release ``job`` if any. Returns the error
+        messages."""
+        batch_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            'mrp_multi_level.procure_batch_size', 100))
+        product_obj = self.env['product.product']
+        location_obj = self.env['stock.location']
+        warehouse_obj = self.env['stock.warehouse']
+        name = 'INT: ' + str(self.env.user.login)
+        errors = []
+        batch_errors = done = 0
+        for batch in split_every(batch_size, procurements):
+            released = []
+            for vals in batch:
+                product = product_obj.browse(vals['product_id'])
+                values = {
+                    'date_planned': fields.Datetime.to_string(
+                        fields.Date.from_string(vals['date_planned'])),
+                    'warehouse_id': warehouse_obj.browse(
+                        vals['warehouse_id']),
+                    'group_id': False,
+                }
+                try:
+                    with self.env.cr.savepoint():
+                        self.env['procurement.group'].run(
+                            product, vals['qty'], product.uom_id,
+                            location_obj.browse(vals['location_id']),
+                            name, name, values)
+                    released += vals['planned_order_ids']
+                except UserError as error:
+                    errors.append(error.name)
+            self.env['mrp.planned.order'].browse(released)._release_all()
+            done += len(batch)
+            if job is not None:
+                job._add_progress(len(batch), errors[batch_errors:])
+                batch_errors = len(errors)
+            if commit:
+                self.env.cr.commit()
+                _logger.info('MRP procurement: %s/%s groups released',
+                             done, len(procurements))
+        return errors
+
     @api.multi
     def make_procurement(self):
         self.ensure_one()
+        if self.bulk:
+            return self._make_bulk_procurement()
         errors = []
         for item in self.item_ids:
             if not item.qty:
@@ -92,6 +204,28 @@ class MrpInventoryProcure(models.TransientModel):
                 raise UserError('\n'.join(errors))
         return {'type': 'ir.actions.act_window_close'}
 
+    @api.multi
+    def _make_bulk_procurement(self):
+        if self.background:
+            job = self.env['mrp.inventory.procure.job'].create({
+                'mrp_inventory_ids': [(6, 0, self.mrp_inventory_ids.ids)],
+                'procurement_count': self.procurement_count,
+            })
+            action = self.env.ref(
+                'mrp_multi_level.mrp_inventory_procure_job_action')
+            result = action.read()[0]
+            result.update({
+                'res_id': job.id,
+                'view_mode': 'form',
+                'views': [(False, 'form')],
+            })
+            return result
+        procurements = self._get_bulk_procurements(self.mrp_inventory_ids)
+        errors = self._run_bulk_procurements(procurements)
+        if errors:
+            raise UserError('\n'.join(errors))
+        return {'type': 'ir.actions.act_window_close'}
+
 
 class MrpInventoryProcureItem(models.TransientModel):
     _name = 'mrp.inventory.procure.item'
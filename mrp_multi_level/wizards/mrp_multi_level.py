@@ -6,11 +6,115 @@
 
 from odoo import api, fields, models, exceptions, _
 from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT
+from odoo.tools.misc import split_every
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
+from functools import partial
 import logging
-from odoo.tools.float_utils import float_round
+import time
+import psycopg2
+from odoo.tools.float_utils import float_compare, float_round
+from ..models.mrp_run import MrpRunProfiler
 logger = logging.getLogger(__name__)
 
+INSERT_BATCH_SIZE = 1000
+# First key of the advisory locks taken on the MRP areas being computed.
+MRP_AREA_LOCK = 0x4d5250
+
+# Lightweight copy of the mrp.move fields used when netting. ``new`` rows are
+# the ones generated by the BoM explosion during the current calculation.
+MrpMoveRow = namedtuple('MrpMoveRow', [
+    'id', 'new', 'product_mrp_area_id', 'mrp_date', 'mrp_type', 'mrp_qty',
+    'mrp_origin', 'name',
+])
+
+
+class MrpNettingBuffer(object):
+    """In-memory state of the MRP calculation of an MRP area.
+
+    Holds the demand and supply time series of every product MRP area and
+    the planned orders, exploded moves, links between them and pegging to
+    be created once the netting is finished.
+    """
+
+    def __init__(self):
+        self.series = defaultdict(list)
+        self.orders = []
+        self.orders_by_pma = defaultdict(list)
+        self.moves = []
+        self.links = []
+        self.pegging = []
+
+    def add_existing_move(self, row):
+        self.series[row.product_mrp_area_id].append(row)
+
+    def add_move(self, vals):
+        """Queue a new mrp.move and push it into the series of its product
+        MRP area. Returns its index in the buffer."""
+        index = len(self.moves)
+        self.moves.append(vals)
+        mrp_date = vals['mrp_date']
+        if not isinstance(mrp_date, date):
+            mrp_date = fields.Date.from_string(mrp_date)
+        self.series[vals['product_mrp_area_id']].append(MrpMoveRow(
+            index, True, vals['product_mrp_area_id'], mrp_date,
+            vals['mrp_type'], vals['mrp_qty'], vals['mrp_origin'],
+            vals['name']))
+        return index
+
+    def add_order(self, vals):
+        """Queue a new planned order. Returns its index in the buffer."""
+        self.orders.append(vals)
+        index = len(self.orders) - 1
+        self.orders_by_pma[vals['product_mrp_area_id']].append(index)
+        return index
+
+    def add_orders(self, vals, count):
+        """Queue ``count`` identical planned orders. Returns their indexes
+        in the buffer."""
+        return [self.add_order(dict(vals)) for __ in range(count)]
+
+    def link(self, order_index, move_index):
+        self.links.append((order_index, move_index))
+
+    def peg(self, demand, supply, qty):
+        """Peg ``qty`` of the ``demand`` move row to ``supply``: a move row,
+        the index of a planned order or None for the stock on hand."""
+        self.pegging.append((demand, supply, qty))
+
+    def get_moves(self, product_mrp_area_id):
+        """Moves of a product MRP area, in the same order than
+        ``mrp.move``: date, supply before demand, then creation order."""
+        return sorted(self.series[product_mrp_area_id], key=lambda r: (
+            r.mrp_date, r.mrp_type != 's', r.new, r.id))
+
+
+class MrpRunCache(object):
+    """Lookups memoized for the duration of an MRP run.
+
+    Only ids are kept, so that the cache does not depend on the cursor it
+    was filled from.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.picking_types = {}
+        self.product_mrp_areas = {}
+        self.on_hand = {}
+        self.boms = {}
+        self.explosions = {}
+        self.bom_line_qty = {}
+
+    def clear(self):
+        self.locations.clear()
+        self.picking_types.clear()
+        self.product_mrp_areas.clear()
+        self.on_hand.clear()
+        self.boms.clear()
+        self.explosions.clear()
+        self.bom_line_qty.clear()
+
 
 class MultiLevelMrp(models.TransientModel):
     _name = 'mrp.multi.level'
@@ -20,21 +124,43 @@ class MultiLevelMrp(models.TransientModel):
         string="MRP Areas to run",
         help="If empty, all areas will be computed.",
     )
+    net_change = fields.Boolean(
+        help="Only recompute the products whose demand, supply or MRP "
+             "parameters changed since the last run, and their components.",
+    )
+    snapshot = fields.Boolean(
+        string="Isolated Run",
+        help="Build the new plan next to the current one, which stays "
+             "visible until the run is finished and is then replaced at "
+             "once. Not available for net change runs.",
+    )
+    exclude_reserved = fields.Boolean(
+        string="Exclude Reserved Stock",
+        help="Do not consider the stock already reserved for other moves as "
+             "available when computing the on hand quantities.",
+    )
+    parallel = fields.Boolean(
+        string="Parallel Run",
+        help="Compute each MRP area in its own transaction, by scheduled "
+             "actions. The areas are computed at the same time when the "
+             "server runs several worker processes. The results of every "
+             "area are committed as soon as it finishes.",
+    )
+    background = fields.Boolean(
+        string="Run in Background",
+        help="Queue the run, to be computed by a scheduled action which "
+             "commits the results of every stage and low level code. The "
+             "run can be followed and cancelled from the MRP runs, and is "
+             "resumed from its last completed stage if interrupted. The "
+             "areas are computed one after the other.",
+    )
 
     # TODO: dates are not being correctly computed for supply...
 
     @api.model
     def _prepare_product_mrp_area_data(self, product_mrp_area):
-        qty_available = 0.0
-        product_obj = self.env['product.product']
-        # TODO: move mrp_qty_available computation, maybe unreserved??
-        location_ids = product_mrp_area.mrp_area_id._get_locations()
-        for location in location_ids:
-            product_l = product_obj.with_context(
-                {'location': location.id}).browse(
-                product_mrp_area.product_id.id)
-            qty_available += product_l.qty_available
-
+        qty_available = self._get_on_hand_by_product_mrp_area(
+            product_mrp_area)[product_mrp_area.id]
         return {
             'product_mrp_area_id': product_mrp_area.id,
             'mrp_qty_available': qty_available,
@@ -73,6 +199,9 @@ class MultiLevelMrp(models.TransientModel):
     @api.model
     def _prepare_mrp_move_data_from_stock_move(
             self, product_mrp_area, move, direction='in'):
+        """Values of the mrp.move of a single stock move. The MRP
+        initialisation uses ``_prepare_mrp_move_data_from_stock_moves``
+        instead, which is the one to extend."""
         if direction == 'out':
             mrp_type = 'd'
             product_qty = -move.product_qty
@@ -164,7 +293,7 @@ class MultiLevelMrp(models.TransientModel):
             'purchase_order_id': None,
             'purchase_line_id': None,
             'stock_move_id': None,
-            'mrp_qty': -(qty * bomline.product_qty),  # TODO: review with UoM
+            'mrp_qty': -(qty * self._get_bom_line_unit_qty(bom, bomline)),
             'current_qty': None,
             'mrp_date': mrp_date_demand_2,
             'current_date': None,
@@ -193,7 +322,7 @@ class MultiLevelMrp(models.TransientModel):
         if calendar and product_mrp_area.mrp_lead_time:
             date_str = fields.Date.to_string(mrp_date)
             dt = fields.Datetime.from_string(date_str)
-            res = calendar.plan_days(
+            res = calendar.plan_working_days(
                 -1 * product_mrp_area.mrp_lead_time - 1, dt)
             mrp_action_date = res.date()
         else:
@@ -201,44 +330,98 @@ class MultiLevelMrp(models.TransientModel):
                 days=product_mrp_area.mrp_lead_time)
         return mrp_action_date, mrp_date_supply
 
+    @api.model
+    def _get_bom_line_unit_qty(self, bom, bomline):
+        """Quantity of the component of ``bomline``, in its product UoM,
+        needed to produce one unit of the product of ``bom``."""
+        cache = self.env.context.get('mrp_cache')
+        if cache is not None and bomline.id in cache.bom_line_qty:
+            return cache.bom_line_qty[bomline.id]
+        line_qty = bomline.product_uom_id._compute_quantity(
+            bomline.product_qty, bomline.product_id.uom_id)
+        bom_qty = bom.product_uom_id._compute_quantity(
+            bom.product_qty, bom.product_tmpl_id.uom_id)
+        unit_qty = line_qty / (bom_qty or 1.0)
+        if cache is not None:
+            cache.bom_line_qty[bomline.id] = unit_qty
+        return unit_qty
+
+    @api.model
+    def _get_explosion_bom(self, product):
+        """BoM used to explode the requirements of ``product``: the first
+        active one with lines."""
+        cache = self.env.context.get('mrp_cache')
+        if cache is not None and product.id in cache.boms:
+            return self.env['mrp.bom'].browse(cache.boms[product.id])
+        bom = self.env['mrp.bom']
+        for product_bom in product.bom_ids:
+            if product_bom.active and product_bom.bom_line_ids:
+                bom = product_bom
+                break
+        if cache is not None:
+            cache.boms[product.id] = bom.id
+        return bom
+
+    @api.model
+    def _get_explosion_lines(self, bom, mrp_area):
+        """BoM lines of ``bom`` to explode in ``mrp_area``, memoized by BoM
+        and MRP area during a run."""
+        cache = self.env.context.get('mrp_cache')
+        key = (bom.id, mrp_area.id)
+        if cache is not None and key in cache.explosions:
+            return self.env['mrp.bom.line'].browse(cache.explosions[key])
+        bomlines = self.env['mrp.bom.line']
+        for bomline in bom.bom_line_ids:
+            if bomline.product_qty <= 0.00 or \
+                    bomline.product_id.type != 'product':
+                continue
+            if self.with_context(mrp_explosion=True)._exclude_from_mrp(
+                    bomline.product_id, mrp_area):
+                # Stop explosion.
+                continue
+            # Fill the unit quantity cache for the explosions to come.
+            self._get_bom_line_unit_qty(bom, bomline)
+            bomlines |= bomline
+        if cache is not None:
+            cache.explosions[key] = bomlines.ids
+        return bomlines
+
     @api.model
     def explode_action(
             self, product_mrp_area_id, mrp_action_date, name, qty, action
     ):
-        """Explode requirements."""
+        """Explode requirements.
+
+        The exploded demand is pushed to the netting buffer, so it is
+        directly available to the components of the next levels.
+        ``action`` is the index of the planned order in the buffer, or the
+        list of indexes of identical orders exploded at once, ``qty``
+        being then the quantity of each one. Every order gets its own
+        exploded moves, the BoM lines being only read once.
+        """
+        netting = self.env.context['mrp_netting']
         mrp_date_demand = mrp_action_date
         if mrp_date_demand < date.today():
             mrp_date_demand = date.today()
-        if not product_mrp_area_id.product_id.bom_ids:
+        bom = self._get_explosion_bom(product_mrp_area_id.product_id)
+        if not bom:
             return False
-        bomcount = 0
-        for bom in product_mrp_area_id.product_id.bom_ids:
-            if not bom.active or not bom.bom_line_ids:
-                continue
-            bomcount += 1
-            if bomcount != 1:
-                continue
-            for bomline in bom.bom_line_ids:
-                if bomline.product_qty <= 0.00 or \
-                        bomline.product_id.type != 'product':
-                    continue
-                if self.with_context(mrp_explosion=True)._exclude_from_mrp(
-                        bomline.product_id,
-                        product_mrp_area_id.mrp_area_id):
-                    # Stop explosion.
-                    continue
-                # TODO: review: mrp_transit_delay, mrp_inspection_delay
-                mrp_date_demand_2 = mrp_date_demand - timedelta(
-                    days=(product_mrp_area_id.mrp_transit_delay +
-                          product_mrp_area_id.mrp_inspection_delay))
-                move_data = \
-                    self._prepare_mrp_move_data_bom_explosion(
-                        product_mrp_area_id, bomline, qty,
-                        mrp_date_demand_2,
-                        bom, name)
-                mrpmove_id2 = self.env['mrp.move'].create(move_data)
-                if hasattr(action, "mrp_move_down_ids"):
-                    action.mrp_move_down_ids = [(4, mrpmove_id2.id)]
+        # TODO: review: mrp_transit_delay, mrp_inspection_delay
+        mrp_date_demand_2 = mrp_date_demand - timedelta(
+            days=(product_mrp_area_id.mrp_transit_delay +
+                  product_mrp_area_id.mrp_inspection_delay))
+        order_indexes = action if isinstance(action, list) else [action]
+        for bomline in self._get_explosion_lines(
+                bom, product_mrp_area_id.mrp_area_id):
+            move_data = \
+                self._prepare_mrp_move_data_bom_explosion(
+                    product_mrp_area_id, bomline, qty,
+                    mrp_date_demand_2,
+                    bom, name)
+            for order_index in order_indexes:
+                move_index = netting.add_move(dict(move_data))
+                if order_index is not None:
+                    netting.link(order_index, move_index)
         return True
 
     @api.model
@@ -263,20 +446,21 @@ class MultiLevelMrp(models.TransientModel):
         self = self.with_context(auditlog_disabled=True)
 
         qty_ordered = values.get("qty_ordered", 0.0) if values else 0.0
-        qty_to_order = mrp_qty
-        while qty_ordered < mrp_qty:
-            qty = product_mrp_area_id._adjust_qty_to_order(qty_to_order)
-            qty_to_order -= qty
+        to_be_exploded = product_mrp_area_id._to_be_exploded()
+        # Identical orders are prepared and exploded only once.
+        for qty, count in product_mrp_area_id._get_order_quantities(
+                mrp_qty, qty_ordered):
             order_data = self._prepare_planned_order_data(
                 product_mrp_area_id, qty, mrp_date_supply, mrp_action_date,
                 name)
-            planned_order = self.env['mrp.planned.order'].create(order_data)
-            qty_ordered = qty_ordered + qty
+            planned_orders = self.env.context['mrp_netting'].add_orders(
+                order_data, count)
+            qty_ordered = qty_ordered + qty * count
 
-            if product_mrp_area_id._to_be_exploded():
+            if to_be_exploded:
                 self.explode_action(
                     product_mrp_area_id, mrp_action_date,
-                    name, qty, planned_order)
+                    name, qty, planned_orders)
 
         values['qty_ordered'] = qty_ordered
         log_msg = '[%s] %s: qty_ordered = %s' % (
@@ -289,48 +473,321 @@ class MultiLevelMrp(models.TransientModel):
         return values
 
     @api.model
-    def _mrp_cleanup(self, mrp_areas):
+    def _get_mrp_truncatable_tables(self):
+        """Tables of the MRP results that can be emptied with TRUNCATE
+        when every MRP area is cleaned up: the planned orders are kept if
+        some of them are fixed, and a table referenced by a foreign key
+        from a table that is not emptied cannot be truncated."""
+        tables = {
+            'mrp_move_planned_order_rel', 'mrp_pegging', 'mrp_move',
+            'mrp_inventory', 'mrp_planned_order'}
+        self.env.cr.execute(
+            "SELECT 1 FROM mrp_planned_order WHERE fixed LIMIT 1")
+        if self.env.cr.fetchone():
+            tables.discard('mrp_planned_order')
+        self.env.cr.execute("""
+            SELECT confrelid::regclass::text, conrelid::regclass::text
+            FROM pg_constraint
+            WHERE contype = 'f'
+            AND confrelid = ANY(%s::regclass[])
+        """, (list(tables),))
+        references = self.env.cr.fetchall()
+        changed = True
+        while changed:
+            changed = False
+            for referenced, referencing in references:
+                if referenced in tables and referencing not in tables:
+                    tables.discard(referenced)
+                    changed = True
+        return tables
+
+    @api.model
+    def _mrp_cleanup(self, mrp_areas, truncate=False):
+        """Remove the MRP results of ``mrp_areas`` (all when empty) with
+        set-based SQL statements, the fixed planned orders being kept, as
+        well as the results of the isolated runs being computed or that
+        can be resumed.
+
+        With ``truncate``, the tables are emptied with TRUNCATE when every
+        MRP area is cleaned up. As TRUNCATE locks the tables against any
+        read until the end of the transaction, it is only meant for the
+        callers committing the cleanup right away.
+        """
         logger.info('Start MRP Cleanup')
-        domain = []
-        if mrp_areas:
-            domain += [('mrp_area_id', 'in', mrp_areas.ids)]
-        self.env['mrp.move'].search(domain).unlink()
-        self.env['mrp.inventory'].search(domain).unlink()
-        domain += [('fixed', '=', False)]
-        self.env['mrp.planned.order'].search(domain).unlink()
-        logger.info('End MRP Cleanup')
+        truncated = set()
+        all_areas = self.env['mrp.area'].with_context(
+            active_test=False).search([])
+        kept_runs = self.env['mrp.run']._get_runs_keeping_results()
+        if not mrp_areas or mrp_areas == all_areas:
+            if truncate and not kept_runs:
+                truncated = self._get_mrp_truncatable_tables()
+            if truncated:
+                self.env.cr.execute(
+                    'TRUNCATE %s' % ', '.join(sorted(truncated)))
+            where, params = 'TRUE', ()
+        else:
+            where = 'mrp_area_id IN %s'
+            params = (tuple(mrp_areas.ids),)
+        if kept_runs:
+            where += ' AND (active OR mrp_run_id IS NULL ' \
+                     'OR mrp_run_id NOT IN %s)'
+            params += (tuple(kept_runs.ids),)
+        if 'mrp_move_planned_order_rel' not in truncated:
+            self.env.cr.execute("""
+                DELETE FROM mrp_move_planned_order_rel
+                WHERE move_down_id IN (SELECT id FROM mrp_move WHERE %s)
+            """ % where, params)
+        for table in ('mrp_pegging', 'mrp_move', 'mrp_inventory'):
+            if table not in truncated:
+                self.env.cr.execute(
+                    'DELETE FROM %s WHERE %s' % (table, where), params)
+        if 'mrp_planned_order' not in truncated:
+            self.env.cr.execute("""
+                DELETE FROM mrp_planned_order
+                WHERE %s AND NOT coalesce(fixed, FALSE)
+            """ % where, params)
+        # The deleted records may be in the cache of any model, through
+        # their one2many and many2many fields.
+        self.env['mrp.move'].invalidate_cache()
+        logger.info('End MRP Cleanup%s', truncated and ' (truncated)' or '')
+        return True
+
+    @api.model
+    def _mrp_cleanup_net_change(self, product_mrp_areas):
+        """Remove the MRP results of the given product MRP areas only.
+
+        The demand exploded from planned orders of product MRP areas that
+        are not recomputed is kept.
+        """
+        logger.info('Start MRP Cleanup (net change)')
+        planned_orders = self.env['mrp.planned.order'].search([
+            ('product_mrp_area_id', 'in', product_mrp_areas.ids),
+            ('fixed', '=', False),
+        ])
+        moves = self.env['mrp.move'].search([
+            ('product_mrp_area_id', 'in', product_mrp_areas.ids)])
+        moves = moves.filtered(
+            lambda m: m.mrp_origin != 'mrp' or not (
+                m.planned_order_up_ids.mapped('product_mrp_area_id') -
+                product_mrp_areas))
+        moves |= planned_orders.mapped('mrp_move_down_ids')
+        # The pegging of the kept moves is computed again as well. Pegging
+        # rows belong to the product MRP area of their demand move.
+        self.env.cr.execute("""
+            DELETE FROM mrp_pegging
+            WHERE demand_move_id IN (
+                SELECT id FROM mrp_move WHERE product_mrp_area_id IN %s)
+        """, (tuple(product_mrp_areas.ids) or (None, ), ))
+        moves.unlink()
+        self.env['mrp.inventory'].search([
+            ('product_mrp_area_id', 'in', product_mrp_areas.ids)]).unlink()
+        planned_orders.unlink()
+        logger.info('End MRP Cleanup (net change)')
         return True
 
+    @api.model
+    def _consume_net_change_queue(self, mrp_areas, include_pending=True):
+        """Return the products queued as changed, by MRP area, removing them
+        from the queue. Without ``include_pending``, the products queued
+        for all the areas are left in the queue."""
+        queue_obj = self.env['mrp.dirty.product']
+        all_areas = self.env['mrp.area'].search([])
+        if not mrp_areas:
+            mrp_areas = all_areas
+        if not mrp_areas:
+            return defaultdict(set)
+        self.env.cr.execute("""
+            SELECT id, product_id, mrp_area_id
+            FROM mrp_dirty_product
+            WHERE (%s AND mrp_area_id IS NULL) OR mrp_area_id IN %s
+            FOR UPDATE
+        """, (include_pending, tuple(mrp_areas.ids)))
+        rows = self.env.cr.fetchall()
+        product_ids_by_area = defaultdict(set)
+        pending_product_ids = set()
+        for __, product_id, mrp_area_id in rows:
+            if mrp_area_id:
+                product_ids_by_area[mrp_area_id].add(product_id)
+                continue
+            pending_product_ids.add(product_id)
+            for mrp_area in mrp_areas:
+                product_ids_by_area[mrp_area.id].add(product_id)
+        if rows:
+            self.env.cr.execute(
+                "DELETE FROM mrp_dirty_product WHERE id IN %s",
+                (tuple(row[0] for row in rows), ))
+        # Products queued for all the areas are still pending for the areas
+        # not being computed.
+        products = self.env['product.product'].browse(pending_product_ids)
+        for mrp_area in all_areas - mrp_areas:
+            queue_obj.enqueue(products, mrp_area=mrp_area)
+        return product_ids_by_area
+
+    @api.model
+    def _split_net_change_queue(self):
+        """Queue the products queued for all the areas for each one of
+        them, so that the queue of every area can be consumed on its
+        own."""
+        queue_obj = self.env['mrp.dirty.product']
+        self.env.cr.execute("""
+            SELECT id, product_id FROM mrp_dirty_product
+            WHERE mrp_area_id IS NULL
+            FOR UPDATE
+        """)
+        rows = self.env.cr.fetchall()
+        if not rows:
+            return
+        products = self.env['product.product'].browse(
+            set(row[1] for row in rows))
+        for mrp_area in self.env['mrp.area'].search([]):
+            queue_obj.enqueue(products, mrp_area=mrp_area)
+        self.env.cr.execute(
+            "DELETE FROM mrp_dirty_product WHERE id IN %s",
+            (tuple(row[0] for row in rows), ))
+
+    @api.model
+    def _get_bom_components(self, products):
+        """Return the components of ``products`` at any BoM level."""
+        bom_line_obj = self.env['mrp.bom.line']
+        components = products.browse()
+        todo = products
+        while todo:
+            bom_lines = bom_line_obj.search([
+                ('bom_id.product_tmpl_id', 'in',
+                 todo.mapped('product_tmpl_id').ids)])
+            todo = bom_lines.mapped('product_id') - components - products
+            components |= todo
+        return components
+
+    @api.model
+    def _get_net_change_product_mrp_areas(self, mrp_areas,
+                                          include_pending=True):
+        """Product MRP areas to recompute in a net change run: the queued
+        ones and the ones of their components in the same MRP area."""
+        product_obj = self.env['product.product']
+        product_mrp_areas = self.env['product.mrp.area']
+        product_ids_by_area = self._consume_net_change_queue(
+            mrp_areas, include_pending=include_pending)
+        for mrp_area_id, product_ids in product_ids_by_area.items():
+            products = product_obj.browse(product_ids)
+            products |= self._get_bom_components(products)
+            product_mrp_areas |= product_mrp_areas.search([
+                ('mrp_area_id', '=', mrp_area_id),
+                ('product_id', 'in', products.ids),
+            ])
+        log_msg = 'MRP net change: %s product MRP areas to recompute' % (
+            len(product_mrp_areas))
+        logger.info(log_msg)
+        return product_mrp_areas
+
+    @api.model
+    def _get_llc_fingerprint(self):
+        """Digest of everything the low level codes depend on: the active
+        BoM structure and the active products."""
+        self.env.cr.execute("""
+            SELECT md5(string_agg(
+                bom.id || ':' || bom.product_tmpl_id || ':' || line.product_id,
+                ',' ORDER BY line.id)) || '-' || (
+                    SELECT count(*) FROM product_product WHERE active)
+            FROM mrp_bom_line AS line
+            JOIN mrp_bom AS bom ON bom.id = line.bom_id
+            WHERE bom.active
+        """)
+        return self.env.cr.fetchone()[0] or ''
+
+    @api.model
+    def _get_llc_bom_edges(self):
+        """Return the (parent product, component) pairs of the active BoMs
+        between active products."""
+        self.env.cr.execute("""
+            SELECT DISTINCT parent.id, line.product_id
+            FROM mrp_bom_line AS line
+            JOIN mrp_bom AS bom ON bom.id = line.bom_id
+            JOIN product_product AS parent
+                ON parent.product_tmpl_id = bom.product_tmpl_id
+            JOIN product_product AS component
+                ON component.id = line.product_id
+            WHERE bom.active AND parent.active AND component.active
+        """)
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _get_bom_cycles(self, nodes, predecessors):
+        """Return the BoM cycles found among ``nodes``, the products that
+        could not be sorted, as lists of product ids."""
+        cycles = []
+        visited = set()
+        for start in nodes:
+            path, index = [], {}
+            node = start
+            while node not in index and node not in visited:
+                index[node] = len(path)
+                path.append(node)
+                node = next(p for p in predecessors[node] if p in nodes)
+            if node in index:
+                cycles.append(list(reversed(path[index[node]:])))
+            visited.update(path)
+        return cycles
+
     @api.model
     def _low_level_code_calculation(self):
         logger.info('Start low level code calculation')
-        counter = 999999
-        llc = 0
-        self.env['product.product'].search([]).write({'llc': llc})
-        products = self.env['product.product'].search([('llc', '=', llc)])
-        if products:
-            counter = len(products)
-        log_msg = 'Low level code 0 finished - Nbr. products: %s' % counter
-        logger.info(log_msg)
+        param_obj = self.env['ir.config_parameter'].sudo()
+        fingerprint = self._get_llc_fingerprint()
+        if fingerprint == param_obj.get_param(
+                'mrp_multi_level.llc_fingerprint'):
+            self.env.cr.execute(
+                "SELECT max(llc) FROM product_product WHERE active")
+            mrp_lowest_llc = (self.env.cr.fetchone()[0] or 0) + 1
+            logger.info('End low level code calculation (no BoM changes)')
+            return mrp_lowest_llc
 
-        while counter:
-            llc += 1
-            products = self.env['product.product'].search(
-                [('llc', '=', llc - 1)])
-            p_templates = products.mapped('product_tmpl_id')
-            bom_lines = self.env['mrp.bom.line'].search(
-                [('product_id.llc', '=', llc - 1),
-                 ('bom_id.product_tmpl_id', 'in', p_templates.ids)])
-            products = bom_lines.mapped('product_id')
-            products.write({'llc': llc})
-            products = self.env['product.product'].search([('llc', '=', llc)])
-            counter = len(products)
-            log_msg = 'Low level code %s finished - Nbr. products: %s' % (
-                llc, counter)
-            logger.info(log_msg)
+        self.env.cr.execute("SELECT id, llc FROM product_product WHERE active")
+        current_llc = dict(self.env.cr.fetchall())
+        children = defaultdict(list)
+        predecessors = defaultdict(list)
+        indegree = dict.fromkeys(current_llc, 0)
+        for parent_id, component_id in self._get_llc_bom_edges():
+            children[parent_id].append(component_id)
+            predecessors[component_id].append(parent_id)
+            indegree[component_id] += 1
+        # Topological sort, the level of a product being the length of the
+        # longest path from a top level product.
+        llc = dict.fromkeys(current_llc, 0)
+        todo = [node for node, count in indegree.items() if not count]
+        while todo:
+            node = todo.pop()
+            for child in children[node]:
+                llc[child] = max(llc[child], llc[node] + 1)
+                indegree[child] -= 1
+                if not indegree[child]:
+                    todo.append(child)
+        unsorted = {node for node, count in indegree.items() if count}
+        if unsorted:
+            product_obj = self.env['product.product']
+            cycles = [' > '.join(product_obj.browse(cycle + cycle[:1]).mapped(
+                'display_name')) for cycle in self._get_bom_cycles(
+                    unsorted, predecessors)]
+            raise exceptions.UserError(_(
+                "The low level codes cannot be computed because of the "
+                "following BoM cycles:\n%s") % '\n'.join(cycles))
 
-        mrp_lowest_llc = llc
-        logger.info('End low level code calculation')
+        product_ids_by_llc = defaultdict(list)
+        for product_id, level in llc.items():
+            if level != current_llc[product_id]:
+                product_ids_by_llc[level].append(product_id)
+        for level, product_ids in product_ids_by_llc.items():
+            self.env.cr.execute(
+                "UPDATE product_product SET llc = %s WHERE id IN %s",
+                (level, tuple(product_ids)))
+        self.env['product.product'].invalidate_cache(['llc'])
+        param_obj.set_param('mrp_multi_level.llc_fingerprint', fingerprint)
+
+        mrp_lowest_llc = max(llc.values() or [0]) + 1
+        updated = sum(len(ids) for ids in product_ids_by_llc.values())
+        log_msg = 'End low level code calculation - Nbr. levels: %s, ' \
+                  'products updated: %s' % (mrp_lowest_llc, updated)
+        logger.info(log_msg)
         return mrp_lowest_llc
 
     @api.model
@@ -342,62 +799,100 @@ class MultiLevelMrp(models.TransientModel):
 
     @api.model
     def _calculate_mrp_applicable(self, mrp_areas):
+        """Flag the product MRP areas of ``mrp_areas`` (all of them when
+        empty) whose product is storable as MRP applicable. A single UPDATE
+        only touches the rows whose flag changes. The product MRP areas
+        whose flag changed once adjusted by ``_adjust_mrp_applicable`` are
+        queued for the net change runs and returned."""
         logger.info('Start Calculate MRP Applicable')
-        domain = []
+        area_clause = ''
+        params = {}
         if mrp_areas:
-            domain += [('mrp_area_id', 'in', mrp_areas.ids)]
-        self.env['product.mrp.area'].search(domain).write(
-            {'mrp_applicable': False})
-        domain += [('product_id.type', '=', 'product')]
-        self.env['product.mrp.area'].search(domain).write(
-            {'mrp_applicable': True})
+            area_clause = " AND pma.mrp_area_id IN %(mrp_areas)s"
+            params['mrp_areas'] = tuple(mrp_areas.ids)
+        flags_query = """
+            SELECT pma.id, coalesce(pma.mrp_applicable, FALSE)
+            FROM product_mrp_area pma
+            WHERE pma.active
+        """ + area_clause
+        self.env.cr.execute(flags_query, params)
+        previous = dict(self.env.cr.fetchall())
+        self.env.cr.execute("""
+            UPDATE product_mrp_area pma
+            SET mrp_applicable = applicable
+            FROM (
+                SELECT pp.id AS product_id,
+                    pp.active AND pt.type = 'product' AS applicable
+                FROM product_product pp
+                JOIN product_template pt ON pt.id = pp.product_tmpl_id
+            ) p
+            WHERE p.product_id = pma.product_id AND pma.active
+            AND pma.mrp_applicable IS DISTINCT FROM p.applicable
+        """ + area_clause, params)
+        self.env['product.mrp.area'].invalidate_cache(['mrp_applicable'])
         self._adjust_mrp_applicable(mrp_areas)
-        count_domain = [('mrp_applicable', '=', True)]
-        if mrp_areas:
-            count_domain += [('mrp_area_id', 'in', mrp_areas.ids)]
-        counter = self.env['product.mrp.area'].search(count_domain, count=True)
-        log_msg = 'End Calculate MRP Applicable: %s' % counter
-        logger.info(log_msg)
-        return True
+        self.env.cr.execute(flags_query, params)
+        changed = self.env['product.mrp.area'].browse([
+            pma_id for pma_id, applicable in self.env.cr.fetchall()
+            if applicable != previous.get(pma_id, False)])
+        for mrp_area in changed.mapped('mrp_area_id'):
+            self.env['mrp.dirty.product'].enqueue(
+                changed.filtered(
+                    lambda a: a.mrp_area_id == mrp_area).mapped('product_id'),
+                mrp_area=mrp_area)
+        logger.info('End Calculate MRP Applicable: %s changed', len(changed))
+        return changed
 
     @api.model
-    def _estimates_domain(self, product_mrp_area):
-        locations = product_mrp_area.mrp_area_id._get_locations()
+    def _estimates_domain(self, product_mrp_areas):
+        locations = self._get_mrp_area_locations(
+            product_mrp_areas.mapped('mrp_area_id'))
         return [
-            ('product_id', '=', product_mrp_area.product_id.id),
+            ('product_id', 'in', product_mrp_areas.mapped('product_id').ids),
             ('location_id', 'in', locations.ids),
             ('date_range_id.date_end', '>=', fields.Date.today()),
         ]
 
     @api.model
-    def _init_mrp_move_from_forecast(self, product_mrp_area):
-        if not product_mrp_area.group_estimate_days:
-            return False
+    def _init_mrp_move_from_forecast(self, product_mrp_areas):
+        """Return the forecast mrp.move values of the given product MRP
+        areas (all of them in the same MRP area), by product MRP area.
+
+        There is one item by demand estimate: its values and the series
+        of dates ``(date_start, date_end, days)`` it is expanded in.
+        """
+        res = defaultdict(list)
+        product_mrp_areas = product_mrp_areas.filtered('group_estimate_days')
+        if not product_mrp_areas:
+            return res
+        pma_by_product = {pma.product_id.id: pma for pma in product_mrp_areas}
         today = fields.Date.today()
-        domain = self._estimates_domain(product_mrp_area)
+        domain = self._estimates_domain(product_mrp_areas)
         estimates = self.env['stock.demand.estimate'].search(domain)
         for rec in estimates:
+            product_mrp_area = pma_by_product[rec.product_id.id]
             start = rec.date_range_id.date_start
             if start < today:
                 start = today
             mrp_date = fields.Date.from_string(start)
             date_end = fields.Date.from_string(rec.date_range_id.date_end)
-            delta = timedelta(days=product_mrp_area.group_estimate_days)
-            while mrp_date <= date_end:
-                mrp_move_data = \
-                    self._prepare_mrp_move_data_from_forecast(
-                        rec, product_mrp_area, mrp_date)
-                self.env['mrp.move'].create(mrp_move_data)
-                mrp_date += delta
-        return True
+            if mrp_date > date_end:
+                continue
+            res[product_mrp_area.id].append((
+                self._prepare_mrp_move_data_from_forecast(
+                    rec, product_mrp_area, mrp_date),
+                (mrp_date, date_end, product_mrp_area.group_estimate_days),
+            ))
+        return res
 
     # TODO: move this methods to product_mrp_area?? to be able to
     # show moves with an action
     @api.model
-    def _in_stock_moves_domain(self, product_mrp_area):
-        locations = product_mrp_area.mrp_area_id._get_locations()
+    def _in_stock_moves_domain(self, product_mrp_areas):
+        locations = self._get_mrp_area_locations(
+            product_mrp_areas.mapped('mrp_area_id'))
         return [
-            ('product_id', '=', product_mrp_area.product_id.id),
+            ('product_id', 'in', product_mrp_areas.mapped('product_id').ids),
             ('state', 'not in', ['done', 'cancel']),
             ('product_qty', '>', 0.00),
             ('location_id', 'not in', locations.ids),
@@ -405,10 +900,11 @@ class MultiLevelMrp(models.TransientModel):
         ]
 
     @api.model
-    def _out_stock_moves_domain(self, product_mrp_area):
-        locations = product_mrp_area.mrp_area_id._get_locations()
+    def _out_stock_moves_domain(self, product_mrp_areas):
+        locations = self._get_mrp_area_locations(
+            product_mrp_areas.mapped('mrp_area_id'))
         return [
-            ('product_id', '=', product_mrp_area.product_id.id),
+            ('product_id', 'in', product_mrp_areas.mapped('product_id').ids),
             ('state', 'not in', ['done', 'cancel']),
             ('product_qty', '>', 0.00),
             ('location_id', 'in', locations.ids),
@@ -416,25 +912,110 @@ class MultiLevelMrp(models.TransientModel):
         ]
 
     @api.model
-    def _init_mrp_move_from_stock_move(self, product_mrp_area):
+    def _prepare_mrp_move_data_from_stock_moves(
+            self, product_mrp_areas, moves, direction='in'):
+        """Batch version of ``_prepare_mrp_move_data_from_stock_move``: the
+        origin, order number and parent product of all ``moves`` are
+        resolved with a single query. ``product_mrp_areas`` holds the
+        product MRP area of every move. Returns a list of values."""
+        if not moves:
+            return []
+        # As in the single move version, the last destination move
+        # belonging to a production gives the origin, and moves with
+        # destination moves but no production get no origin.
+        self.env.cr.execute("""
+            SELECT m.id, m.product_id, m.product_qty, m.date_expected,
+                m.state, m.name, pol.id, pol.order_id, po.name,
+                m.production_id, mp.name, pk.name,
+                EXISTS (SELECT 1 FROM stock_move_move_rel r
+                        WHERE r.move_orig_id = m.id),
+                dest.production_id, dest.name, dest.parent_product_id
+            FROM stock_move m
+            LEFT JOIN purchase_order_line pol ON pol.id = m.purchase_line_id
+            LEFT JOIN purchase_order po ON po.id = pol.order_id
+            LEFT JOIN mrp_production mp ON mp.id = m.production_id
+            LEFT JOIN stock_picking pk ON pk.id = m.picking_id
+            LEFT JOIN LATERAL (
+                SELECT d.production_id, dmp.name,
+                    coalesce(dmp.product_id, d.product_id)
+                        AS parent_product_id
+                FROM stock_move_move_rel r
+                JOIN stock_move d ON d.id = r.move_dest_id
+                JOIN mrp_production dmp ON dmp.id = d.production_id
+                WHERE r.move_orig_id = m.id
+                ORDER BY d.sequence DESC, d.id DESC
+                LIMIT 1
+            ) dest ON TRUE
+            WHERE m.id IN %s
+            ORDER BY m.sequence, m.id
+        """, (tuple(moves.ids), ))
+        pma_by_product = {pma.product_id.id: pma for pma in product_mrp_areas}
+        today = date.today()
+        res = []
+        for (move_id, product_id, product_qty, date_expected, state, name,
+                po_line, po, po_name, mo, mo_name, picking_name, has_dest,
+                dest_mo, dest_mo_name, dest_product_id) in \
+                self.env.cr.fetchall():
+            if direction == 'out':
+                mrp_type = 'd'
+                product_qty = -product_qty
+            else:
+                mrp_type = 's'
+            mrp_mo = origin = order_number = parent_product_id = None
+            if po_line:
+                order_number = po_name
+                origin = 'po'
+            elif mo:
+                order_number = mo_name
+                origin = 'mo'
+                mrp_mo = mo
+            elif has_dest:
+                if dest_mo:
+                    order_number = dest_mo_name
+                    origin = 'mo'
+                    mrp_mo = dest_mo
+                    parent_product_id = dest_product_id
+            else:
+                order_number = picking_name or name
+                origin = 'mv'
+            mrp_date = max(date_expected.date(), today)
+            res.append({
+                'product_id': product_id,
+                'product_mrp_area_id': pma_by_product[product_id].id,
+                'production_id': mrp_mo,
+                'purchase_order_id': po if po_line else None,
+                'purchase_line_id': po_line,
+                'stock_move_id': move_id,
+                'mrp_qty': product_qty,
+                'current_qty': product_qty,
+                'mrp_date': mrp_date,
+                'current_date': date_expected,
+                'mrp_type': mrp_type,
+                'mrp_origin': origin,
+                'mrp_order_number': order_number,
+                'parent_product_id': parent_product_id,
+                'name': order_number,
+                'state': state,
+            })
+        return res
+
+    @api.model
+    def _init_mrp_move_from_stock_move(self, product_mrp_areas):
+        """Return the mrp.move values coming from the open stock moves of
+        the given product MRP areas (all of them in the same MRP area), by
+        product MRP area."""
         # TODO: Should we exclude the quantity done from the moves?
+        res = defaultdict(list)
         move_obj = self.env['stock.move']
-        mrp_move_obj = self.env['mrp.move']
-        in_domain = self._in_stock_moves_domain(product_mrp_area)
+        in_domain = self._in_stock_moves_domain(product_mrp_areas)
         in_moves = move_obj.search(in_domain)
-        out_domain = self._out_stock_moves_domain(product_mrp_area)
+        out_domain = self._out_stock_moves_domain(product_mrp_areas)
         out_moves = move_obj.search(out_domain)
-        if in_moves:
-            for move in in_moves:
-                move_data = self._prepare_mrp_move_data_from_stock_move(
-                    product_mrp_area, move, direction='in')
-                mrp_move_obj.create(move_data)
-        if out_moves:
-            for move in out_moves:
-                move_data = self._prepare_mrp_move_data_from_stock_move(
-                    product_mrp_area, move, direction='out')
-                mrp_move_obj.create(move_data)
-        return True
+        for moves, direction in ((in_moves, 'in'), (out_moves, 'out')):
+            for vals in self._prepare_mrp_move_data_from_stock_moves(
+                    product_mrp_areas, moves, direction=direction):
+                res[vals['product_mrp_area_id']].append(vals)
+        return res
 
     @api.model
     def _prepare_mrp_move_data_from_purchase_order(
@@ -462,42 +1043,272 @@ class MultiLevelMrp(models.TransientModel):
         }
 
     @api.model
-    def _init_mrp_move_from_purchase_order(self, product_mrp_area):
-        location_ids = product_mrp_area.mrp_area_id._get_locations()
-        picking_types = self.env['stock.picking.type'].search(
-            [('default_location_dest_id', 'in',
-              location_ids.ids)])
-        picking_type_ids = [ptype.id for ptype in picking_types]
+    def _init_mrp_move_from_purchase_order(self, product_mrp_areas):
+        """Return the mrp.move values coming from the draft purchase order
+        lines of the given product MRP areas (all of them in the same MRP
+        area), by product MRP area."""
+        res = defaultdict(list)
+        pma_by_product = {pma.product_id.id: pma for pma in product_mrp_areas}
+        picking_type_ids = self._get_mrp_area_picking_types(
+            product_mrp_areas.mapped('mrp_area_id')).ids
         orders = self.env['purchase.order'].search(
             [('picking_type_id', 'in', picking_type_ids),
              ('state', 'in', ['draft', 'sent', 'to approve'])])
         po_lines = self.env['purchase.order.line'].search(
             [('order_id', 'in', orders.ids),
              ('product_qty', '>', 0.0),
-             ('product_id', '=', product_mrp_area.product_id.id)])
+             ('product_id', 'in', list(pma_by_product))])
 
         for line in po_lines:
-            mrp_move_data = \
+            product_mrp_area = pma_by_product[line.product_id.id]
+            res[product_mrp_area.id].append(
                 self._prepare_mrp_move_data_from_purchase_order(
-                    line, product_mrp_area)
-            self.env['mrp.move'].create(mrp_move_data)
+                    line, product_mrp_area))
+        return res
+
+    @api.model
+    def _get_mrp_area_locations(self, mrp_area):
+        cache = self.env.context.get('mrp_cache')
+        if cache is None:
+            return mrp_area._get_locations()
+        if mrp_area.id not in cache.locations:
+            cache.locations[mrp_area.id] = mrp_area._get_locations().ids
+        return self.env['stock.location'].browse(cache.locations[mrp_area.id])
+
+    @api.model
+    def _get_mrp_area_picking_types(self, mrp_area):
+        """Picking types whose default destination is in ``mrp_area``."""
+        cache = self.env.context.get('mrp_cache')
+        if cache is not None and mrp_area.id in cache.picking_types:
+            return self.env['stock.picking.type'].browse(
+                cache.picking_types[mrp_area.id])
+        picking_types = self.env['stock.picking.type'].search([
+            ('default_location_dest_id', 'in',
+             self._get_mrp_area_locations(mrp_area).ids)])
+        if cache is not None:
+            cache.picking_types[mrp_area.id] = picking_types.ids
+        return picking_types
+
+    @api.model
+    def _get_cached_product_mrp_area(self, product, mrp_area):
+        """Return the ``(id, mrp_exclude)`` of the product MRP area of
+        ``product`` in ``mrp_area``, reading all the product MRP areas of
+        the area at once. ``None`` when there is no run cache."""
+        cache = self.env.context.get('mrp_cache')
+        if cache is None:
+            return None
+        self._load_cached_product_mrp_areas(mrp_area)
+        return cache.product_mrp_areas[mrp_area.id].get(
+            product.id, (False, True))
+
+    @api.model
+    def _load_cached_product_mrp_areas(self, mrp_area):
+        cache = self.env.context['mrp_cache']
+        if mrp_area.id not in cache.product_mrp_areas:
+            cache.product_mrp_areas[mrp_area.id] = {
+                rec['product_id'][0]: (rec['id'], rec['mrp_exclude'])
+                for rec in self.env['product.mrp.area'].search_read(
+                    [('mrp_area_id', '=', mrp_area.id)],
+                    ['product_id', 'mrp_exclude'])}
 
     @api.model
     def _get_product_mrp_area_from_product_and_area(self, product, mrp_area):
+        cached = self._get_cached_product_mrp_area(product, mrp_area)
+        if cached is not None:
+            return self.env['product.mrp.area'].browse(cached[0])
         return self.env['product.mrp.area'].search([
             ('product_id', '=', product.id),
             ('mrp_area_id', '=', mrp_area.id),
         ], limit=1)
 
     @api.model
-    def _init_mrp_move(self, product_mrp_area):
-        self._init_mrp_move_from_forecast(product_mrp_area)
-        self._init_mrp_move_from_stock_move(product_mrp_area)
-        self._init_mrp_move_from_purchase_order(product_mrp_area)
+    def _bulk_insert(self, model_name, vals_list, date_series=None,
+                     date_fields=None):
+        """Insert ``vals_list`` in the table of ``model_name`` using
+        multi-row INSERT statements instead of one ``create`` per record.
+
+        Only meant for the MRP result tables: stored related fields are
+        taken from ``product_mrp_area_id`` and no compute is triggered.
+        Returns the new ids, in the same order than ``vals_list``.
+
+        ``date_series`` optionally gives a ``(date_start, date_end, days)``
+        tuple for each vals: the vals are then expanded by the database in
+        one record every ``days`` days from ``date_start`` to ``date_end``
+        (included), the date being set on every field of ``date_fields``.
+        """
+        if not vals_list:
+            return []
+        model = self.env[model_name]
+        if 'mrp_run_id' in model._fields:
+            snapshot_run = self.env.context.get('mrp_snapshot_run')
+            version = {
+                'active': not snapshot_run,
+                'mrp_run_id': snapshot_run or self.env.context.get('mrp_run'),
+            }
+            vals_list = [dict(vals, **version) for vals in vals_list]
+        related = {}
+        for name, field in model._fields.items():
+            path = field.related
+            if isinstance(path, str):
+                path = path.split('.')
+            if field.store and path and path[0] == 'product_mrp_area_id':
+                related[name] = path[1:]
+        if related:
+            pmas = self.env['product.mrp.area'].browse(
+                {vals['product_mrp_area_id'] for vals in vals_list})
+            related_values = {}
+            for pma in pmas:
+                for name, path in related.items():
+                    value = pma
+                    for fname in path:
+                        value = value[fname]
+                    if isinstance(value, models.BaseModel):
+                        value = value.id
+                    related_values[(pma.id, name)] = value
+        date_fields = date_fields or []
+        columns = sorted(
+            set().union(*vals_list) - set(related) - set(date_fields) -
+            set(models.MAGIC_COLUMNS))
+        columns += sorted(related)
+        fields_list = [model._fields[name] for name in columns]
+        if date_series is None:
+            row_template = '(%s, %%s, %%s, %s, %s)' % (
+                ', '.join(['%s'] * len(columns)),
+                "(now() at time zone 'UTC')", "(now() at time zone 'UTC')")
+            query = 'INSERT INTO "%s" (%s, create_uid, write_uid, ' \
+                    'create_date, write_date) VALUES %%s RETURNING id' % (
+                        model._table,
+                        ', '.join('"%s"' % name for name in columns))
+        else:
+            # Values are typed, NULL would be taken as text otherwise.
+            row_template = '(%%s, %s, %%s, %%s, %%s::date, %%s::date, ' \
+                           '%%s::int4)' % ', '.join(
+                               '%%s::%s' % field.column_type[1]
+                               for field in fields_list)
+            query = """
+                INSERT INTO "{table}" ({columns}, {date_columns},
+                    create_uid, write_uid, create_date, write_date)
+                SELECT {values}, {dates}, v.create_uid, v.write_uid,
+                    (now() at time zone 'UTC'), (now() at time zone 'UTC')
+                FROM (VALUES %s) AS v(seq, {values_columns}, create_uid,
+                    write_uid, date_start, date_end, days)
+                CROSS JOIN LATERAL generate_series(
+                    v.date_start, v.date_end, v.days * interval '1 day'
+                ) AS d
+                ORDER BY v.seq, d
+                RETURNING id
+            """.format(
+                table=model._table,
+                columns=', '.join('"%s"' % name for name in columns),
+                date_columns=', '.join('"%s"' % name for name in date_fields),
+                values=', '.join('v."%s"' % name for name in columns),
+                dates=', '.join(['d::date'] * len(date_fields)),
+                values_columns=', '.join('"%s"' % name for name in columns))
+        ids = []
+        for batch in split_every(INSERT_BATCH_SIZE, zip(
+                vals_list, date_series or [None] * len(vals_list))):
+            rows = []
+            for index, (vals, series) in enumerate(batch):
+                row = []
+                for field in fields_list:
+                    if field.name in related:
+                        value = related_values[
+                            (vals['product_mrp_area_id'], field.name)]
+                    else:
+                        value = vals.get(field.name)
+                    if field.type in ('date', 'datetime'):
+                        value = field.convert_to_cache(value, model)
+                    row.append(field.convert_to_column(value, model))
+                row += [self.env.uid, self.env.uid]
+                if series is not None:
+                    row = [index] + row + list(series)
+                rows.append(self.env.cr.mogrify(
+                    row_template, row).decode('utf-8'))
+            self.env.cr.execute(query % ', '.join(rows))
+            ids += [row[0] for row in self.env.cr.fetchall()]
+        model.invalidate_cache()
+        profiler = self.env.context.get('mrp_profiler')
+        if profiler is not None:
+            profiler.add_rows(self.env.cr, len(ids))
+        return ids
+
+    @contextmanager
+    def _profile_stage(self, name, mrp_area=None, llc=None):
+        """Measure a stage of the run when it is profiled."""
+        profiler = self.env.context.get('mrp_profiler')
+        if profiler is None:
+            yield {}
+            return
+        with profiler.stage(self.env.cr, name, mrp_area.id if mrp_area
+                            else None, llc) as stats:
+            yield stats
+
+    @api.model
+    def _init_mrp_move(self, product_mrp_areas):
+        """Create the mrp.move records of the given product MRP areas, all
+        of them belonging to the same MRP area. Each source is fetched with
+        a single search for the whole set and the records are inserted in
+        bulk, keeping the order of the per-product initialisation."""
+        if not product_mrp_areas:
+            return
+        # The forecast is expanded by the database, before the other
+        # sources are inserted.
+        forecast = self._init_mrp_move_from_forecast(product_mrp_areas)
+        sources = [
+            self._init_mrp_move_from_stock_move(product_mrp_areas),
+            self._init_mrp_move_from_purchase_order(product_mrp_areas),
+        ]
+        horizon = product_mrp_areas[0].mrp_area_id._get_horizon_date()
+        forecast_list = []
+        vals_list = []
+        for product_mrp_area in product_mrp_areas:
+            for vals, series in forecast.get(product_mrp_area.id, []):
+                if horizon is not None:
+                    vals, series, tail = self._collapse_forecast_series(
+                        vals, series, horizon)
+                    if tail:
+                        vals_list.append(tail)
+                if series:
+                    forecast_list.append((vals, series))
+            for source in sources:
+                vals_list += source.get(product_mrp_area.id, [])
+        if horizon is not None:
+            for vals in vals_list:
+                if vals['mrp_date'] > horizon:
+                    vals['mrp_date'] = horizon
+        if forecast_list:
+            vals, series = zip(*forecast_list)
+            self._bulk_insert(
+                'mrp.move', list(vals), date_series=list(series),
+                date_fields=['mrp_date', 'current_date'])
+        self._bulk_insert('mrp.move', vals_list)
+
+    @api.model
+    def _collapse_forecast_series(self, vals, series, horizon):
+        """Cut the expansion of a demand estimate at the planning horizon.
+        The quantity the series would have after it is collapsed into one
+        move on the ``horizon`` date. Returns the values and series left,
+        None when all of it is beyond the horizon, and the collapsed move
+        values, if any."""
+        date_start, date_end, days = series
+        if date_end <= horizon:
+            return vals, series, None
+        count = (date_end - date_start).days // days + 1
+        head = 0
+        if date_start <= horizon:
+            head = (horizon - date_start).days // days + 1
+        tail = dict(vals, mrp_date=horizon,
+                    mrp_qty=vals['mrp_qty'] * (count - head))
+        if not head:
+            return vals, None, tail
+        return vals, (date_start, horizon, days), tail
 
     @api.model
     def _exclude_from_mrp(self, product, mrp_area):
         """ To extend with various logic where needed. """
+        cached = self._get_cached_product_mrp_area(product, mrp_area)
+        if cached is not None:
+            return cached[1]
         product_mrp_area = self.env['product.mrp.area'].search(
             [('product_id', '=', product.id),
              ('mrp_area_id', '=', mrp_area.id)], limit=1)
@@ -506,39 +1317,43 @@ class MultiLevelMrp(models.TransientModel):
         return product_mrp_area.mrp_exclude
 
     @api.model
-    def _mrp_initialisation(self, mrp_areas):
+    def _mrp_initialisation(self, mrp_areas, product_mrp_areas=None):
         logger.info('Start MRP initialisation')
         if not mrp_areas:
             mrp_areas = self.env['mrp.area'].search([])
-        product_mrp_areas = self.env['product.mrp.area'].search([
+        domain = [
             ('mrp_area_id', 'in', mrp_areas.ids),
             ('mrp_applicable', '=', True),
-        ])
+        ]
+        if product_mrp_areas is not None:
+            domain += [('id', 'in', product_mrp_areas.ids)]
+        product_mrp_areas = self.env['product.mrp.area'].search(domain)
         init_counter = 0
         for mrp_area in mrp_areas:
-            for product_mrp_area in product_mrp_areas.filtered(
-                    lambda a: a.mrp_area_id == mrp_area):
-                if self._exclude_from_mrp(
-                        product_mrp_area.product_id, mrp_area):
-                    continue
-                init_counter += 1
-                log_msg = 'MRP Init: %s - %s ' % (
-                    init_counter, product_mrp_area.display_name)
-                logger.info(log_msg)
-                self._init_mrp_move(product_mrp_area)
+            area_product_mrp_areas = product_mrp_areas.filtered(
+                lambda a: a.mrp_area_id == mrp_area and
+                not self._exclude_from_mrp(a.product_id, mrp_area))
+            init_counter += len(area_product_mrp_areas)
+            log_msg = 'MRP Init: %s - %s products (total: %s)' % (
+                mrp_area.name, len(area_product_mrp_areas), init_counter)
+            logger.info(log_msg)
+            with self._profile_stage('initialisation', mrp_area) as stats:
+                self._init_mrp_move(area_product_mrp_areas)
+                stats['product_count'] = len(area_product_mrp_areas)
         logger.info('End MRP initialisation')
 
     @api.model
     def _init_mrp_move_grouped_demand(self, nbr_create, product_mrp_area):
         last_date = None
         last_qty = 0.00
-        onhand = product_mrp_area.qty_available
+        onhand = self._get_on_hand_by_product_mrp_area(
+            product_mrp_area)[product_mrp_area.id]
         grouping_delta = product_mrp_area.mrp_nbr_days
-        for move in product_mrp_area.mrp_move_ids:
+        for move in self._get_netting_moves(product_mrp_area):
             if self._exclude_move(move):
                 continue
             if last_date and (
-                    fields.Date.from_string(move.mrp_date)
+                    move.mrp_date
                     >= last_date + timedelta(days=grouping_delta)) and (
                         (onhand + last_qty + move.mrp_qty)
                         < product_mrp_area.mrp_minimum_stock
@@ -562,12 +1377,12 @@ class MultiLevelMrp(models.TransientModel):
                     (onhand + last_qty) < \
                     product_mrp_area.mrp_minimum_stock:
                 if not last_date or last_qty == 0.0:
-                    last_date = fields.Date.from_string(move.mrp_date)
+                    last_date = move.mrp_date
                     last_qty = move.mrp_qty
                 else:
                     last_qty += move.mrp_qty
             else:
-                last_date = fields.Date.from_string(move.mrp_date)
+                last_date = move.mrp_date
                 onhand += move.mrp_qty
 
         if last_date and last_qty != 0.00:
@@ -583,193 +1398,827 @@ class MultiLevelMrp(models.TransientModel):
 
     @api.model
     def _exclude_move(self, move):
-        """Improve extensibility being able to exclude special moves."""
+        """Improve extensibility being able to exclude special moves.
+
+        ``move`` is a :class:`MrpMoveRow` of the netting buffer.
+        """
         return False
 
     @api.model
-    def _mrp_calculation(self, mrp_lowest_llc, mrp_areas):
+    def _init_netting_buffer(self, mrp_area, product_mrp_areas=None):
+        """Load the demand and supply of the MRP area in a netting buffer
+        with a single query."""
+        netting = MrpNettingBuffer()
+        query = """
+            SELECT id, product_mrp_area_id, mrp_date, mrp_type, mrp_qty,
+                mrp_origin, name
+            FROM mrp_move m
+            WHERE mrp_area_id = %(mrp_area)s AND {version}
+        """
+        version, params = self._get_mrp_version_clause('m')
+        query = query.format(version=version)
+        params['mrp_area'] = mrp_area.id
+        if product_mrp_areas is not None:
+            query += " AND product_mrp_area_id IN %(product_mrp_areas)s"
+            params['product_mrp_areas'] = \
+                tuple(product_mrp_areas.ids) or (None, )
+        self.env.cr.execute(query, params)
+        for row in self.env.cr.fetchall():
+            netting.add_existing_move(MrpMoveRow(row[0], False, *row[1:]))
+        return netting
+
+    @api.model
+    def _get_netting_moves(self, product_mrp_area):
+        return self.env.context['mrp_netting'].get_moves(product_mrp_area.id)
+
+    @api.model
+    def _flush_netting_buffer(self, netting):
+        """Create the planned orders, the exploded moves and the links
+        between them in bulk."""
+        order_ids = self._bulk_insert('mrp.planned.order', netting.orders)
+        move_ids = self._bulk_insert('mrp.move', netting.moves)
+        for links in split_every(INSERT_BATCH_SIZE, netting.links):
+            rows = ', '.join(self.env.cr.mogrify('(%s, %s)', (
+                order_ids[order_index], move_ids[move_index],
+            )).decode('utf-8') for order_index, move_index in links)
+            self.env.cr.execute("""
+                INSERT INTO mrp_move_planned_order_rel (order_id, move_down_id)
+                VALUES %s
+            """ % rows)
+
+        def move_id(row):
+            return move_ids[row.id] if row.new else row.id
+
+        pegging = []
+        for demand, supply, qty in netting.pegging:
+            pegging.append({
+                'product_mrp_area_id': demand.product_mrp_area_id,
+                'demand_move_id': move_id(demand),
+                'supply_move_id':
+                    move_id(supply) if isinstance(supply, MrpMoveRow)
+                    else None,
+                'planned_order_id':
+                    order_ids[supply] if isinstance(supply, int) else None,
+                'qty': qty,
+            })
+        self._bulk_insert('mrp.pegging', pegging)
+        self.env['mrp.move'].invalidate_cache()
+        return order_ids, move_ids
+
+    @api.model
+    def _get_mrp_calculation_domain(self, mrp_lowest_llc, mrp_areas,
+                                    product_mrp_areas=None):
+        """Domain of the product MRP areas netted by the calculation."""
+        domain = [
+            ('product_id.llc', '<', mrp_lowest_llc),
+            ('mrp_area_id', 'in', mrp_areas.ids),
+        ]
+        if product_mrp_areas is not None:
+            domain += [('id', 'in', product_mrp_areas.ids)]
+        return domain
+
+    @api.model
+    def _mrp_calculation_llc(self, mrp_area, llc, product_mrp_areas):
+        """Net the given product MRP areas, of the same MRP area and low
+        level code, in the netting buffer of the context."""
+        profiler = self.env.context.get('mrp_profiler')
+        with self._profile_stage('calculation', mrp_area, llc) as stats:
+            for product_mrp_area in product_mrp_areas:
+                start = time.time()
+                self._mrp_calculation_product_mrp_area(product_mrp_area)
+                if profiler is not None:
+                    profiler.add_product(
+                        product_mrp_area.id, time.time() - start)
+            stats['product_count'] = len(product_mrp_areas)
+        return len(product_mrp_areas)
+
+    @api.model
+    def _mrp_calculation(self, mrp_lowest_llc, mrp_areas,
+                         product_mrp_areas=None):
         logger.info('Start MRP calculation')
         product_mrp_area_obj = self.env['product.mrp.area']
         counter = 0
         if not mrp_areas:
             mrp_areas = self.env['mrp.area'].search([])
         for mrp_area in mrp_areas:
+            netting = self._init_netting_buffer(mrp_area, product_mrp_areas)
+            area_self = self.with_context(mrp_netting=netting)
+            product_mrp_areas_by_llc = defaultdict(
+                lambda: product_mrp_area_obj)
+            domain = self._get_mrp_calculation_domain(
+                mrp_lowest_llc, mrp_area, product_mrp_areas)
+            for product_mrp_area in product_mrp_area_obj.search(domain):
+                product_mrp_areas_by_llc[
+                    product_mrp_area.product_id.llc] |= product_mrp_area
             llc = 0
             while mrp_lowest_llc > llc:
-                product_mrp_areas = product_mrp_area_obj.search(
-                    [('product_id.llc', '=', llc),
-                     ('mrp_area_id', '=', mrp_area.id)])
+                counter += area_self._mrp_calculation_llc(
+                    mrp_area, llc, product_mrp_areas_by_llc[llc])
                 llc += 1
 
-                for product_mrp_area in product_mrp_areas:
-                    nbr_create = 0
-                    onhand = product_mrp_area.qty_available
-                    if product_mrp_area.mrp_nbr_days == 0:
-                        for move in product_mrp_area.mrp_move_ids:
-                            if self._exclude_move(move):
-                                continue
-                            qtytoorder = product_mrp_area.mrp_minimum_stock - \
-                                onhand - move.mrp_qty
-                            if qtytoorder > 0.0:
-                                cm = self.create_action(
-                                    product_mrp_area_id=product_mrp_area,
-                                    mrp_date=move.mrp_date,
-                                    mrp_qty=qtytoorder, name=move.name)
-                                qty_ordered = cm['qty_ordered']
-                                onhand += move.mrp_qty + qty_ordered
-                                nbr_create += 1
-                            else:
-                                onhand += move.mrp_qty
-                    else:
-                        nbr_create = self._init_mrp_move_grouped_demand(
-                            nbr_create, product_mrp_area)
-
-                    if onhand < product_mrp_area.mrp_minimum_stock and \
-                            nbr_create == 0:
-                        qtytoorder = \
-                            product_mrp_area.mrp_minimum_stock - onhand
-                        cm = self.create_action(
-                            product_mrp_area_id=product_mrp_area,
-                            mrp_date=date.today(),
-                            mrp_qty=qtytoorder,
-                            name='Minimum Stock')
-                        qty_ordered = cm['qty_ordered']
-                        onhand += qty_ordered
-                    counter += 1
-
             log_msg = 'MRP Calculation LLC %s Finished - Nbr. products: %s' % (
                 llc - 1, counter)
             logger.info(log_msg)
+            log_msg = 'MRP Calculation %s: %s planned orders, %s moves' % (
+                mrp_area.name, len(netting.orders), len(netting.moves))
+            logger.info(log_msg)
+            with self._profile_stage('flush', mrp_area):
+                self._flush_netting_buffer(netting)
 
         logger.info('Enb MRP calculation')
 
     @api.model
-    def _get_demand_groups(self, product_mrp_area):
-        query = """
-            SELECT mrp_date, sum(mrp_qty)
-            FROM mrp_move
-            WHERE product_mrp_area_id = %(mrp_product)s
-            AND mrp_type = 'd'
-            GROUP BY mrp_date
-        """
-        params = {
-            'mrp_product': product_mrp_area.id
-        }
-        return query, params
+    def _mrp_calculation_product_mrp_area(self, product_mrp_area):
+        """Net the demand and supply of a product MRP area, creating the
+        needed planned orders in the netting buffer."""
+        nbr_create = 0
+        onhand = self._get_on_hand_by_product_mrp_area(
+            product_mrp_area)[product_mrp_area.id]
+        initial_onhand = onhand
+        if product_mrp_area.mrp_nbr_days == 0:
+            for move in self._get_netting_moves(product_mrp_area):
+                if self._exclude_move(move):
+                    continue
+                qtytoorder = product_mrp_area.mrp_minimum_stock - \
+                    onhand - move.mrp_qty
+                if qtytoorder > 0.0:
+                    cm = self.create_action(
+                        product_mrp_area_id=product_mrp_area,
+                        mrp_date=move.mrp_date,
+                        mrp_qty=qtytoorder, name=move.name)
+                    qty_ordered = cm['qty_ordered']
+                    onhand += move.mrp_qty + qty_ordered
+                    nbr_create += 1
+                else:
+                    onhand += move.mrp_qty
+        else:
+            nbr_create = self._init_mrp_move_grouped_demand(
+                nbr_create, product_mrp_area)
+
+        if onhand < product_mrp_area.mrp_minimum_stock and \
+                nbr_create == 0:
+            qtytoorder = \
+                product_mrp_area.mrp_minimum_stock - onhand
+            cm = self.create_action(
+                product_mrp_area_id=product_mrp_area,
+                mrp_date=date.today(),
+                mrp_qty=qtytoorder,
+                name='Minimum Stock')
+            qty_ordered = cm['qty_ordered']
+            onhand += qty_ordered
+        self._peg_product_mrp_area(product_mrp_area, initial_onhand)
+        return nbr_create
 
     @api.model
-    def _get_supply_groups(self, product_mrp_area):
-        query = """
-                SELECT mrp_date, sum(mrp_qty)
-                FROM mrp_move
-                WHERE product_mrp_area_id = %(mrp_product)s
-                AND mrp_type = 's'
-                GROUP BY mrp_date
-            """
-        params = {
-            'mrp_product': product_mrp_area.id,
-        }
-        return query, params
+    def _peg_product_mrp_area(self, product_mrp_area, onhand):
+        """Peg the demand of a product MRP area to the supply covering it,
+        first come first served: the stock on hand, then the supply moves
+        and planned orders by date. Demand not covered yet is pegged to
+        the next supply to come."""
+        netting = self.env.context['mrp_netting']
+        rounding = product_mrp_area.product_id.uom_id.rounding
+        events = []
+        for move in self._get_netting_moves(product_mrp_area):
+            if self._exclude_move(move):
+                continue
+            events.append((move.mrp_date, move.mrp_type != 's', move))
+        for index in netting.orders_by_pma[product_mrp_area.id]:
+            due_date = netting.orders[index]['due_date']
+            if not isinstance(due_date, date):
+                due_date = fields.Date.from_string(due_date)
+            events.append((due_date, False, index))
+        # Stable sort: the netting order is kept within a date.
+        events.sort(key=lambda e: (e[0], e[1]))
+        supplies = deque()
+        demands = deque()
+        if float_compare(onhand, 0.0, precision_rounding=rounding) > 0:
+            supplies.append([None, onhand])
+        for __, is_demand, item in events:
+            if is_demand:
+                qty = -item.mrp_qty
+                pending, available = demands, supplies
+            else:
+                if isinstance(item, MrpMoveRow):
+                    qty = item.mrp_qty
+                else:
+                    qty = netting.orders[item]['mrp_qty']
+                pending, available = supplies, demands
+            while available and float_compare(
+                    qty, 0.0, precision_rounding=rounding) > 0:
+                other = available[0]
+                pegged_qty = min(qty, other[1])
+                if is_demand:
+                    netting.peg(item, other[0], pegged_qty)
+                else:
+                    netting.peg(other[0], item, pegged_qty)
+                qty -= pegged_qty
+                other[1] -= pegged_qty
+                if float_compare(
+                        other[1], 0.0, precision_rounding=rounding) <= 0:
+                    available.popleft()
+            if float_compare(qty, 0.0, precision_rounding=rounding) > 0:
+                pending.append([item, qty])
+
+    @api.model
+    def _get_mrp_bucket_clause(self, column, area_alias):
+        """SQL expression of the inventory bucket of the date ``column``,
+        following the settings of the MRP area aliased ``area_alias``: the
+        date itself or the start of its week or month, not before today.
+        Dates beyond the planning horizon fall in its last day."""
+        return """
+            CASE WHEN {area}.planning_horizon > 0
+                AND {column} > %(today)s::date + {area}.planning_horizon
+            THEN %(today)s::date + {area}.planning_horizon
+            WHEN {area}.inventory_bucket IN ('week', 'month')
+            THEN greatest(
+                date_trunc({area}.inventory_bucket, {column})::date,
+                %(today)s::date)
+            ELSE {column} END
+        """.format(column=column, area=area_alias)
 
     @api.model
-    def _get_planned_order_groups(self, product_mrp_area):
+    def _get_mrp_inventory_groups(self, product_mrp_areas):
+        """Time-phased aggregation of the demand, supply and planned orders
+        of ``product_mrp_areas``, one row per product MRP area and
+        inventory bucket, with the running sums needed by the inventory
+        projection."""
         query = """
-            SELECT due_date, sum(mrp_qty)
-            FROM mrp_planned_order
-            WHERE product_mrp_area_id = %(mrp_product)s
-            GROUP BY due_date
+            WITH grouped AS (
+                SELECT m.product_mrp_area_id, {move_bucket} AS date,
+                    sum(CASE WHEN mrp_type = 'd' THEN mrp_qty ELSE 0.0 END)
+                        AS demand_qty,
+                    sum(CASE WHEN mrp_type = 's' THEN mrp_qty ELSE 0.0 END)
+                        AS supply_qty,
+                    0.0 AS planned_qty
+                FROM mrp_move m
+                JOIN mrp_area a ON a.id = m.mrp_area_id
+                WHERE m.product_mrp_area_id IN %(product_mrp_areas)s
+                AND {move_version}
+                GROUP BY m.product_mrp_area_id, 2
+                UNION ALL
+                SELECT po.product_mrp_area_id, {order_bucket}, 0.0, 0.0,
+                    sum(po.mrp_qty)
+                FROM mrp_planned_order po
+                JOIN mrp_area a ON a.id = po.mrp_area_id
+                WHERE po.product_mrp_area_id IN %(product_mrp_areas)s
+                AND {order_version}
+                GROUP BY po.product_mrp_area_id, 2
+            )
+            SELECT product_mrp_area_id, date,
+                sum(demand_qty), sum(supply_qty),
+                sum(sum(demand_qty) + sum(supply_qty)) OVER w,
+                sum(sum(demand_qty) + sum(supply_qty) + sum(planned_qty))
+                    OVER w
+            FROM grouped
+            GROUP BY product_mrp_area_id, date
+            WINDOW w AS (
+                PARTITION BY product_mrp_area_id ORDER BY date
+                ROWS UNBOUNDED PRECEDING)
+            ORDER BY product_mrp_area_id, date
         """
-        params = {
-            'mrp_product': product_mrp_area.id
-        }
+        move_version, params = self._get_mrp_version_clause('m')
+        order_version, __ = self._get_mrp_version_clause('po', fixed=True)
+        query = query.format(
+            move_version=move_version, order_version=order_version,
+            move_bucket=self._get_mrp_bucket_clause('m.mrp_date', 'a'),
+            order_bucket=self._get_mrp_bucket_clause('po.due_date', 'a'))
+        params['product_mrp_areas'] = tuple(product_mrp_areas.ids)
+        params['today'] = date.today()
         return query, params
 
     @api.model
-    def _init_mrp_inventory(self, product_mrp_area):
-        mrp_move_obj = self.env['mrp.move']
-        planned_order_obj = self.env['mrp.planned.order']
-        # Read Demand
-        demand_qty_by_date = {}
-        query, params = self._get_demand_groups(product_mrp_area)
-        self.env.cr.execute(query, params)
-        for mrp_date, qty in self.env.cr.fetchall():
-            demand_qty_by_date[mrp_date] = qty
-        # Read Supply
-        supply_qty_by_date = {}
-        query, params = self._get_supply_groups(product_mrp_area)
-        self.env.cr.execute(query, params)
-        for mrp_date, qty in self.env.cr.fetchall():
-            supply_qty_by_date[mrp_date] = qty
-        # Read planned orders:
-        planned_qty_by_date = {}
-        query, params = self._get_planned_order_groups(product_mrp_area)
+    def _get_on_hand_by_product_mrp_area(self, product_mrp_areas):
+        """On hand quantity of ``product_mrp_areas``, by product MRP area.
+
+        During a run, the quants are aggregated once per MRP area for all
+        its products and kept in the run cache. The reserved quantity is
+        excluded when the ``mrp_exclude_reserved`` context key is set.
+        """
+        exclude_reserved = self.env.context.get('mrp_exclude_reserved')
+        cache = self.env.context.get('mrp_cache')
+        on_hand = {}
+        for mrp_area in product_mrp_areas.mapped('mrp_area_id'):
+            area_pmas = product_mrp_areas.filtered(
+                lambda a: a.mrp_area_id == mrp_area)
+            if cache is None:
+                area_on_hand = mrp_area._get_on_hand_qty(
+                    area_pmas.mapped('product_id'),
+                    exclude_reserved=exclude_reserved)
+            else:
+                if mrp_area.id not in cache.on_hand:
+                    self._load_cached_product_mrp_areas(mrp_area)
+                    products = self.env['product.product'].browse(
+                        cache.product_mrp_areas[mrp_area.id])
+                    cache.on_hand[mrp_area.id] = mrp_area._get_on_hand_qty(
+                        products, exclude_reserved=exclude_reserved)
+                area_on_hand = cache.on_hand[mrp_area.id]
+            for product_mrp_area in area_pmas:
+                on_hand[product_mrp_area.id] = area_on_hand.get(
+                    product_mrp_area.product_id.id, 0.0)
+        return on_hand
+
+    @api.model
+    def _init_mrp_inventory(self, product_mrp_areas):
+        """Build the time-phased inventory of ``product_mrp_areas`` from a
+        single aggregation query, inserting the ``mrp.inventory`` records
+        in bulk and attaching them their planned orders."""
+        if not product_mrp_areas:
+            return self.env['mrp.inventory']
+        on_hand = self._get_on_hand_by_product_mrp_area(product_mrp_areas)
+        query, params = self._get_mrp_inventory_groups(product_mrp_areas)
         self.env.cr.execute(query, params)
-        for mrp_date, qty in self.env.cr.fetchall():
-            planned_qty_by_date[mrp_date] = qty
-        # Dates
-        moves_dates = mrp_move_obj.search([
-            ('product_mrp_area_id', '=', product_mrp_area.id)],
-            order='mrp_date').mapped('mrp_date')
-        action_dates = planned_order_obj.search([
-            ('product_mrp_area_id', '=', product_mrp_area.id)],
-            order='due_date').mapped('due_date')
-        mrp_dates = set(moves_dates + action_dates)
-        on_hand_qty = product_mrp_area.product_id.with_context(
-            location=product_mrp_area.mrp_area_id.location_id.id
-        )._product_available()[
-            product_mrp_area.product_id.id]['qty_available']
-        running_availability = on_hand_qty
-        for mdt in sorted(mrp_dates):
-            mrp_inventory_data = {
-                'product_mrp_area_id': product_mrp_area.id,
+        vals_list = []
+        for (pma_id, mdt, demand_qty, supply_qty, net_qty,
+                planned_net_qty) in self.env.cr.fetchall():
+            on_hand_qty = on_hand[pma_id]
+            vals_list.append({
+                'product_mrp_area_id': pma_id,
                 'date': mdt,
-            }
-            demand_qty = demand_qty_by_date.get(mdt, 0.0)
-            mrp_inventory_data['demand_qty'] = abs(demand_qty)
-            supply_qty = supply_qty_by_date.get(mdt, 0.0)
-            mrp_inventory_data['supply_qty'] = abs(supply_qty)
-            mrp_inventory_data['initial_on_hand_qty'] = on_hand_qty
-            on_hand_qty += (supply_qty + demand_qty)
-            mrp_inventory_data['final_on_hand_qty'] = on_hand_qty
-            # Consider that MRP plan is followed exactly:
-            running_availability += supply_qty \
-                + demand_qty + planned_qty_by_date.get(mdt, 0.0)
-            mrp_inventory_data['running_availability'] = running_availability
-
-            inv_id = self.env['mrp.inventory'].create(mrp_inventory_data)
-            # attach planned orders to inventory
-            planned_order_obj.search([
-                ('due_date', '=', mdt),
-                ('product_mrp_area_id', '=', product_mrp_area.id),
-            ]).write(
-                {'mrp_inventory_id': inv_id.id})
-
-    @api.model
-    def _mrp_final_process(self, mrp_areas):
+                'demand_qty': abs(demand_qty),
+                'supply_qty': abs(supply_qty),
+                'initial_on_hand_qty':
+                    on_hand_qty + net_qty - supply_qty - demand_qty,
+                'final_on_hand_qty': on_hand_qty + net_qty,
+                # Consider that MRP plan is followed exactly:
+                'running_availability': on_hand_qty + planned_net_qty,
+                'to_procure': 0.0,
+            })
+        inventories = self.env['mrp.inventory'].browse(
+            self._bulk_insert('mrp.inventory', vals_list))
+        if not inventories:
+            return inventories
+        # attach planned orders to inventory. The fixed orders of the
+        # current plan are attached when an isolated run is swapped in.
+        version, params = self._get_mrp_version_clause('po')
+        params['inventories'] = tuple(inventories.ids)
+        params['today'] = date.today()
+        self.env.cr.execute("""
+            UPDATE mrp_planned_order po
+            SET mrp_inventory_id = inv.id
+            FROM mrp_inventory inv
+            JOIN mrp_area a ON a.id = inv.mrp_area_id
+            WHERE inv.id IN %(inventories)s
+            AND po.product_mrp_area_id = inv.product_mrp_area_id
+            AND {bucket} = inv.date
+            AND {version}
+        """.format(version=version, bucket=self._get_mrp_bucket_clause(
+            'po.due_date', 'a')), params)
+        version, params = self._get_mrp_version_clause('po', fixed=True)
+        params['inventories'] = tuple(inventories.ids)
+        params['today'] = date.today()
+        self.env.cr.execute("""
+            UPDATE mrp_inventory inv
+            SET to_procure = po.to_procure
+            FROM (
+                SELECT po.product_mrp_area_id, {bucket} AS date,
+                    sum(po.mrp_qty) - sum(coalesce(po.qty_released, 0.0))
+                        AS to_procure
+                FROM mrp_planned_order po
+                JOIN mrp_area a ON a.id = po.mrp_area_id
+                WHERE {version}
+                GROUP BY po.product_mrp_area_id, 2
+            ) po
+            WHERE inv.id IN %(inventories)s
+            AND inv.product_mrp_area_id = po.product_mrp_area_id
+            AND inv.date = po.date
+        """.format(version=version, bucket=self._get_mrp_bucket_clause(
+            'po.due_date', 'a')), params)
+        self._update_mrp_inventory_release_date(inventories)
+        return inventories
+
+    @api.model
+    def _update_mrp_inventory_release_date(self, inventories):
+        """Compute the order release date of ``inventories`` in memory and
+        store it with one UPDATE per distinct date."""
+        ids_by_date = defaultdict(list)
+        with self.env.do_in_draft():
+            inventories._compute_order_release_date()
+            for inventory in inventories:
+                ids_by_date[inventory.order_release_date].append(
+                    inventory.id)
+        inventories.invalidate_cache()
+        for release_date, ids in ids_by_date.items():
+            self.env.cr.execute(
+                "UPDATE mrp_inventory SET order_release_date = %s "
+                "WHERE id IN %s", (release_date or None, tuple(ids)))
+
+    @api.model
+    def _mrp_final_process(self, mrp_areas, product_mrp_areas=None):
         logger.info('Start MRP final process')
+        if not mrp_areas:
+            mrp_areas = self.env['mrp.area'].search([])
         domain = [('product_id.llc', '<', 9999)]
-        if mrp_areas:
-            domain += [('mrp_area_id', 'in', mrp_areas.ids)]
-        product_mrp_area_ids = self.env['product.mrp.area'].search(domain)
-
-        for product_mrp_area in product_mrp_area_ids:
+        if product_mrp_areas is not None:
+            domain += [('id', 'in', product_mrp_areas.ids)]
+        inventories = self.env['mrp.inventory']
+        for mrp_area in mrp_areas:
+            area_product_mrp_areas = self.env['product.mrp.area'].search(
+                domain + [('mrp_area_id', '=', mrp_area.id)]).filtered(
+                lambda a: not self._exclude_from_mrp(a.product_id, mrp_area))
             # Build the time-phased inventory
-            if self._exclude_from_mrp(
-                    product_mrp_area.product_id,
-                    product_mrp_area.mrp_area_id):
-                continue
-            self._init_mrp_inventory(product_mrp_area)
-        logger.info('End MRP final process')
+            with self._profile_stage('final_process', mrp_area) as stats:
+                inventories |= self._init_mrp_inventory(
+                    area_product_mrp_areas)
+                stats['product_count'] = len(area_product_mrp_areas)
+        logger.info('End MRP final process - %s inventory records',
+                    len(inventories))
+
+    @api.model
+    def _get_mrp_version_clause(self, alias, fixed=False):
+        """SQL condition on the table aliased ``alias`` selecting the MRP
+        results being computed: the rows built by the current isolated
+        run, or the active ones. With ``fixed``, the fixed planned orders
+        of the current plan are selected as well. Returns the condition
+        and its named parameters."""
+        snapshot_run = self.env.context.get('mrp_snapshot_run')
+        if not snapshot_run:
+            return '{0}.active'.format(alias), {}
+        clause = '{0}.mrp_run_id = %(mrp_snapshot_run)s'
+        if fixed:
+            clause = '({0}.mrp_run_id = %(mrp_snapshot_run)s ' \
+                     'OR ({0}.fixed AND {0}.active))'
+        return clause.format(alias), {'mrp_snapshot_run': snapshot_run}
+
+    @api.model
+    def _swap_mrp_snapshot(self, mrp_areas):
+        """Make the results built by the current isolated run the active
+        plan of ``mrp_areas``. The replaced results are only deactivated,
+        they are removed later on by the garbage collector of runs."""
+        params = {
+            'mrp_snapshot_run': self.env.context['mrp_snapshot_run'],
+            'mrp_areas': tuple(mrp_areas.ids),
+        }
+        for table, where in (
+                ('mrp_pegging', ''),
+                ('mrp_move', ''),
+                ('mrp_inventory', ''),
+                ('mrp_planned_order', 'AND NOT coalesce(fixed, FALSE)')):
+            self.env.cr.execute("""
+                UPDATE {table}
+                SET active = coalesce(mrp_run_id = %(mrp_snapshot_run)s,
+                                      FALSE)
+                WHERE mrp_area_id IN %(mrp_areas)s
+                AND (active OR mrp_run_id = %(mrp_snapshot_run)s)
+                {where}
+            """.format(table=table, where=where), params)
+        params['today'] = date.today()
+        self.env.cr.execute("""
+            UPDATE mrp_planned_order po
+            SET mrp_inventory_id = inv.id
+            FROM mrp_inventory inv
+            JOIN mrp_area a ON a.id = inv.mrp_area_id
+            WHERE po.fixed AND po.active
+            AND po.mrp_area_id IN %(mrp_areas)s
+            AND inv.mrp_run_id = %(mrp_snapshot_run)s
+            AND po.product_mrp_area_id = inv.product_mrp_area_id
+            AND {bucket} = inv.date
+        """.format(bucket=self._get_mrp_bucket_clause(
+            'po.due_date', 'a')), params)
+        self.env['mrp.move'].invalidate_cache()
+
+    @api.model
+    def _lock_mrp_areas(self, mrp_areas):
+        """Take the transaction level advisory lock of the given areas, to
+        prevent concurrent runs to compute the same area."""
+        for mrp_area in mrp_areas:
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_xact_lock(%s, %s)",
+                (MRP_AREA_LOCK, mrp_area.id))
+            if not self.env.cr.fetchone()[0]:
+                raise exceptions.UserError(_(
+                    "The MRP area %s is already being computed by another "
+                    "MRP run.") % mrp_area.name)
+
+    @api.model
+    def _run_mrp_area(self, mrp_area, mrp_lowest_llc, product_mrp_areas=None):
+        """Compute the MRP of a single area, once the low level codes and
+        the applicable products are computed. Returns the duration of each
+        stage, in seconds."""
+        self._lock_mrp_areas(mrp_area)
+        timings = OrderedDict()
+        snapshot = self.env.context.get('mrp_snapshot_run')
+        start = time.time()
+        with self._profile_stage('cleanup', mrp_area):
+            if product_mrp_areas is not None:
+                self._mrp_cleanup_net_change(product_mrp_areas)
+            elif not snapshot:
+                # Isolated runs replace the current plan at the end.
+                self._mrp_cleanup(mrp_area)
+        timings['cleanup'] = time.time() - start
+        start = time.time()
+        self._mrp_initialisation(mrp_area, product_mrp_areas)
+        timings['initialisation'] = time.time() - start
+        start = time.time()
+        self._mrp_calculation(mrp_lowest_llc, mrp_area, product_mrp_areas)
+        timings['calculation'] = time.time() - start
+        start = time.time()
+        self._mrp_final_process(mrp_area, product_mrp_areas)
+        if snapshot:
+            self._swap_mrp_snapshot(mrp_area)
+        timings['final_process'] = time.time() - start
+        return timings
+
+    @api.model
+    def _run_mrp_area_run(self, run, commit=True):
+        """Compute the area ``run`` of a parallel run in a single
+        transaction, committed at the end. The net change queue of its
+        area is consumed in the same transaction, so that it is kept if the
+        area fails."""
+        mrp_area = run.mrp_area_ids
+        wizard = self.create({
+            'mrp_area_ids': [(6, 0, mrp_area.ids)],
+            'net_change': run.net_change,
+            'snapshot': run.snapshot,
+            'exclude_reserved': run.exclude_reserved,
+        })
+        cache = MrpRunCache()
+        profiler = MrpRunProfiler()
+        wizard = wizard.with_context(
+            mrp_cache=cache,
+            mrp_profiler=profiler,
+            mrp_run=run.id,
+            mrp_snapshot_run=run.snapshot and run.id,
+            mrp_exclude_reserved=run.exclude_reserved,
+        )
+        try:
+            with self.env.cr.savepoint():
+                product_mrp_areas = None
+                with wizard._profile_stage('queue', mrp_area):
+                    if run.net_change:
+                        product_mrp_areas = \
+                            wizard._get_net_change_product_mrp_areas(
+                                mrp_area, include_pending=False)
+                    else:
+                        wizard._consume_net_change_queue(
+                            mrp_area, include_pending=False)
+                timings = wizard._run_mrp_area(
+                    mrp_area, run.lowest_llc, product_mrp_areas)
+        except Exception as e:
+            logger.exception('MRP area %s failed', mrp_area.name)
+            self.env['mrp.run'].invalidate_cache()
+            run.write({
+                'state': 'failed',
+                'date_end': fields.Datetime.now(),
+                'error': str(e),
+            })
+        else:
+            logger.info(
+                'MRP area %s computed in %.2fs (%s)', mrp_area.name,
+                sum(timings.values()), ', '.join(
+                    '%s: %.2fs' % item for item in timings.items()))
+            run._save_profile(profiler)
+        finally:
+            cache.clear()
+        if commit:
+            self.env.cr.commit()
+
+    @api.multi
+    def _run_mrp_multi_level_parallel(self):
+        """Compute the low level codes and the applicable products, and
+        dispatch the MRP areas to area runs, computed by scheduled actions
+        once the transaction is committed."""
+        run = self.env['mrp.run'].browse(self.env.context['mrp_run'])
+        mrp_areas = self.mrp_area_ids or self.env['mrp.area'].search([])
+        with self._profile_stage('llc'):
+            mrp_lowest_llc = self._low_level_code_calculation()
+        with self._profile_stage('applicable'):
+            self._calculate_mrp_applicable(self.mrp_area_ids)
+        with self._profile_stage('queue'):
+            self._split_net_change_queue()
+        run.lowest_llc = mrp_lowest_llc
+        for mrp_area in mrp_areas:
+            self.env['mrp.run'].create({
+                'parent_id': run.id,
+                'mrp_area_ids': [(6, 0, mrp_area.ids)],
+                'net_change': run.net_change,
+                'snapshot': run.snapshot,
+                'exclude_reserved': run.exclude_reserved,
+                'lowest_llc': mrp_lowest_llc,
+                'state': 'queued',
+            })
+        run._dispatch_area_runs()
+        logger.info('Parallel MRP run: %s areas dispatched to %s workers',
+                    len(mrp_areas), len(run.worker_cron_ids))
 
     @api.multi
     def run_mrp_multi_level(self):
-        self._mrp_cleanup(self.mrp_area_ids)
-        mrp_lowest_llc = self._low_level_code_calculation()
-        self._calculate_mrp_applicable(self.mrp_area_ids)
-        self._mrp_initialisation(self.mrp_area_ids)
-        self._mrp_calculation(mrp_lowest_llc, self.mrp_area_ids)
-        self._mrp_final_process(self.mrp_area_ids)
+        cache = MrpRunCache()
+        profiler = MrpRunProfiler()
+        snapshot = self.snapshot and not self.net_change
+        parallel = self.parallel and not self.background
+        run = self.env['mrp.run'].create({
+            'mrp_area_ids': [(6, 0, self.mrp_area_ids.ids)],
+            'net_change': self.net_change,
+            'snapshot': snapshot,
+            'exclude_reserved': self.exclude_reserved,
+            'background': self.background,
+            'parallel': parallel,
+            'state': self.background and 'queued' or 'running',
+        })
+        if parallel:
+            try:
+                self.with_context(
+                    mrp_cache=cache,
+                    mrp_profiler=profiler,
+                    mrp_run=run.id,
+                )._run_mrp_multi_level_parallel()
+            finally:
+                cache.clear()
+            run._flush_profile(profiler)
+        if self.background or parallel:
+            action = self.env.ref("mrp_multi_level.mrp_run_action")
+            result = action.read()[0]
+            result.update({
+                'res_id': run.id,
+                'view_mode': 'form',
+                'views': [(False, 'form')],
+            })
+            return result
+        try:
+            self.with_context(
+                mrp_cache=cache,
+                mrp_profiler=profiler,
+                mrp_run=run.id,
+                mrp_snapshot_run=snapshot and run.id,
+                mrp_exclude_reserved=self.exclude_reserved,
+            )._run_mrp_multi_level()
+        finally:
+            cache.clear()
+        run._save_profile(profiler)
         # Open MRP inventory screen to show result if manually run:
         action = self.env.ref("mrp_multi_level.mrp_inventory_action")
         result = action.read()[0]
         return result
+
+    @api.multi
+    def _run_mrp_multi_level(self):
+        if self.net_change:
+            product_mrp_areas = self._get_net_change_product_mrp_areas(
+                self.mrp_area_ids)
+        else:
+            # Everything is recomputed, no need to keep the queue.
+            product_mrp_areas = None
+            self._consume_net_change_queue(self.mrp_area_ids)
+        self._lock_mrp_areas(
+            self.mrp_area_ids or self.env['mrp.area'].search([]))
+        snapshot = self.env.context.get('mrp_snapshot_run')
+        with self._profile_stage('cleanup'):
+            if product_mrp_areas is not None:
+                self._mrp_cleanup_net_change(product_mrp_areas)
+            elif not snapshot:
+                # Isolated runs replace the current plan at the end.
+                self._mrp_cleanup(self.mrp_area_ids)
+        with self._profile_stage('llc'):
+            mrp_lowest_llc = self._low_level_code_calculation()
+        with self._profile_stage('applicable'):
+            self._calculate_mrp_applicable(self.mrp_area_ids)
+        self._mrp_initialisation(self.mrp_area_ids, product_mrp_areas)
+        self._mrp_calculation(
+            mrp_lowest_llc, self.mrp_area_ids, product_mrp_areas)
+        self._mrp_final_process(self.mrp_area_ids, product_mrp_areas)
+        if snapshot:
+            self._swap_mrp_snapshot(
+                self.mrp_area_ids or self.env['mrp.area'].search([]))
+
+    @api.model
+    def _run_background_mrp_run(self, run, commit=True):
+        """Compute the queued or interrupted background ``run``. Returns
+        whether it was completed."""
+        wizard = self.create({
+            'mrp_area_ids': [(6, 0, run.mrp_area_ids.ids)],
+            'net_change': run.net_change,
+            'snapshot': run.snapshot,
+            'exclude_reserved': run.exclude_reserved,
+        })
+        cache = MrpRunCache()
+        profiler = MrpRunProfiler()
+        try:
+            completed = wizard.with_context(
+                mrp_cache=cache,
+                mrp_profiler=profiler,
+                mrp_run=run.id,
+                mrp_snapshot_run=run.snapshot and run.id,
+                mrp_exclude_reserved=run.exclude_reserved,
+            )._run_mrp_run_steps(run, commit=commit)
+        except Exception as e:
+            logger.exception('Background MRP run %s failed', run.id)
+            if commit:
+                self.env.cr.rollback()
+            self.env['mrp.run'].invalidate_cache()
+            run.write({'state': 'failed', 'error': str(e)})
+            completed = False
+        finally:
+            cache.clear()
+        if completed:
+            run._save_profile(profiler)
+        if commit:
+            self.env.cr.commit()
+        return completed
+
+    @api.multi
+    def _run_mrp_run_steps(self, run, commit=True):
+        """Run the steps of the background ``run`` not completed yet, each
+        one being recorded as completed in the transaction of its results.
+        Returns False when the run is cancelled."""
+        self.ensure_one()
+        mrp_areas = self.mrp_area_ids or self.env['mrp.area'].search([])
+        profiler = self.env.context['mrp_profiler']
+        completed = set((run.completed_steps or '').split())
+        self._lock_mrp_areas(mrp_areas)
+        for step, stage, function in self._get_mrp_run_steps(run):
+            if step in completed:
+                continue
+            try:
+                function()
+                run._checkpoint(step, stage, profiler)
+                if commit:
+                    self.env.cr.commit()
+            except psycopg2.extensions.TransactionRollbackError:
+                # The run was most likely cancelled meanwhile.
+                if not commit:
+                    raise
+                self.env.cr.rollback()
+                if not run._is_cancelled():
+                    raise
+            if run._is_cancelled():
+                logger.info('Background MRP run %s cancelled', run.id)
+                return False
+            # The advisory locks are released by the commit.
+            self._lock_mrp_areas(mrp_areas)
+        return True
+
+    @api.multi
+    def _get_mrp_run_steps(self, run):
+        """Steps of the background ``run``, as (step, stage, function)
+        tuples, ``step`` identifying them once completed. They are
+        generated while the run goes on, as the calculation steps depend
+        on the low level codes computed by a former one."""
+        mrp_areas = self.mrp_area_ids or self.env['mrp.area'].search([])
+        snapshot = self.env.context.get('mrp_snapshot_run')
+
+        def get_product_mrp_areas():
+            return run.product_mrp_area_ids if run.net_change else None
+
+        def queue():
+            if run.net_change:
+                run.product_mrp_area_ids = \
+                    self._get_net_change_product_mrp_areas(
+                        self.mrp_area_ids)
+            else:
+                self._consume_net_change_queue(self.mrp_area_ids)
+
+        def cleanup():
+            with self._profile_stage('cleanup'):
+                if run.net_change:
+                    self._mrp_cleanup_net_change(run.product_mrp_area_ids)
+                elif not snapshot:
+                    # The step is committed right away.
+                    self._mrp_cleanup(self.mrp_area_ids, truncate=True)
+
+        def llc():
+            with self._profile_stage('llc'):
+                run.lowest_llc = self._low_level_code_calculation()
+
+        def applicable():
+            with self._profile_stage('applicable'):
+                self._calculate_mrp_applicable(self.mrp_area_ids)
+            run.product_total = self.env['product.mrp.area'].search_count(
+                self._get_mrp_calculation_domain(
+                    run.lowest_llc, mrp_areas, get_product_mrp_areas()))
+
+        def initialisation(mrp_area):
+            self._mrp_initialisation(mrp_area, get_product_mrp_areas())
+
+        def calculation(mrp_area, llc):
+            product_mrp_areas = get_product_mrp_areas()
+            llc_product_mrp_areas = self.env['product.mrp.area'].search(
+                self._get_mrp_calculation_domain(
+                    run.lowest_llc, mrp_area, product_mrp_areas) +
+                [('product_id.llc', '=', llc)])
+            if not llc_product_mrp_areas:
+                return
+            # The buffer is loaded again from the moves committed by the
+            # former low level codes.
+            netting = self._init_netting_buffer(mrp_area, product_mrp_areas)
+            self.with_context(mrp_netting=netting)._mrp_calculation_llc(
+                mrp_area, llc, llc_product_mrp_areas)
+            with self._profile_stage('flush', mrp_area):
+                self._flush_netting_buffer(netting)
+
+        def final_process(mrp_area):
+            self._mrp_final_process(mrp_area, get_product_mrp_areas())
+
+        yield 'queue', 'queue', queue
+        yield 'cleanup', 'cleanup', cleanup
+        yield 'llc', 'llc', llc
+        yield 'applicable', 'applicable', applicable
+        for mrp_area in mrp_areas:
+            yield 'initialisation-%s' % mrp_area.id, 'initialisation', \
+                partial(initialisation, mrp_area)
+            for level in range(run.lowest_llc):
+                yield 'calculation-%s-%s' % (mrp_area.id, level), \
+                    'calculation', partial(calculation, mrp_area, level)
+            yield 'final_process-%s' % mrp_area.id, 'final_process', \
+                partial(final_process, mrp_area)
+        if snapshot:
+            yield 'swap', 'swap', partial(self._swap_mrp_snapshot, mrp_areas)
@@ -4,7 +4,7 @@
 {
     "name": "MRP Warehouse Calendar",
     "summary": "Considers the warehouse calendars in manufacturing",
-    "version": "11.0.1.0.0",
+    "version": "11.0.1.1.0",
     "license": "AGPL-3",
     "website": "https://github.com/stock-logistics-warehouse",
     "author": "Eficent, "
@@ -17,7 +17,7 @@ class ProcurementRule(models.Model):
         if warehouse.calendar_id and product_id.produce_delay:
             lead_days = values['company_id'].manufacturing_lead + \
                 product_id.produce_delay
-            date_expected = warehouse.calendar_id.plan_days(
+            date_expected = warehouse.calendar_id.plan_working_days(
                 -1 * lead_days - 1, dt_planned)
             date_planned = date_expected
         return date_planned
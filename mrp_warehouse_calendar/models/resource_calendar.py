@@ -0,0 +1,103 @@
+# Copyright 2019 Eficent Business and IT Consulting Services, S.L.
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from odoo import api, fields, models, tools
+
+# Horizon of the working day index, in days before and after today.
+WORKING_DAY_INDEX_PAST = 366
+WORKING_DAY_INDEX_FUTURE = 3 * 366
+
+
+class ResourceCalendar(models.Model):
+    _inherit = 'resource.calendar'
+
+    @api.model
+    @tools.ormcache('calendar_id', 'start')
+    def _get_working_day_index(self, calendar_id, start):
+        """Working days of a calendar over the index horizon beginning on
+        the ``start`` ordinal. Returns the working days, as their ordinal
+        with the hours their attendances start and end, and for every day
+        of the horizon the number of working days before it, so that
+        planning is a lookup in both."""
+        calendar = self.browse(calendar_id)
+        attendances = [(
+            int(attendance.dayofweek),
+            fields.Date.from_string(attendance.date_from),
+            fields.Date.from_string(attendance.date_to),
+            attendance.hour_from,
+            attendance.hour_to,
+        ) for attendance in calendar.attendance_ids]
+        working_days = []
+        rank = []
+        for ordinal in range(start, start + WORKING_DAY_INDEX_PAST +
+                             WORKING_DAY_INDEX_FUTURE + 1):
+            rank.append(len(working_days))
+            day = date.fromordinal(ordinal)
+            hours = [(hour_from, hour_to) for (
+                dayofweek, date_from, date_to, hour_from, hour_to,
+            ) in attendances if dayofweek == day.weekday() and
+                (not date_from or date_from <= day) and
+                (not date_to or date_to >= day)]
+            if hours:
+                working_days.append((
+                    ordinal,
+                    min(hour_from for hour_from, __ in hours),
+                    max(hour_to for __, hour_to in hours),
+                ))
+        rank.append(len(working_days))
+        return tuple(working_days), tuple(rank)
+
+    @api.multi
+    def plan_working_days(self, days, day_dt):
+        """Counterpart of ``plan_days(days, day_dt)`` looking the date up in
+        the working day index of the calendar. Like ``plan_days``, the days
+        are counted in the timezone of the user, the day of ``day_dt``
+        included, and the end of the last working day planned is returned
+        when planning forward, its start when planning backward. Leaves are
+        not taken into account. Falls back to ``plan_days`` for fractional
+        days and out of the index horizon."""
+        self.ensure_one()
+        if days and days == int(days):
+            days = int(days)
+            tz = pytz.timezone(
+                self._context.get('tz') or self.env.user.tz or 'UTC')
+            local_day = pytz.utc.localize(
+                day_dt.replace(tzinfo=None)).astimezone(tz).date()
+            start = date.today().toordinal() - WORKING_DAY_INDEX_PAST
+            working_days, rank = self._get_working_day_index(self.id, start)
+            offset = local_day.toordinal() - start
+            if 0 <= offset < len(rank) - 1:
+                if days > 0:
+                    position = rank[offset] + days - 1
+                else:
+                    position = rank[offset + 1] + days
+                if 0 <= position < len(working_days):
+                    ordinal, hour_from, hour_to = working_days[position]
+                    local_dt = datetime.fromordinal(ordinal) + timedelta(
+                        hours=hour_to if days > 0 else hour_from)
+                    return tz.localize(local_dt, is_dst=False).astimezone(
+                        pytz.utc).replace(tzinfo=None)
+        return self.plan_days(days, day_dt)
+
+
+class ResourceCalendarAttendance(models.Model):
+    _inherit = 'resource.calendar.attendance'
+
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(ResourceCalendarAttendance, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        return super(ResourceCalendarAttendance, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(ResourceCalendarAttendance, self).unlink()
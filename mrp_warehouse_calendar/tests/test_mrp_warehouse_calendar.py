@@ -1,5 +1,9 @@
 # Copyright 2018 Eficent Business and IT Consulting Services, S.L.
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl.html).
+from datetime import datetime, timedelta
+
+import pytz
+
 from odoo import fields
 from odoo.tests.common import TransactionCase
 
@@ -85,3 +89,58 @@ class TestMrpWarehouseCalendar(TransactionCase):
             mo.date_planned_finished).date()
         monday = fields.Datetime.from_string('2097-01-07 09:00:00').date()
         self.assertEqual(date_plan_finished, monday)
+
+    def test_plan_working_days(self):
+        today = fields.Datetime.from_string(fields.Date.today())
+        calendar_utc = self.calendar.with_context(tz='UTC')
+        # Same dates than plan_days inside the horizon of the index, for
+        # every day of the week:
+        for shift in range(-7, 21):
+            day_dt = today + timedelta(days=shift)
+            for days in (-10, -2, -1, 1, 2, 10):
+                self.assertEqual(
+                    calendar_utc.plan_working_days(days, day_dt).date(),
+                    calendar_utc.plan_days(days, day_dt).date())
+        # The index is refreshed when the attendances change:
+        date_planned = calendar_utc.plan_working_days(-2, today)
+        self.calendar.attendance_ids.filtered(
+            lambda a: a.dayofweek == str(date_planned.weekday())).unlink()
+        self.assertNotEqual(
+            calendar_utc.plan_working_days(-2, today).date(),
+            date_planned.date())
+
+    def test_plan_working_days_timezone(self):
+        tz = pytz.timezone('Europe/Brussels')
+        calendar_brussels = self.calendar.with_context(tz=tz.zone)
+        today = fields.Date.from_string(fields.Date.today())
+        monday = today + timedelta(days=7 - today.weekday())
+        # Monday 23:30 UTC is already Tuesday in Brussels: Tuesday is the
+        # first day planned backward, Monday the second one.
+        day_dt = datetime.combine(monday, datetime.min.time()) + timedelta(
+            hours=23, minutes=30)
+        date_planned = calendar_brussels.plan_working_days(-2, day_dt)
+        self.assertEqual(
+            date_planned.date(),
+            calendar_brussels.plan_days(-2, day_dt).date())
+        hour_from = min(self.calendar.attendance_ids.filtered(
+            lambda a: a.dayofweek == '0').mapped('hour_from'))
+        self.assertEqual(
+            date_planned,
+            tz.localize(datetime.combine(monday, datetime.min.time()) +
+                        timedelta(hours=hour_from)).astimezone(
+                pytz.utc).replace(tzinfo=None))
+        # In UTC, the same date is a Monday and the Friday before is
+        # planned:
+        self.assertEqual(
+            self.calendar.with_context(tz='UTC').plan_working_days(
+                -2, day_dt).date(),
+            monday - timedelta(days=3))
+        # Planning forward returns the end of the working day:
+        hour_to = max(self.calendar.attendance_ids.filtered(
+            lambda a: a.dayofweek == '2').mapped('hour_to'))
+        self.assertEqual(
+            calendar_brussels.plan_working_days(2, day_dt),
+            tz.localize(datetime.combine(monday + timedelta(days=2),
+                                         datetime.min.time()) +
+                        timedelta(hours=hour_to)).astimezone(
+                pytz.utc).replace(tzinfo=None))